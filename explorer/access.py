@@ -0,0 +1,50 @@
+"""
+Who may see an analysis job, run or upload.
+
+Results belong to whoever uploaded them: the signed-in user, and in any case
+the browser session that uploaded, identified by a random owner key kept in
+the session and recorded on the job and its run. Lookups by ID from a
+request go through owned(), so a run or job UUID alone (from a shared link
+or a log line) gives no access to someone else's results.
+"""
+import uuid
+
+from django.db.models import Q
+
+SESSION_KEY = 'owner_key'
+
+
+def owner_key(request):
+    """This session's owner key, created on first use; recorded on what the session uploads."""
+    key = request.session.get(SESSION_KEY)
+    if not key:
+        key = request.session[SESSION_KEY] = uuid.uuid4().hex
+    return key
+
+
+async def aowner_key(request):
+    """owner_key() for async views."""
+    key = await request.session.aget(SESSION_KEY)
+    if not key:
+        key = uuid.uuid4().hex
+        await request.session.aset(SESSION_KEY, key)
+    return key
+
+
+def _mine(user, key):
+    mine = Q(pk__in=[])
+    if key:
+        mine |= Q(owner_key=key)
+    if user.is_authenticated:
+        mine |= Q(user=user)
+    return mine
+
+
+def owned(queryset, request):
+    """``queryset`` narrowed to the rows the request's user or session owns."""
+    return queryset.filter(_mine(request.user, request.session.get(SESSION_KEY)))
+
+
+async def aowned(queryset, request):
+    """owned() for async views."""
+    return queryset.filter(_mine(await request.auser(), await request.session.aget(SESSION_KEY)))
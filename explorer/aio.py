@@ -0,0 +1,58 @@
+"""
+Blocking work for the async views (explorer.async_views, used under ASGI).
+
+One ASGI process serves every connection on a single event loop, so nothing
+that blocks may run on it. File I/O (parsing and saving uploads, reading
+stored files) and loading stored results run in a dedicated pool of
+NIKA_IO_WORKERS threads. Analysis itself goes to the job executor (see
+explorer.jobs) and PDF rendering to the report executor (explorer.reports).
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+# Bytes read per chunk when streaming a stored file
+FILE_CHUNK_SIZE = 256 * 1024
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_io_executor():
+    """Process-wide pool for blocking I/O of the async views, created on first use."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'NIKA_IO_WORKERS', 8), thread_name_prefix='nika-io'
+            )
+    return _executor
+
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking call in the I/O pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def iterate(iterable):
+    """Async iterator over a blocking iterable, each step taken in the I/O pool."""
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await run_io(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def iter_file(handle, chunk_size=FILE_CHUNK_SIZE):
+    """Async iterator over the bytes of an open file, read in the I/O pool."""
+    while True:
+        chunk = await run_io(handle.read, chunk_size)
+        if not chunk:
+            return
+        yield chunk
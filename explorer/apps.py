@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ExplorerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'explorer'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connects the run file cleanup and job recovery)
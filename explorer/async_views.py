@@ -0,0 +1,291 @@
+"""
+Async versions of the upload, dashboard, job status, report, export and plot views,
+routed instead of the sync ones when NIKA_ASYNC_VIEWS is on (nika/asgi.py
+turns it on).
+
+Under ASGI every sync view runs in one shared thread, so a slow upload save,
+a report render being waited for or a large download would hold up every
+other request of the process. Here the event loop only awaits: session and
+ORM work uses Django's async APIs, file I/O and result loading run in the
+I/O pool (explorer.aio), analysis in the job executor and reports in the
+report executor. Downloads are sent through async iterators, as ASGI would
+otherwise read a sync stream into memory before sending it.
+"""
+import asyncio
+import logging
+from concurrent.futures.process import BrokenProcessPool
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+
+from .aio import iter_file, iterate, run_io
+from .forms import CSVUploadForm, ImageUploadForm, VIDEO_EXTENSIONS
+from .lazy import lazy_import
+from .models import AnalysisJob, AnalysisRun
+from . import access, http_cache, jobs, report_view, reports, upload_view, uploads, views
+
+plotting_utils = lazy_import('explorer.plotting_utils')
+
+logger = logging.getLogger(__name__)
+
+
+async def _upload_user(request):
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def _bound_form(form_class, request):
+    # Reading request.POST/FILES parses the multipart body, spooling large files to disk
+    form = form_class(request.POST, request.FILES)
+    form.is_valid()
+    return form
+
+
+async def _track_job(request, job):
+    pending = await request.session.aget('pending_jobs', {})
+    pending[job.kind] = str(job.id)
+    await request.session.aset('pending_jobs', pending)
+
+
+async def _queued_response(request, job, message):
+    """views._queued_response() with the session read and written through its async API."""
+    await _track_job(request, job)
+
+    if views._is_ajax(request):
+        return JsonResponse(views._job_json(job), status=202)
+    messages.info(request, message)
+    return redirect('dashboard')
+
+
+async def _session_run(request, slot):
+    run_id = await request.session.aget(f'{slot}_run')
+    return await AnalysisRun.objects.filter(pk=run_id).afirst() if run_id else None
+
+
+async def _load(run):
+    # The dashboard's runs come without their result, which is read here
+    return await run_io(_in_pool, run.load) if run is not None else None
+
+
+async def dashboard(request):
+    # Session bookkeeping and rendering touch the session, user and messages synchronously
+    csv_run, image_run, pending_jobs = await sync_to_async(views._dashboard_runs)(request)
+    etag = await sync_to_async(views._dashboard_etag)(request, csv_run, image_run, pending_jobs)
+    if etag is not None:
+        not_modified = http_cache.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+    csv_results, image_results = await asyncio.gather(_load(csv_run), _load(image_run))
+    response = await sync_to_async(views._render_dashboard)(request, csv_results, image_results, pending_jobs)
+    if etag is not None:
+        http_cache.validate(response, etag, per_session=True)
+    return response
+
+
+async def upload_csv(request):
+    """
+    Handle CSV file upload: queue the ML analysis and return at once.
+    """
+    if request.method != 'POST':
+        return redirect('dashboard')
+
+    form = await run_io(_bound_form, CSVUploadForm, request)
+    if not form.is_valid():
+        return views._invalid_form(request, form)
+    csv_file = form.cleaned_data['csv_file']
+
+    try:
+        job = await jobs.aenqueue(
+            'csv', csv_file, user=await _upload_user(request),
+            content_hash=uploads.content_hash(request, 'csv_file'), owner_key=await access.aowner_key(request)
+        )
+        return await _queued_response(request, job, f'CSV file "{csv_file.name}" queued for analysis.')
+    except Exception as e:
+        messages.error(request, f'Error processing CSV file: {str(e)}')
+        return redirect('dashboard')
+
+
+async def upload_image(request):
+    """
+    Handle image file upload: store it and queue mineral anomaly detection.
+    """
+    from django.core.files.storage import default_storage
+
+    if request.method != 'POST':
+        return redirect('dashboard')
+
+    form = await run_io(_bound_form, ImageUploadForm, request)
+    if not form.is_valid():
+        return views._invalid_form(request, form)
+    image_file = form.cleaned_data['image_file']
+
+    try:
+        file_path = await run_io(default_storage.save, f"uploads/{image_file.name}", image_file)
+        logger.info(f"🚀 Queueing image processing for: {image_file.name} (size: {image_file.size} bytes)")
+
+        kind = 'video' if image_file.name.lower().endswith(VIDEO_EXTENSIONS) else 'image'
+        job = await jobs.aenqueue(
+            kind, image_file, stored_path=file_path, user=await _upload_user(request),
+            content_hash=uploads.content_hash(request, 'image_file'), owner_key=await access.aowner_key(request)
+        )
+        return await _queued_response(request, job, f'Image file "{image_file.name}" queued for analysis.')
+    except Exception as e:
+        logger.error(f"❌ Error processing image file {image_file.name}: {str(e)}")
+        messages.error(request, f'Error processing image file: {str(e)}')
+        return redirect('dashboard')
+
+
+def _in_pool(func, *args):
+    # I/O pool threads outlive the request, so release their database connection here
+    try:
+        return func(*args)
+    finally:
+        connection.close()
+
+
+async def upload_start(request):
+    """
+    Open a chunked upload.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    return await run_io(_in_pool, upload_view.start_upload, request, await _upload_user(request))
+
+
+async def upload_chunk(request, upload_id):
+    """
+    Report, continue or abandon a chunked upload; the chunk is written and hashed in the I/O pool.
+    """
+    response, job = await run_io(_in_pool, upload_view.handle_chunk, request, upload_id)
+    if job is not None:
+        await _track_job(request, job)
+    return response
+
+
+async def job_status(request, job_id):
+    """
+    Report state, stage and percent complete of an analysis job as JSON.
+    """
+    owned_jobs = await access.aowned(AnalysisJob.objects.all(), request)
+    job = await owned_jobs.filter(pk=job_id).afirst()
+    if job is None:
+        return JsonResponse({'error': 'Unknown job'}, status=404)
+    return JsonResponse(job.to_status())
+
+
+async def serve_report(request, run, full=False):
+    """
+    report_view.serve_report() that awaits the render and streams the PDF from the I/O pool.
+    """
+    etag = reports.report_etag(run, full)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        path = await reports.aget_report(run, full=full)
+    except Exception as e:
+        messages.error(request, f'Error generating report: {str(e)}')
+        return redirect('dashboard')
+
+    if path is None:
+        return report_view._still_rendering(request)
+    response = await run_io(report_view._report_file, run, path, full, etag)
+    response.streaming_content = iter_file(response.file_to_stream)
+    return response
+
+
+async def run_report(request, run_id):
+    """
+    Download the PDF report of a stored run (?full=1 for the full report).
+    """
+    runs = await access.aowned(AnalysisRun.objects.all(), request)
+    run = await runs.filter(pk=run_id).afirst()
+    if run is None:
+        raise Http404('Unknown run')
+    return await serve_report(request, run, report_view._wants_full(request))
+
+
+async def download_report(request):
+    """
+    Download the PDF report of the CSV (?type=csv) or image (?type=image) run the session shows
+    (?full=1 for the full report).
+    """
+    slot = 'image' if request.GET.get('type', 'csv') == 'image' else 'csv'
+    run = await _session_run(request, slot)
+    if run is None:
+        label = 'image' if slot == 'image' else 'CSV'
+        messages.error(request, f'No {label} analysis results found. Please upload and analyze a file first.')
+        return redirect('dashboard')
+
+    return await serve_report(request, run, report_view._wants_full(request))
+
+
+async def download_image_report(request):
+    """
+    Download the PDF report of the image run the session shows.
+    """
+    if request.method != 'POST':
+        return redirect('dashboard')
+    run = await _session_run(request, 'image')
+    if run is None:
+        messages.error(request, 'No image analysis results found. Please upload and analyze an image first.')
+        return redirect('dashboard')
+    return await serve_report(request, run)
+
+
+async def export_results(request, run_id):
+    """
+    Stream the full anomaly table of a CSV run, or every row's score, as a download.
+
+    Query parameters: format (csv, json, jsonl, excel), table (anomalies, scores), limit.
+    Chunks are encoded in the I/O pool as the client reads them.
+    """
+    options = views._export_options(request)
+    if isinstance(options, HttpResponse):
+        return options
+
+    runs = await access.aowned(AnalysisRun.objects.defer('data'), request)
+    run = await runs.filter(pk=run_id, kind='csv').afirst()
+    if run is None:
+        raise Http404('Unknown run')
+    not_modified = http_cache.not_modified(request, views._export_etag(run, *options), run.created_at)
+    if not_modified is not None:
+        return not_modified
+    response = await run_io(_in_pool, views._export_response, run, *options)
+    response.streaming_content = iterate(response.streaming_content)
+    return response
+
+
+async def plot_image(request, kind, run_id, name):
+    """
+    One server-rendered plot of a stored run as PNG; the render in the plot workers
+    is awaited for at most NIKA_PLOTS['wait_seconds'], then the client is told to retry.
+    """
+    if name not in plotting_utils.PLOT_SETS.get(kind, {}):
+        raise Http404('Unknown plot')
+    runs = await access.aowned(AnalysisRun.objects.defer('data'), request)
+    run = await runs.filter(pk=run_id).afirst()
+    if run is None or ('image' if run.kind == 'video' else run.kind) != kind:
+        raise Http404('Unknown run')
+    etag = http_cache.etag('plot', kind, run.id, name)
+    not_modified = http_cache.not_modified(request, etag, run.created_at)
+    if not_modified is not None:
+        return not_modified
+
+    png = await run_io(plotting_utils.cached_plot, kind, name, run.id)
+    if png is None:
+        future = await run_io(_in_pool, plotting_utils.schedule, kind, name, run.id, run.load)
+        wait = getattr(settings, 'NIKA_PLOTS', {}).get('wait_seconds', 5)
+        try:
+            # shield: a timed-out wait must not cancel the render
+            png = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), wait)
+        except (asyncio.TimeoutError, BrokenProcessPool):
+            png = None
+    return views._plot_response(png, etag, run)
@@ -0,0 +1,142 @@
+"""
+Pre-aggregated series behind the dashboard charts.
+
+The browser renders these with Chart.js; each chart is a small dict:
+    {'type': 'bar'|'line'|'pie'|'radar', 'labels': [...],
+     'datasets': [{'label': str, 'data': [...], 'color': str | [str, ...]}],
+     'y_max': optional axis limit, 'annotation': optional extra value}
+Charts with no data are left out.
+"""
+from datetime import datetime
+
+import numpy as np
+
+SEVERITY_COLORS = {'Critical': '#dc2626', 'High': '#ea580c', 'Medium': '#ca8a04', 'Low': '#65a30d'}
+ZONE_COLORS = ['#e11d48', '#059669', '#dc2626', '#7c3aed', '#ea580c']
+AREA_COLORS = ['#ef4444', '#10b981', '#3b82f6']
+
+
+def anomaly_chart_data(results):
+    """
+    Chart series for CSV anomaly detection results.
+
+    Args:
+        results: Results dictionary from process_csv
+
+    Returns:
+        dict: severity_distribution, confidence_distribution, performance_comparison, timeline
+    """
+    charts = {}
+    anomalies = results.get('anomalies', [])
+
+    if anomalies:
+        # 1. Anomaly Severity Distribution (most frequent first)
+        severities = {}
+        for a in anomalies:
+            severity = a.get('severity', 'Unknown')
+            severities[severity] = severities.get(severity, 0) + 1
+        labels = sorted(severities, key=severities.get, reverse=True)
+        charts['severity_distribution'] = {
+            'type': 'bar',
+            'labels': labels,
+            'datasets': [{
+                'label': 'Number of Anomalies',
+                'data': [severities[s] for s in labels],
+                'color': [SEVERITY_COLORS.get(s, '#6b7280') for s in labels],
+            }],
+        }
+
+        # 2. Confidence Score Distribution (10 bins, as the histogram had)
+        confidences = np.array([a.get('confidence', 0) for a in anomalies], dtype=float)
+        counts, edges = np.histogram(confidences, bins=10)
+        charts['confidence_distribution'] = {
+            'type': 'bar',
+            'labels': [f'{(lo + hi) / 2:.3f}' for lo, hi in zip(edges[:-1], edges[1:])],
+            'datasets': [{'label': 'Frequency', 'data': counts.tolist(), 'color': '#3b82f6'}],
+            'annotation': {'label': 'Mean', 'value': round(float(confidences.mean()), 3)},
+        }
+
+        # 4. Anomaly Timeline (by hour of day)
+        hours = np.zeros(24, dtype=int)
+        for a in anomalies:
+            try:
+                hours[datetime.strptime(a.get('timestamp', ''), '%Y-%m-%d %H:%M:%S').hour] += 1
+            except (TypeError, ValueError):
+                continue
+        if hours.any():
+            charts['timeline'] = {
+                'type': 'line',
+                'labels': list(range(24)),
+                'datasets': [{'label': 'Number of Anomalies', 'data': hours.tolist(), 'color': '#3b82f6'}],
+            }
+
+    # 3. Performance Comparison
+    metrics = results.get('metrics', {})
+    baseline = metrics.get('baseline_metrics', {})
+    nika = metrics.get('nika_metrics', {})
+    if baseline and nika:
+        keys = ['precision', 'recall', 'f1_score', 'accuracy']
+        charts['performance_comparison'] = {
+            'type': 'bar',
+            'labels': ['Precision', 'Recall', 'F1-Score', 'Accuracy'],
+            'datasets': [
+                {'label': 'Baseline', 'data': [round(baseline.get(k, 0), 3) for k in keys], 'color': '#ef4444'},
+                {'label': 'NIKA ML', 'data': [round(nika.get(k, 0), 3) for k in keys], 'color': '#10b981'},
+            ],
+            'y_max': 1,
+        }
+
+    return charts
+
+
+def image_chart_data(results):
+    """
+    Chart series for image analysis results.
+
+    Args:
+        results: Results dictionary from process_image
+
+    Returns:
+        dict: mineral_confidence, area_distribution, ml_metrics_radar
+    """
+    charts = {}
+    zones = results.get('anomaly_zones', [])
+
+    if zones:
+        # 1. Confidence by Mineral Type
+        charts['mineral_confidence'] = {
+            'type': 'bar',
+            'labels': [z.get('mineral_type', 'Unknown') for z in zones],
+            'datasets': [{
+                'label': 'Confidence Score',
+                'data': [z.get('confidence', 0) for z in zones],
+                'color': ZONE_COLORS[:len(zones)],
+            }],
+        }
+
+        # 2. Zone Area Distribution
+        charts['area_distribution'] = {
+            'type': 'pie',
+            'labels': [z.get('name', 'Zone') for z in zones],
+            'datasets': [{
+                'label': 'Area (px)',
+                'data': [z.get('bounding_box', {}).get('width', 0) * z.get('bounding_box', {}).get('height', 0) for z in zones],
+                'color': [AREA_COLORS[i % len(AREA_COLORS)] for i in range(len(zones))],
+            }],
+        }
+
+    # 3. ML Metrics Radar Chart
+    detection = results.get('analysis_results', {}).get('detection_metrics', {})
+    if detection:
+        charts['ml_metrics_radar'] = {
+            'type': 'radar',
+            'labels': ['Sensitivity', 'Specificity', 'Precision'],
+            'datasets': [{
+                'label': 'ML Detection Metrics',
+                'data': [detection.get(k, 0) for k in ('sensitivity', 'specificity', 'precision')],
+                'color': '#3b82f6',
+            }],
+            'y_max': 1,
+        }
+
+    return charts
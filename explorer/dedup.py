@@ -0,0 +1,152 @@
+"""
+Duplicate detection for uploads.
+
+Every upload records the SHA-256 of its bytes (computed as they arrive, see
+explorer.uploads), so a byte-identical re-upload of any kind reuses the
+earlier result without reading the file again.
+
+Every finished SAM image analysis stores a 64-bit perceptual hash on its
+AnalysisJob. Each process keeps those hashes in a multi-index hash table, topped up from the
+database as other workers finish jobs. A new upload within
+NIKA_NEAR_DUPLICATES['max_distance'] bits of an earlier one by the same
+uploader warm-starts SAM from that image's zones (a few prompts instead of
+the full point grid); boxes, overlay and mineral map are still its own.
+"""
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import AnalysisJob
+
+pipeline_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'nika_pipeline', 'content')
+if pipeline_path not in sys.path:
+    sys.path.append(pipeline_path)
+
+from phash import MultiIndexHash, phash, to_signed, to_unsigned  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+_index = None
+_synced_at = None
+_seen = set()
+_sync_lock = threading.Lock()
+
+
+def _options():
+    return getattr(settings, 'NIKA_NEAR_DUPLICATES', {})
+
+
+def _sync():
+    """Add hashes of jobs finished since the last lookup (by any process) to the index."""
+    global _index, _synced_at
+    with _sync_lock:
+        if _index is None:
+            _index = MultiIndexHash(_options().get('max_distance', 10))
+        rows = AnalysisJob.objects.filter(kind='image', status=AnalysisJob.DONE, phash__isnull=False)
+        if _synced_at is not None:
+            rows = rows.filter(finished_at__gte=_synced_at)
+        for job_id, h, finished_at in rows.order_by('finished_at').values_list('pk', 'phash', 'finished_at'):
+            if job_id not in _seen:
+                _seen.add(job_id)
+                _index.add(to_unsigned(h), job_id)
+            _synced_at = finished_at
+
+
+def fingerprint(img_rgb):
+    """Perceptual hash of a decoded image, as stored on AnalysisJob.phash."""
+    return to_signed(phash(img_rgb))
+
+
+def find_near_duplicate(h, user_id=None, owner_key=''):
+    """
+    Nearest finished image job of the same uploader within the configured Hamming distance.
+
+    Args:
+        h: fingerprint() of the new image
+        user_id: Uploading user, if signed in
+        owner_key: Uploading session's key (see explorer.access)
+
+    Returns:
+        tuple: (AnalysisJob, distance), or None
+    """
+    options = _options()
+    if not options.get('enabled', True) or not (user_id or owner_key):
+        return None
+    uploader = Q(user_id=user_id) if user_id else Q(owner_key=owner_key)
+    _sync()
+    for distance, job_id in _index.search(to_unsigned(h), options.get('max_distance', 10)):
+        job = AnalysisJob.objects.filter(
+            uploader, pk=job_id, status=AnalysisJob.DONE, run__isnull=False
+        ).select_related('run').first()
+        if job is not None:
+            return job, distance
+    return None
+
+
+def find_identical(kind, content_hash, user_id=None, owner_key=''):
+    """Latest finished job of the same uploader and kind whose upload had exactly these bytes, or None."""
+    options = getattr(settings, 'NIKA_EXACT_DUPLICATES', {})
+    if not content_hash or not options.get('enabled', True) or not (user_id or owner_key):
+        return None
+    uploader = Q(user_id=user_id) if user_id else Q(owner_key=owner_key)
+    return AnalysisJob.objects.filter(
+        uploader, kind=kind, content_hash=content_hash, status=AnalysisJob.DONE, run__isnull=False
+    ).select_related('run').order_by('-finished_at').first()
+
+
+def reuse_identical(job, filename, size_bytes, stored_path):
+    """
+    The identical earlier job's result relabelled for the new upload.
+
+    A CSV result keeps the earlier run's scores_path: both runs share the file,
+    which is deleted with the last run that refers to it (explorer.signals).
+    """
+    result = job.run.load()
+    if job.kind != 'csv':
+        result['original_image_path'] = stored_path
+    result['file_info'] = {
+        **result.get('file_info', {}),
+        'filename': filename,
+        'size_bytes': size_bytes,
+        'processed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    result['duplicate_of'] = {'job_id': str(job.pk), 'filename': job.original_name}
+    logger.info(f"♻️ {filename} is identical to {job.original_name}, reusing its result")
+    return result
+
+
+def warm_start_points(job, shape):
+    """
+    Centres of an earlier job's zones, scaled to an image of ``shape`` (H, W), as SAM prompts.
+
+    A near-duplicate is re-framed or re-exposed, so the zones are only where to
+    look: the new image is segmented at these points and everything spatial in
+    its result (boxes, overlay, mineral map) comes from its own pixels.
+    """
+    result = job.run.load()
+    height, width = shape[:2]
+    try:
+        old_width, old_height = (
+            int(v) for v in result['analysis_results']['image_quality']['resolution'].split('x')
+        )
+    except (KeyError, TypeError, ValueError):
+        old_width, old_height = width, height
+    points = []
+    for zone in result.get('anomaly_zones', []):
+        center = zone.get('center_coordinates') or {}
+        if 'x' in center and 'y' in center:
+            points.append((
+                min(max(center['x'] * width / old_width, 0), width - 1),
+                min(max(center['y'] * height / old_height, 0), height - 1),
+            ))
+    return points
+
+
+def near_duplicate_info(job, distance):
+    """What a result analysed with warm_start_points() records about the image it started from."""
+    return {'job_id': str(job.pk), 'filename': job.original_name, 'hamming_distance': distance}
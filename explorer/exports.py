@@ -0,0 +1,372 @@
+"""
+Streaming exports of stored analysis results.
+
+Every writer here is a generator of bytes chunks for StreamingHttpResponse.
+Rows are pulled from a row generator and written a batch at a time, so the
+download starts at once and the writers' memory does not grow with the
+number of rows. Per-row scores are kept in a gzipped CSV next to the run
+(write_scores) and read back line by line, for the score table and for the
+anomaly table (the rows flagged in it), so neither loads the stored result.
+"""
+import csv
+import gzip
+import io
+import json
+import math
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+# Rows encoded per yielded chunk
+BATCH_ROWS = 1000
+# Excel's row limit per worksheet (header included); longer tables continue on a new sheet
+XLSX_MAX_ROWS = 1048576
+
+# Leading columns of the anomaly table; the anomaly's data_values follow
+ANOMALY_FIELDS = [
+    'id', 'row_index', 'type', 'severity', 'confidence', 'anomaly_score',
+    'baseline_score', 'nika_score', 'timestamp', 'description', 'affected_columns',
+]
+
+FORMATS = {
+    # format: (content type, file extension)
+    'csv': ('text/csv', 'csv'),
+    'json': ('application/json', 'json'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'excel': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+
+# Anomalies the IsolationForest flags in a CSV
+
+ML_ANOMALY_TYPE = 'Statistical Outlier (ML)'
+
+
+def severity_from_score(score):
+    """Severity level of an anomaly score."""
+    abs_score = abs(score)
+    if abs_score > 0.5:
+        return 'Critical'
+    elif abs_score > 0.3:
+        return 'High'
+    elif abs_score > 0.1:
+        return 'Medium'
+    else:
+        return 'Low'
+
+
+def ml_anomaly(row_index, score, values, timestamp):
+    """The anomaly record of a flagged row; ``values`` maps each scored column to the row's value."""
+    return {
+        'id': f'anomaly_{row_index + 1}',
+        'type': ML_ANOMALY_TYPE,
+        'severity': severity_from_score(score),
+        'confidence': abs(score),
+        'row_index': row_index,
+        'timestamp': timestamp,
+        'affected_columns': list(values),
+        'description': f'ML-detected anomaly in row {row_index + 1}',
+        'anomaly_score': score,
+        'data_values': values,
+    }
+
+
+# Tables: (header, row generator) of a CSV analysis run
+
+def anomaly_table(run):
+    """
+    The run's anomalies, one row each, with their data values as extra columns.
+
+    The rows flagged in the scores file are rebuilt with ml_anomaly() as they
+    are read, stamped with the run's creation time, so memory stays flat
+    however many rows were flagged. Runs without a scores file (the rule-based
+    fallback, which flags a handful of rows) are read from the stored result.
+    """
+    scores = score_table(run)
+    if scores is None:
+        return _anomaly_rows(run.load().get('anomalies', []))
+    header, rows = scores
+    value_columns = header[3:]
+    timestamp = timezone.localtime(run.created_at).strftime('%Y-%m-%d %H:%M:%S')
+    anomalies = (
+        ml_anomaly(row_index, score, dict(zip(value_columns, values)), timestamp)
+        for row_index, score, is_anomaly, *values in rows if is_anomaly
+    )
+    return _anomaly_rows(anomalies, value_columns)
+
+
+def _anomaly_rows(anomalies, value_columns=None):
+    if value_columns is None:
+        value_columns = list(anomalies[0].get('data_values', {})) if anomalies else []
+
+    def rows():
+        for anomaly in anomalies:
+            values = anomaly.get('data_values', {})
+            row = [anomaly.get(field) for field in ANOMALY_FIELDS]
+            row[ANOMALY_FIELDS.index('affected_columns')] = ';'.join(anomaly.get('affected_columns', []))
+            yield row + [values.get(column) for column in value_columns]
+
+    return ANOMALY_FIELDS + value_columns, rows()
+
+
+def score_table(run):
+    """
+    Every input row with its anomaly score, read line by line from the run's scores file.
+
+    Returns:
+        tuple: (header, row generator), or None if the analysis stored no per-row scores
+    """
+    path = run.scores_path
+    if not path or not default_storage.exists(path):
+        return None
+    handle = default_storage.open(path, 'rb')
+    reader = csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=handle), encoding='utf-8', newline=''))
+    header = next(reader, [])
+
+    def rows():
+        try:
+            for row in reader:
+                yield [_parse_number(value) for value in row]
+        finally:
+            handle.close()
+
+    return header, rows()
+
+
+def _parse_number(value):
+    if value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def write_scores(path, row_index, scores, is_anomaly, values):
+    """
+    Store per-row anomaly scores as gzipped CSV for score_table() and anomaly_table().
+
+    Args:
+        path: Storage path, e.g. 'scores/<key>.csv.gz'
+        row_index, scores, is_anomaly: Equal-length sequences
+        values: DataFrame of the scored feature columns, in row order
+
+    Returns:
+        str: The path saved to
+    """
+    import tempfile
+    from django.core.files.base import File
+
+    with tempfile.TemporaryFile() as tmp:
+        with gzip.GzipFile(fileobj=tmp, mode='wb') as gz:
+            text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(['row_index', 'anomaly_score', 'is_anomaly'] + [str(c) for c in values.columns])
+            for start in range(0, len(values), BATCH_ROWS):
+                stop = start + BATCH_ROWS
+                writer.writerows(
+                    [i, s, int(a), *v] for i, s, a, v in zip(
+                        row_index[start:stop], scores[start:stop], is_anomaly[start:stop],
+                        values.iloc[start:stop].itertuples(index=False, name=None),
+                    )
+                )
+            text.flush()
+            text.detach()
+        tmp.seek(0)
+        return default_storage.save(path, File(tmp))
+
+
+# Writers: (header, rows) -> generator of bytes
+
+def stream_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for n, row in enumerate(rows, 1):
+        writer.writerow(['' if value is None else value for value in row])
+        if n % BATCH_ROWS == 0:
+            yield _drain(buffer).encode('utf-8')
+    yield _drain(buffer).encode('utf-8')
+
+
+def _json_batches(header, rows):
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(dict(zip(header, map(_json_value, row))), default=str))
+        if len(batch) == BATCH_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_jsonl(header, rows):
+    for batch in _json_batches(header, rows):
+        yield ('\n'.join(batch) + '\n').encode('utf-8')
+
+
+def stream_json(header, rows):
+    """A JSON array of row objects, written element by element."""
+    yield b'['
+    separator = ''
+    for batch in _json_batches(header, rows):
+        yield (separator + ','.join(batch)).encode('utf-8')
+        separator = ','
+    yield b']'
+
+
+def _json_value(value):
+    # NaN/inf are not valid JSON
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable stream that collects zip output until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Characters XML 1.0 does not allow, even escaped
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _xlsx_cell(value):
+    if value is None or (isinstance(value, float) and not math.isfinite(value)):
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, int):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, float):
+        return f'<c><v>{float(value)!r}</v></c>'
+    text = escape(_XML_ILLEGAL.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(map(_xlsx_cell, values)) + '</row>'
+
+
+def stream_xlsx(header, rows, sheet_name='Sheet'):
+    """
+    An .xlsx workbook written as a streamed zip: each worksheet is deflated row
+    by row (inline strings, no shared string table to hold in memory), and the
+    workbook parts that list the sheets are written last.
+    """
+    sink = _ChunkSink()
+    archive = zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED)
+    sheets = 0
+    rows = iter(rows)
+    header_xml = _xlsx_row(header)
+    end = object()
+    row = next(rows, end)
+    while True:
+        sheets += 1
+        with archive.open(f'xl/worksheets/sheet{sheets}.xml', mode='w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(header_xml.encode('utf-8'))
+            written, batch = 1, []
+            while row is not end and written < XLSX_MAX_ROWS:
+                batch.append(_xlsx_row(row))
+                written += 1
+                if len(batch) == BATCH_ROWS:
+                    sheet.write(''.join(batch).encode('utf-8'))
+                    batch = []
+                    yield sink.drain()
+                row = next(rows, end)
+            sheet.write((''.join(batch) + '</sheetData></worksheet>').encode('utf-8'))
+        yield sink.drain()
+        # A new sheet only for a row that did not fit on this one
+        if row is end:
+            break
+
+    names = [sheet_name[:31]] + [f'{sheet_name[:26]} ({n})' for n in range(2, sheets + 1)]
+    archive.writestr('xl/workbook.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+        + ''.join(f'<sheet name="{escape(name)}" sheetId="{n}" r:id="rId{n}"/>' for n, name in enumerate(names, 1))
+        + '</sheets></workbook>'
+    ))
+    archive.writestr('xl/_rels/workbook.xml.rels', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        + ''.join(
+            f'<Relationship Id="rId{n}" Target="worksheets/sheet{n}.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+            for n in range(1, sheets + 1)
+        )
+        + '</Relationships>'
+    ))
+    archive.writestr('_rels/.rels', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ))
+    archive.writestr('[Content_Types].xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        + ''.join(
+            f'<Override PartName="/xl/worksheets/sheet{n}.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for n in range(1, sheets + 1)
+        )
+        + '</Types>'
+    ))
+    archive.close()
+    yield sink.drain()
+
+
+def stream_table(fmt, header, rows, sheet_name='Sheet'):
+    """Bytes chunks of the table in one of FORMATS."""
+    if fmt == 'csv':
+        return stream_csv(header, rows)
+    if fmt == 'jsonl':
+        return stream_jsonl(header, rows)
+    if fmt == 'json':
+        return stream_json(header, rows)
+    if fmt == 'excel':
+        return stream_xlsx(header, rows, sheet_name)
+    raise ValueError(f"Unknown export format: {fmt}")
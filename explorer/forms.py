@@ -1,5 +1,9 @@
 from django import forms
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg', '.tif', '.tiff')
+# Inspection footage accepted by the image upload, analysed on scene keyframes
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v')
+
 class CSVUploadForm(forms.Form):
     csv_file = forms.FileField(
         label='CSV File',
@@ -22,18 +26,17 @@ class ImageUploadForm(forms.Form):
     image_file = forms.FileField(
         label='Image File',
         widget=forms.FileInput(attrs={
-            'accept': 'image/*',
+            'accept': 'image/*,video/*,.tif,.tiff',
             'class': 'form-control'
         }),
-        help_text='Upload an image file for analysis'
+        help_text='Upload an image or inspection video for analysis'
     )
     
     def clean_image_file(self):
         image_file = self.cleaned_data.get('image_file')
         if image_file:
             # Check if it's a valid image format
-            valid_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg']
             file_extension = image_file.name.lower().split('.')[-1]
-            if f'.{file_extension}' not in valid_extensions:
+            if f'.{file_extension}' not in IMAGE_EXTENSIONS + VIDEO_EXTENSIONS:
                 raise forms.ValidationError('Please upload a valid image file.')
         return image_file
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""
+HTTP validators for pages and files built from stored runs.
+
+A run's result never changes once stored, so the IDs of the runs a response
+is built from (and the version of its layout) fully determine it. Views
+compute the ETag before loading a result or rendering anything, and answer
+a matching If-None-Match with 304: a refresh costs a few hundred bytes and
+no work on the server. PDF reports get the same from explorer.reports.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views import static
+
+# Bump when the dashboard, chart series or exports change shape; cached copies are then refetched
+PAGE_VERSION = 1
+
+
+def _options():
+    return getattr(settings, 'NIKA_HTTP_CACHE', {})
+
+
+def etag(*parts):
+    """Strong ETag over what identifies a response: run IDs, variants, PAGE_VERSION."""
+    key = '|'.join(str(part) for part in (PAGE_VERSION, *parts))
+    return f'"{hashlib.blake2s(key.encode(), digest_size=12).hexdigest()}"'
+
+
+def not_modified(request, tag, modified=None):
+    """
+    The 304 answer if the client's copy is current, else None.
+
+    Args:
+        request: The GET request
+        tag: etag() of the response
+        modified: Datetime the response last changed, for If-Modified-Since; only for
+            responses addressed by run ID, as a session can point back at an older run
+    """
+    return get_conditional_response(
+        request, etag=tag, last_modified=int(modified.timestamp()) if modified else None
+    )
+
+
+def validate(response, tag, modified=None, max_age=None, per_session=False):
+    """
+    Attach validators to a fresh response.
+
+    Without ``max_age`` clients revalidate on every use (and get 304 while
+    nothing changed); ``per_session`` marks responses that depend on the
+    session cookie, so shared caches do not mix them up.
+    """
+    response['ETag'] = tag
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified.timestamp())
+    if max_age is None:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+    if per_session:
+        patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve for MEDIA_URL (uploads, previews, overlays) that also
+    answers If-None-Match, from the file's modification time and size.
+    """
+    try:
+        stat = os.stat(safe_join(document_root, posixpath.normpath(path).lstrip('/')))
+    except (OSError, ValueError, SuspiciousFileOperation):
+        return static.serve(request, path, document_root, show_indexes)
+    tag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    response = get_conditional_response(request, etag=tag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = static.serve(request, path, document_root, show_indexes)
+    if response.status_code in (200, 304):
+        response['ETag'] = tag
+        patch_cache_control(response, private=True, max_age=_options().get('media_max_age', 3600))
+    return response
@@ -0,0 +1,287 @@
+"""
+Background analysis jobs.
+
+Uploads are stored once, recorded as AnalysisJob rows (the SQLite database is
+the queue) and run by a local worker pool, so requests return immediately.
+The pool holds threads, or spawned processes with NIKA_JOB_EXECUTOR =
+'process' so that analysis never competes with request handling for the
+GIL. A separate `manage.py run_jobs` process can drain the same queue.
+Each running job records the process running it and a heartbeat. After a
+restart, recover() hands the jobs still queued to the new pool and fails the
+running ones whose process is gone (or has stopped reporting in); a job it
+fails is never marked done afterwards.
+"""
+import functools
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+
+from .models import AnalysisJob, AnalysisRun
+from . import reports
+from .utils import process_csv, process_image, process_video
+
+logger = logging.getLogger(__name__)
+
+PROCESSORS = {
+    'csv': process_csv,
+    'image': process_image,
+    'video': process_video,
+}
+
+# Seconds between a running job's heartbeats
+HEARTBEAT_SECONDS = 30
+
+_executor = None
+_executor_lock = threading.Lock()
+# Jobs running in this process
+_running = set()
+
+
+def get_executor():
+    """Process-wide worker pool, or None when jobs are left to `manage.py run_jobs`."""
+    global _executor
+    workers = getattr(settings, 'NIKA_JOB_WORKERS', 2)
+    if not workers:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            if getattr(settings, 'NIKA_JOB_EXECUTOR', 'thread') == 'process':
+                # spawn: forking a web process that runs threads is unsafe. Workers set Django
+                # up before they unpickle a job (importing this module needs the app registry)
+                _executor = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=django.setup,
+                )
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nika-job')
+    return _executor
+
+
+def _submit(job_id):
+    executor = get_executor()
+    if executor is not None:
+        executor.submit(run_job, job_id).add_done_callback(functools.partial(_check_worker, executor, job_id))
+
+
+def _check_worker(executor, job_id, future):
+    """Fail a job whose worker process died (e.g. OOM-killed) and replace the broken pool."""
+    global _executor
+    if future.cancelled() or not isinstance(future.exception(), BrokenProcessPool):
+        return
+    logger.error(f"❌ Worker process of job {job_id} died")
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    try:
+        AnalysisJob.objects.filter(pk=job_id, status__in=[AnalysisJob.QUEUED, AnalysisJob.RUNNING]).update(
+            status=AnalysisJob.FAILED, stage='Failed', error='The analysis worker process died',
+            finished_at=timezone.now()
+        )
+    finally:
+        connection.close()
+
+
+def worker_id():
+    """How a job records the process running it."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _worker_gone(worker, job_id):
+    # Only decidable for processes on this host; others are judged by their heartbeat
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # A restarted container can get its predecessor's pid
+        return job_id not in _running
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def recover(submit=True):
+    """
+    Resume the queue in a freshly started process: submit the QUEUED jobs to the
+    pool (a job another process claims first is skipped) and fail RUNNING jobs
+    whose process has exited, or that sent no heartbeat for NIKA_JOB_STALE_MINUTES.
+
+    Args:
+        submit: Submit queued jobs to this process's pool (`run_jobs` claims them itself)
+
+    Returns:
+        tuple: (jobs submitted, jobs failed)
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(minutes=getattr(settings, 'NIKA_JOB_STALE_MINUTES', 5))
+    lost = [
+        job_id for job_id, worker, heartbeat_at, started_at in AnalysisJob.objects.filter(
+            status=AnalysisJob.RUNNING
+        ).values_list('pk', 'worker', 'heartbeat_at', 'started_at')
+        if (heartbeat_at or started_at or now) < cutoff or _worker_gone(worker, job_id)
+    ]
+    failed = AnalysisJob.objects.filter(pk__in=lost, status=AnalysisJob.RUNNING).update(
+        status=AnalysisJob.FAILED, stage='Failed',
+        error='The analysis was interrupted by a server restart. Please upload the file again.',
+        finished_at=now
+    ) if lost else 0
+    if failed:
+        logger.warning(f"⚠️ Failed {failed} jobs left running by a stopped process")
+    queued = []
+    if submit and get_executor() is not None:
+        queued = list(AnalysisJob.objects.filter(status=AnalysisJob.QUEUED).values_list('pk', flat=True))
+        for job_id in queued:
+            _submit(job_id)
+    if queued:
+        logger.info(f"📥 Resubmitted {len(queued)} queued jobs")
+    return len(queued), failed
+
+
+def enqueue(kind, upload, stored_path=None, user=None, content_hash='', owner_key=''):
+    """
+    Queue an uploaded file for analysis.
+
+    Args:
+        kind: 'csv', 'image' or 'video'
+        upload: Uploaded file
+        stored_path: Storage path if the upload was already saved
+        user: Uploading user, recorded on the job and its run
+        content_hash: SHA-256 of the upload, if known (see explorer.uploads)
+        owner_key: Uploading session's key (see explorer.access), recorded on the job and its run
+
+    Returns:
+        AnalysisJob: The queued job
+    """
+    if stored_path is None:
+        stored_path = default_storage.save(f'jobs/{upload.name}', upload)
+    return enqueue_stored(
+        kind, upload.name, stored_path, user=user, content_hash=content_hash, owner_key=owner_key
+    )
+
+
+def enqueue_stored(kind, name, stored_path, user=None, content_hash='', owner_key=''):
+    """Queue a file already in storage (e.g. an assembled chunked upload) for analysis."""
+    job = AnalysisJob.objects.create(
+        kind=kind, original_name=name, input_path=stored_path, user=user,
+        content_hash=content_hash, owner_key=owner_key
+    )
+    _submit(job.pk)
+    logger.info(f"📥 Queued {kind} job {job.pk} for {name}")
+    return job
+
+
+async def aenqueue(kind, upload, stored_path=None, user=None, content_hash='', owner_key=''):
+    """enqueue() for async views: the upload is saved in the I/O pool and the job created with the async ORM."""
+    from .aio import run_io
+
+    if stored_path is None:
+        stored_path = await run_io(default_storage.save, f'jobs/{upload.name}', upload)
+    job = await AnalysisJob.objects.acreate(
+        kind=kind, original_name=upload.name, input_path=stored_path, user=user,
+        content_hash=content_hash, owner_key=owner_key
+    )
+    _submit(job.pk)
+    logger.info(f"📥 Queued {kind} job {job.pk} for {upload.name}")
+    return job
+
+
+def claim_next_job():
+    """Atomically take the oldest queued job; returns its id or None."""
+    for job_id in AnalysisJob.objects.filter(status=AnalysisJob.QUEUED).values_list('pk', flat=True)[:10]:
+        if _claim(job_id):
+            return job_id
+    return None
+
+
+def _claim(job_id):
+    # The conditional UPDATE makes sure only one worker runs a job
+    now = timezone.now()
+    return AnalysisJob.objects.filter(pk=job_id, status=AnalysisJob.QUEUED).update(
+        status=AnalysisJob.RUNNING, stage='Starting', started_at=now, worker=worker_id(), heartbeat_at=now
+    ) == 1
+
+
+def _heartbeat(job_id, stop):
+    # Keeps recover() in other processes from taking a long job for an orphan
+    try:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            AnalysisJob.objects.filter(pk=job_id, status=AnalysisJob.RUNNING).update(heartbeat_at=timezone.now())
+    finally:
+        connection.close()
+
+
+def _finish(job_id, **fields):
+    """Record a job's outcome, unless recover() already failed it; returns whether it was recorded."""
+    return AnalysisJob.objects.filter(pk=job_id, status=AnalysisJob.RUNNING).update(
+        finished_at=timezone.now(), **fields
+    ) == 1
+
+
+def run_job(job_id, claimed=False):
+    """Run one queued job to completion, recording stage, progress and the result (as an AnalysisRun)."""
+    stop = threading.Event()
+    try:
+        if not claimed and not _claim(job_id):
+            return
+        _running.add(job_id)
+        threading.Thread(target=_heartbeat, args=(job_id, stop), daemon=True).start()
+        job = AnalysisJob.objects.get(pk=job_id)
+
+        def progress(stage, percent):
+            AnalysisJob.objects.filter(pk=job_id).update(stage=stage, progress=percent, heartbeat_at=timezone.now())
+
+        logger.info(f"⚙️ Running {job.kind} job {job_id}")
+        # A byte-identical re-upload reuses the earlier result without reading the file
+        from . import dedup
+        duplicate = dedup.find_identical(job.kind, job.content_hash, job.user_id, job.owner_key)
+        if duplicate is not None:
+            progress('Reusing identical upload', 90)
+            result = dedup.reuse_identical(
+                duplicate, job.original_name, default_storage.size(job.input_path), job.input_path
+            )
+        else:
+            # Images look for near-duplicates among the same uploader's earlier jobs
+            options = {'uploader': job} if job.kind == 'image' else {}
+            with default_storage.open(job.input_path, 'rb') as fh:
+                result = PROCESSORS[job.kind](File(fh, name=job.original_name), progress=progress, **options)
+
+        # Large TIFFs and videos are shown through the preview the analysis saved
+        preview_path = '' if job.kind == 'csv' else (
+            result.get('preview_image_path') or job.input_path or result.get('original_image_path')
+        )
+        run = AnalysisRun.store(
+            job.kind, result, job.original_name, user=job.user, owner_key=job.owner_key, preview_path=preview_path
+        )
+        if not _finish(
+            job_id, status=AnalysisJob.DONE, stage='Complete', progress=100,
+            run=run, phash=(result.get('file_info') or {}).get('phash'),
+        ):
+            logger.warning(f"⚠️ Job {job_id} was failed by recovery while it ran; dropping its result")
+            run.delete()
+            return
+        logger.info(f"✅ Finished {job.kind} job {job_id}")
+        # Render the PDF now, so the first download is already cached
+        reports.prerender(run)
+    except Exception as e:
+        logger.exception(f"❌ Job {job_id} failed: {e}")
+        _finish(job_id, status=AnalysisJob.FAILED, stage='Failed', error=str(e))
+    finally:
+        stop.set()
+        _running.discard(job_id)
+        # Pool threads outlive the request cycle, so release their connection here
+        connection.close()
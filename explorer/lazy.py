@@ -0,0 +1,62 @@
+"""
+Deferred imports for the heavy subsystems.
+
+torch/SAM, scikit-learn, matplotlib, pandas and reportlab together take
+seconds to import, and most processes (manage.py commands, migrations, a
+web worker serving the dashboard) never touch them. Modules imported with
+lazy_import() are only executed when one of their attributes is first used.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that imports it on first attribute access."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            with self.__dict__['_lazy_lock']:
+                module = self.__dict__['_lazy_module']
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+
+def lazy_import(name):
+    """Module ``name``, imported when it is first used (at once if it already is)."""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
+
+
+def available(*names):
+    """True when every named top-level package is installed, without importing any of them."""
+    try:
+        return all(importlib.util.find_spec(name) is not None for name in names)
+    except (ImportError, ValueError):
+        return False
@@ -0,0 +1,43 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.utils import process_images
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+
+
+class Command(BaseCommand):
+    help = "Analyze a folder of inspection photos with batched SAM encoder inference"
+
+    def add_arguments(self, parser):
+        parser.add_argument('folder', help='Directory containing the images to analyze')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Images per encoder batch (default: sized to free memory)')
+        parser.add_argument('--output', default=None,
+                            help='Write the per-image results to this JSON file')
+
+    def handle(self, *args, **options):
+        folder = options['folder']
+        if not os.path.isdir(folder):
+            raise CommandError(f'Not a directory: {folder}')
+
+        paths = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not paths:
+            raise CommandError(f'No images found in {folder}')
+
+        results = process_images(paths, batch_size=options['batch_size'])
+
+        for result in results:
+            self.stdout.write(
+                f"{result['file_info']['filename']}: {len(result['anomaly_zones'])} anomaly zones"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump({'results': results}, fh, indent=2, default=str)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
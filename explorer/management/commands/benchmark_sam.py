@@ -0,0 +1,77 @@
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.ml_utils import ML_MODELS_AVAILABLE, get_sam_checkpoint
+
+
+class Command(BaseCommand):
+    help = "Compare SAM latency and mask agreement of the CPU acceleration / INT8 / ONNX modes against the eager path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='+', help='Sample images to segment')
+        parser.add_argument('--checkpoint', default=None, help='SAM checkpoint (default: NIKA_SAM_CHECKPOINT)')
+        parser.add_argument('--model-type', default=None, help='vit_h, vit_l or vit_b (default: NIKA_SAM_MODEL_TYPE)')
+        parser.add_argument('--repeats', type=int, default=3, help='Timed runs per image and mode')
+        parser.add_argument('--bf16', action='store_true', help='Enable bfloat16 autocast in the accelerated mode')
+        parser.add_argument('--compile', action='store_true', help='torch.compile the encoder in the accelerated mode')
+        parser.add_argument('--threads', type=int, default=None, help='Intra-op threads for the accelerated mode')
+        parser.add_argument('--interop-threads', type=int, default=None, help='Inter-op threads for the accelerated mode')
+        parser.add_argument('--int8', action='store_true', help='Also benchmark the dynamically quantized INT8 encoder')
+        parser.add_argument('--onnx-dir', default=None,
+                            help='Also benchmark the ONNX Runtime backend from this export directory')
+        parser.add_argument('--max-iou-drop', type=float, default=None,
+                            help='Fail if any mode\'s mean mask IoU against eager drops by more than this')
+
+    def get_modes(self, options):
+        accel = {
+            'cpu_accel': True,
+            'bf16': options['bf16'],
+            'compile': options['compile'],
+            'threads': options['threads'],
+            'interop_threads': options['interop_threads'],
+        }
+        modes = {'eager': {}, 'cpu_accel': accel}
+        if options['int8']:
+            modes['int8'] = {'quantize': True}
+            modes['int8_accel'] = dict(accel, quantize=True)
+        if options['onnx_dir']:
+            modes['onnx'] = {'backend': 'onnx', 'onnx_dir': options['onnx_dir'], 'threads': options['threads']}
+        return modes
+
+    def handle(self, *args, **options):
+        if not ML_MODELS_AVAILABLE:
+            raise CommandError('SAM utilities are not importable (torch / segment_anything missing)')
+        import sam_benchmark
+
+        images = []
+        for path in options['images']:
+            img = cv2.imread(path)
+            if img is None:
+                raise CommandError(f'Could not read image: {path}')
+            images.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+        rows = sam_benchmark.benchmark_modes(
+            options['checkpoint'] or get_sam_checkpoint(),
+            options['model_type'] or getattr(settings, 'NIKA_SAM_MODEL_TYPE', 'vit_h'),
+            images,
+            self.get_modes(options),
+            repeats=options['repeats'],
+        )
+
+        header = f"{'mode':<12}{'load s':>9}{'encoder ms':>12}{'generate ms':>13}{'masks':>7}{'mean IoU':>10}{'min IoU':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in rows:
+            self.stdout.write(
+                f"{row['mode']:<12}{row['load_s']:>9}{row['encoder_ms']:>12}{row['generate_ms']:>13}"
+                f"{row['masks']:>7}{row['mean_iou']:>10}{row['min_iou']:>9}"
+            )
+        for row in rows:
+            self.stdout.write(f"{row['mode']}: {row['info']}")
+
+        if options['max_iou_drop'] is not None:
+            failed = [row['mode'] for row in rows if 1.0 - row['mean_iou'] > options['max_iou_drop']]
+            if failed:
+                raise CommandError(f"Mean mask IoU dropped by more than {options['max_iou_drop']} for: {', '.join(failed)}")
+            self.stdout.write(self.style.SUCCESS(f"All modes within {options['max_iou_drop']} mean IoU of eager"))
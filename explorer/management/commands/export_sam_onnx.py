@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.ml_utils import ML_MODELS_AVAILABLE, get_sam_checkpoint
+
+
+class Command(BaseCommand):
+    help = "Export the SAM image encoder and prompt/mask decoder to ONNX for the onnx inference backend"
+
+    def add_arguments(self, parser):
+        sam_options = getattr(settings, 'NIKA_SAM_OPTIONS', {})
+        parser.add_argument('--output-dir', default=sam_options.get('onnx_dir'),
+                            help='Directory for the .onnx files (default: NIKA_SAM_OPTIONS["onnx_dir"])')
+        parser.add_argument('--checkpoint', default=None, help='SAM checkpoint (default: NIKA_SAM_CHECKPOINT)')
+        parser.add_argument('--model-type', default=None, help='vit_h, vit_l or vit_b (default: NIKA_SAM_MODEL_TYPE)')
+        parser.add_argument('--opset', type=int, default=17, help='ONNX opset version')
+
+    def handle(self, *args, **options):
+        if not ML_MODELS_AVAILABLE:
+            raise CommandError('SAM utilities are not importable (torch / segment_anything missing)')
+        if not options['output_dir']:
+            raise CommandError('No --output-dir given and NIKA_SAM_OPTIONS["onnx_dir"] is not set')
+        import sam_onnx
+
+        meta = sam_onnx.export_onnx(
+            options['checkpoint'] or get_sam_checkpoint(),
+            options['model_type'] or getattr(settings, 'NIKA_SAM_MODEL_TYPE', 'vit_h'),
+            options['output_dir'],
+            opset=options['opset'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported SAM {meta['model_type']} encoder and decoder to {options['output_dir']}"
+        ))
+        self.stdout.write("Set NIKA_SAM_BACKEND=onnx to serve image analysis from these files.")
@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Packages that should only load on first use (see explorer.lazy)
+HEAVY_PACKAGES = (
+    'torch', 'torchvision', 'segment_anything', 'onnxruntime', 'sklearn', 'scipy', 'skimage',
+    'matplotlib', 'seaborn', 'pandas', 'reportlab', 'cv2', 'tifffile',
+)
+
+# Lazily loaded subsystems, timed one after another after startup: (label, module)
+SUBSYSTEMS = (
+    ('pandas', 'pandas'),
+    ('scikit-learn', 'sklearn.ensemble'),
+    ('matplotlib plots', 'explorer.plotting_utils'),
+    ('ReportLab', 'reportlab.platypus'),
+    ('SAM (torch, segment_anything)', 'utils'),
+)
+
+MARKER = '-- nika startup done --'
+
+# Runs in a fresh interpreter under -X importtime; prints timings as JSON on stdout
+PROBE = '''
+import importlib, json, os, sys, time
+t0 = time.perf_counter()
+import django
+django.setup()
+for name in sys.argv[1].split(','):
+    importlib.import_module(name)
+startup = time.perf_counter() - t0
+sys.stderr.write({marker!r} + '\\n')
+subsystems = []
+if sys.argv[2]:
+    for name in sys.argv[2].split(','):
+        t = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            subsystems.append([name, time.perf_counter() - t, None])
+        except Exception as e:
+            subsystems.append([name, None, str(e)])
+print(json.dumps({{'startup_s': startup, 'subsystems': subsystems}}))
+'''.format(marker=MARKER)
+
+
+def parse_importtime(lines):
+    """-X importtime lines to {top-level package: self microseconds}, so nested imports are not counted twice."""
+    totals = {}
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+    return totals
+
+
+class Command(BaseCommand):
+    help = "Report the import-time breakdown and cold-start time of a fresh process (manage.py, web workers)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', action='append', default=None,
+                            help='Module a worker imports at boot (repeatable; default: ROOT_URLCONF and explorer.jobs)')
+        parser.add_argument('--top', type=int, default=15, help='Packages listed in the breakdown')
+        parser.add_argument('--subsystems', action='store_true',
+                            help='Also time loading each lazily imported subsystem after startup')
+        parser.add_argument('--max-seconds', type=float, default=None,
+                            help='Fail if the cold start takes longer than this')
+        parser.add_argument('--strict', action='store_true',
+                            help='Fail if a heavy package (torch, sklearn, matplotlib, ...) is imported at startup')
+
+    def handle(self, *args, **options):
+        modules = options['module'] or [settings.ROOT_URLCONF, 'explorer.jobs']
+        subsystems = [module for _, module in SUBSYSTEMS] if options['subsystems'] else []
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'nika.settings'))
+
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE, ','.join(modules), ','.join(subsystems)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - started
+        if proc.returncode != 0:
+            raise CommandError(f'Startup probe failed:\n{proc.stderr[-2000:]}')
+        timings = json.loads(proc.stdout.strip().splitlines()[-1])
+
+        lines = proc.stderr.splitlines()
+        startup_lines = lines[:lines.index(MARKER)] if MARKER in lines else lines
+        packages = parse_importtime(startup_lines)
+        total_us = sum(packages.values()) or 1
+
+        self.stdout.write(f"Modules imported at boot: {', '.join(modules)}")
+        header = f"{'package':<28}{'import ms':>11}{'share':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for package, us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f"{package:<28}{us / 1000:>11.1f}{us / total_us:>8.1%}")
+        self.stdout.write('-' * len(header))
+        self.stdout.write(f"{'all imports':<28}{total_us / 1000:>11.1f}")
+        self.stdout.write(f"django.setup() + boot imports: {timings['startup_s']:.3f} s")
+        wall_note = 'interpreter start, boot and subsystem loads' if subsystems else 'interpreter start and boot'
+        self.stdout.write(f"Cold start ({wall_note}): {wall:.3f} s")
+
+        if subsystems:
+            self.stdout.write('')
+            self.stdout.write(f"{'lazy subsystem':<32}{'first use ms':>14}")
+            labels = {module: label for label, module in SUBSYSTEMS}
+            for module, seconds, error in timings['subsystems']:
+                shown = f"{seconds * 1000:>14.1f}" if error is None else f"  unavailable ({error})"
+                self.stdout.write(f"{labels.get(module, module):<32}{shown}")
+
+        heavy = sorted(package for package in packages if package in HEAVY_PACKAGES)
+        if heavy:
+            message = f"Heavy packages imported at startup: {', '.join(heavy)}"
+            if options['strict']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No heavy packages imported at startup'))
+
+        if options['max_seconds'] is not None and timings['startup_s'] > options['max_seconds']:
+            raise CommandError(f"Startup took {timings['startup_s']:.3f} s (limit {options['max_seconds']} s)")
@@ -0,0 +1,75 @@
+import re
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from explorer import reports
+from explorer.models import AnalysisRun
+
+
+# reports/<run id>-v<REPORT_VERSION>[-full].pdf (explorer.reports)
+_REPORT_NAME = re.compile(r'^(?P<run>[0-9a-f-]{36})-v(?P<version>\d+)(-full)?\.pdf$')
+
+
+class Command(BaseCommand):
+    help = "Delete old analysis runs, files no run refers to any more and reports of older REPORT_VERSIONs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Also delete runs (and their files) older than this many days')
+        parser.add_argument('--dry-run', action='store_true', help='Only list what would be deleted')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            old = AnalysisRun.objects.filter(created_at__lt=timezone.now() - timedelta(days=options['days']))
+            self.stdout.write(f'{old.count()} runs older than {options["days"]} days')
+            if not options['dry_run']:
+                # Deleted one by one so each run's files go with it (explorer.signals)
+                for run_id in list(old.values_list('pk', flat=True)):
+                    for run in AnalysisRun.objects.filter(pk=run_id):
+                        run.delete()
+
+        orphans = self._orphaned_scores() + self._stale_reports()
+        for path in orphans:
+            self.stdout.write(f'Orphaned file {path}')
+            if not options['dry_run']:
+                default_storage.delete(path)
+        self.stdout.write(self.style.SUCCESS(f'{len(orphans)} orphaned or stale files'))
+
+    def _orphaned_scores(self):
+        """Scores files of runs that were deleted or never stored (a failed job)."""
+        if not default_storage.exists('scores'):
+            return []
+        # Skip files young enough to belong to a job that is still running
+        cutoff = timezone.now() - timedelta(days=1)
+        candidates = {
+            f'scores/{name}' for name in default_storage.listdir('scores')[1]
+            if default_storage.get_modified_time(f'scores/{name}') < cutoff
+        }
+        if candidates:
+            referenced = AnalysisRun.objects.exclude(scores_path='').values_list('scores_path', flat=True)
+            candidates.difference_update(referenced)
+        return sorted(candidates)
+
+    def _stale_reports(self):
+        """Reports of an older REPORT_VERSION, or of runs that no longer exist."""
+        if not default_storage.exists('reports'):
+            return []
+        stale = []
+        names = {}
+        for name in default_storage.listdir('reports')[1]:
+            match = _REPORT_NAME.match(name)
+            if match is None:
+                continue
+            if int(match['version']) != reports.REPORT_VERSION:
+                stale.append(f'reports/{name}')
+            else:
+                names.setdefault(match['run'], []).append(f'reports/{name}')
+        existing = {
+            str(run_id) for run_id in AnalysisRun.objects.filter(pk__in=list(names)).values_list('pk', flat=True)
+        }
+        for run_id, paths in names.items():
+            if run_id not in existing:
+                stale.extend(paths)
+        return sorted(stale)
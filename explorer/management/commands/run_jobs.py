@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from explorer import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued CSV/image analysis jobs outside the web processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        # Queued jobs are claimed below; only jobs left running by a dead worker need recovering
+        submitted, failed = jobs.recover(submit=False)
+        if failed:
+            self.stdout.write(f'Failed {failed} jobs left running by a stopped worker')
+        self.stdout.write(self.style.SUCCESS('Waiting for analysis jobs...'))
+        try:
+            while True:
+                job_id = jobs.claim_next_job()
+                if job_id is None:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll'])
+                    continue
+                self.stdout.write(f'Running job {job_id}')
+                jobs.run_job(job_id, claimed=True)
+        except KeyboardInterrupt:
+            self.stdout.write('Job worker stopped')
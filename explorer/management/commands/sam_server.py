@@ -0,0 +1,46 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.ml_utils import ML_MODELS_AVAILABLE, get_sam_checkpoint
+
+
+class Command(BaseCommand):
+    help = "Run the shared SAM inference server that web workers send image segmentation to"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=None,
+                            help="'host:port' or Unix socket path (default: NIKA_SAM_SERVER)")
+
+    def handle(self, *args, **options):
+        if not ML_MODELS_AVAILABLE:
+            raise CommandError('SAM utilities are not importable (torch / segment_anything missing)')
+        import utils as sam_utils
+        from inference_server import SamServer, parse_address
+
+        address = options['address'] or getattr(settings, 'NIKA_SAM_SERVER', '')
+        if not address:
+            raise CommandError('No --address given and NIKA_SAM_SERVER is not set')
+        authkey = getattr(settings, 'NIKA_SAM_SERVER_AUTHKEY', '') or settings.SECRET_KEY
+
+        # Load locally: this process is the one that owns the weights
+        sam_utils.load_model_once(
+            checkpoint=get_sam_checkpoint(),
+            model_type=getattr(settings, 'NIKA_SAM_MODEL_TYPE', 'vit_h'),
+            **getattr(settings, 'NIKA_SAM_OPTIONS', {})
+        )
+        socket_path = parse_address(address)
+        if isinstance(socket_path, str) and os.path.exists(socket_path):
+            # Stale socket left by a previous run
+            os.unlink(socket_path)
+
+        self.stdout.write(self.style.SUCCESS(f"SAM server listening on {address}: {sam_utils.MODEL_INFO}"))
+        server = SamServer(
+            address, authkey.encode(), sam_utils.segment_image, sam_utils.MODEL_INFO,
+            segment_points=sam_utils.segment_at_points,
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("SAM server stopped")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='phash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
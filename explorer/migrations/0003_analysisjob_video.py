@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0002_analysisjob_phash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysisjob',
+            name='kind',
+            field=models.CharField(choices=[('csv', 'CSV'), ('image', 'Image'), ('video', 'Video')], max_length=10),
+        ),
+    ]
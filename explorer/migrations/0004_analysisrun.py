@@ -0,0 +1,73 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:42
+
+import django.db.models.deletion
+import json
+import uuid
+import zlib
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_results_to_runs(apps, schema_editor):
+    AnalysisJob = apps.get_model('explorer', 'AnalysisJob')
+    AnalysisRun = apps.get_model('explorer', 'AnalysisRun')
+    for job in AnalysisJob.objects.filter(result__isnull=False).iterator():
+        raw = json.dumps(job.result, separators=(',', ':')).encode()
+        job.run = AnalysisRun.objects.create(
+            kind=job.kind, original_name=job.original_name,
+            size_bytes=len(raw), data=zlib.compress(raw, 6)
+        )
+        job.save(update_fields=['run'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0003_analysisjob_video'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='AnalysisRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('csv', 'CSV'), ('image', 'Image'), ('video', 'Video')], max_length=10)),
+                ('original_name', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analysis_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='analysisjob',
+            name='run',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='job', to='explorer.analysisrun'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisrun',
+            index=models.Index(fields=['-created_at'], name='run_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisrun',
+            index=models.Index(fields=['kind', '-created_at'], name='run_kind_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisrun',
+            index=models.Index(fields=['user', '-created_at'], name='run_user_created_idx'),
+        ),
+        migrations.RunPython(move_results_to_runs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='analysisjob',
+            name='result',
+        ),
+    ]
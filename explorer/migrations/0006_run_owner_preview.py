@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:34
+
+import json
+import zlib
+from django.db import migrations, models
+
+
+def fill_preview_paths(apps, schema_editor):
+    # The path the dashboard used to find by decompressing the result on every view
+    AnalysisJob = apps.get_model('explorer', 'AnalysisJob')
+    AnalysisRun = apps.get_model('explorer', 'AnalysisRun')
+    for run in AnalysisRun.objects.exclude(kind='csv').iterator():
+        result = json.loads(zlib.decompress(run.data))
+        input_path = AnalysisJob.objects.filter(run=run).values_list('input_path', flat=True).first()
+        run.preview_path = result.get('preview_image_path') or input_path or result.get('original_image_path') or ''
+        run.save(update_fields=['preview_path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0005_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='owner_key',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='analysisrun',
+            name='owner_key',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='analysisrun',
+            name='preview_path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.RunPython(fill_preview_paths, migrations.RunPython.noop),
+    ]
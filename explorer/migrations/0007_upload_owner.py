@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0006_run_owner_preview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='owner_key',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='stored_path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
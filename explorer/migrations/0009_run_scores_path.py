@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:02
+
+import json
+import zlib
+from django.db import migrations, models
+
+
+def fill_scores_paths(apps, schema_editor):
+    # The path the exports used to find by decompressing the result
+    AnalysisRun = apps.get_model('explorer', 'AnalysisRun')
+    for run in AnalysisRun.objects.filter(kind='csv').iterator():
+        run.scores_path = json.loads(zlib.decompress(run.data)).get('scores_path') or ''
+        run.save(update_fields=['scores_path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0008_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisrun',
+            name='scores_path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.RunPython(fill_scores_paths, migrations.RunPython.noop),
+    ]
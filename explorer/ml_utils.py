@@ -1,53 +1,44 @@
 import random
 import json
+import functools
 import pickle
 import os
 import sys
+import uuid
 from datetime import datetime, timedelta
 import io
 import numpy as np
-import pandas as pd
 from django.http import HttpResponse
 from django.conf import settings
 
+from .lazy import available, lazy_import
+from . import report_figures
+
 # Add nika_pipeline to Python path
 pipeline_path = os.path.join(settings.BASE_DIR, 'nika_pipeline', 'content')
 if pipeline_path not in sys.path:
     sys.path.append(pipeline_path)
 
-try:
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import inch
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-    from reportlab.platypus import Image as ReportLabImage
-    from reportlab.graphics.shapes import Drawing, Rect, Circle, String
-    from reportlab.graphics.charts.barcharts import VerticalBarChart
-    from reportlab.graphics.charts.piecharts import Pie
-    from reportlab.graphics import renderPDF
-    from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-    REPORTLAB_AVAILABLE = True
-except ImportError:
-    REPORTLAB_AVAILABLE = False
-
-try:
-    import utils as sam_utils
-    ML_MODELS_AVAILABLE = True
-except ImportError:
-    ML_MODELS_AVAILABLE = False
+# ReportLab is imported by the report builders themselves, on the first report
+REPORTLAB_AVAILABLE = available('reportlab')
+
+# The SAM stack (torch, segment_anything, skimage) loads on the first image analysis
+ML_MODELS_AVAILABLE = available('torch', 'segment_anything', 'skimage', 'cv2')
+if ML_MODELS_AVAILABLE:
+    sam_utils = lazy_import('utils')
+    overlay_renderer = lazy_import('overlay')
+    large_image = lazy_import('large_image')
+    video_frames = lazy_import('video')
+else:
     print("Warning: SAM utils not available, using fallback mode")
 
-try:
-    from sklearn.ensemble import IsolationForest, RandomForestClassifier
-    from sklearn.neighbors import NearestNeighbors
-    import matplotlib.pyplot as plt
-    import seaborn as sns
-    SKLEARN_AVAILABLE = True
-except ImportError:
-    SKLEARN_AVAILABLE = False
+# scikit-learn loads with the first pickled model
+SKLEARN_AVAILABLE = available('sklearn')
+if not SKLEARN_AVAILABLE:
     print("Warning: sklearn not available, using fallback mode")
 
+pd = lazy_import('pandas')
+
 def load_ml_models():
     """Load the pre-trained scikit-learn models."""
     models = {}
@@ -75,21 +66,67 @@ def load_ml_models():
     
     return models
 
-def process_csv(file):
+def get_sam_checkpoint():
+    """Path of the SAM checkpoint configured in settings."""
+    default = os.path.join(settings.BASE_DIR, 'nika_pipeline', 'content', 'sam_weights', 'sam_vit_h.pth')
+    return str(getattr(settings, 'NIKA_SAM_CHECKPOINT', default))
+
+def get_sam_server():
+    """(address, authkey) of the shared SAM server, or None to load SAM in this process."""
+    address = getattr(settings, 'NIKA_SAM_SERVER', '')
+    if not address:
+        return None
+    authkey = getattr(settings, 'NIKA_SAM_SERVER_AUTHKEY', '') or settings.SECRET_KEY
+    return address, authkey.encode()
+
+def load_sam():
+    """Load the SAM mask generator once, with the inference options from settings.
+    
+    When NIKA_SAM_SERVER is set, connect to the shared server instead so this
+    worker never holds model weights.
+    """
+    server = get_sam_server()
+    if server:
+        return sam_utils.connect_server(*server)
+    return sam_utils.load_model_once(
+        checkpoint=get_sam_checkpoint(),
+        model_type=getattr(settings, 'NIKA_SAM_MODEL_TYPE', 'vit_h'),
+        **getattr(settings, 'NIKA_SAM_OPTIONS', {})
+    )
+
+def get_mineral_library():
+    """The reference mineral library configured in settings (loaded once per process)."""
+    import mineral_library
+    options = getattr(settings, 'NIKA_MINERAL_LIBRARY', {})
+    return mineral_library.load_library(
+        options.get('path'),
+        space=options.get('space', 'rgb'),
+        texture_weight=options.get('texture_weight', 0.0),
+    )
+
+def _report_progress(progress, stage, percent):
+    """Forward a stage update to the job status callback, if there is one."""
+    if progress is not None:
+        progress(stage, percent)
+
+def process_csv(file, progress=None):
     """
     Process CSV files using real ML models for anomaly detection.
     
     Args:
         file: Uploaded CSV file
+        progress: Optional callback(stage, percent) for job status
         
     Returns:
         dict: Contains anomalies list and metrics dictionary
     """
     try:
         # Read CSV file
+        _report_progress(progress, 'Reading CSV', 10)
         df = pd.read_csv(file)
         
         # Load ML models
+        _report_progress(progress, 'Loading models', 25)
         models = load_ml_models()
         
         # Basic data preprocessing
@@ -102,8 +139,10 @@ def process_csv(file):
         X = df[numeric_columns].fillna(df[numeric_columns].mean())
         
         anomalies = []
+        scores_path = None
         
         # Use Isolation Forest for anomaly detection if available
+        _report_progress(progress, 'Detecting anomalies', 40)
         if 'isolation_forest' in models:
             iso_model = models['isolation_forest']
             try:
@@ -113,19 +152,24 @@ def process_csv(file):
                 
                 anomaly_indices = np.where(predictions == -1)[0]
                 
+                from . import exports
+                
+                # Every row's score, for the exports (streamed back from the file row by row)
+                try:
+                    scores_path = exports.write_scores(
+                        f"scores/{uuid.uuid4().hex}.csv.gz",
+                        range(len(X)), anomaly_scores, predictions == -1, X,
+                    )
+                except Exception as e:
+                    import logging
+                    logging.getLogger(__name__).error(f"❌ Error saving row scores: {e}", exc_info=True)
+                
+                detected_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 for idx in anomaly_indices:
-                    anomaly = {
-                        'id': f'anomaly_{idx+1}',
-                        'type': 'Statistical Outlier (ML)',
-                        'severity': get_severity_from_score(anomaly_scores[idx]),
-                        'confidence': abs(float(anomaly_scores[idx])),
-                        'row_index': int(idx),
-                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'affected_columns': numeric_columns.tolist(),
-                        'description': f'ML-detected anomaly in row {idx+1}',
-                        'anomaly_score': float(anomaly_scores[idx]),
-                        'data_values': X.iloc[idx].to_dict()
-                    }
+                    # Same record the anomaly export rebuilds from the scores file
+                    anomaly = exports.ml_anomaly(
+                        int(idx), float(anomaly_scores[idx]), X.iloc[idx].to_dict(), detected_at
+                    )
                     anomalies.append(anomaly)
             except Exception as e:
                 print(f"Error with isolation forest: {e}")
@@ -146,6 +190,7 @@ def process_csv(file):
                 print(f"Error with random forest: {e}")
         
         # Calculate metrics
+        _report_progress(progress, 'Computing metrics', 85)
         total_records = len(df)
         anomaly_rate = len(anomalies) / total_records if total_records > 0 else 0
         
@@ -191,6 +236,7 @@ def process_csv(file):
         return {
             'status': 'success',
             'anomalies': anomalies,
+            'scores_path': scores_path,
             'metrics': metrics,
             'file_info': {
                 'filename': file.name,
@@ -276,33 +322,120 @@ def process_csv_fallback(file):
         }
     }
 
-def get_severity_from_score(score):
-    """Convert anomaly score to severity level."""
-    abs_score = abs(score)
-    if abs_score > 0.5:
-        return 'Critical'
-    elif abs_score > 0.3:
-        return 'High' 
-    elif abs_score > 0.1:
-        return 'Medium'
+def _decode_upload(file):
+    """
+    Decode an uploaded or stored image to RGB without copying it to disk.
+    
+    Files that already live on disk (large temporary uploads, stored job
+    inputs) are memory-mapped; in-memory uploads are decoded from their buffer.
+    (Big)TIFFs are read tile by tile, downscaled to NIKA_LARGE_IMAGE['max_side'].
+    
+    Args:
+        file: Django File / UploadedFile
+        
+    Returns:
+        tuple: H×W×3 RGB image and the (H, W) of the full-resolution source
+    """
+    max_side = getattr(settings, 'NIKA_LARGE_IMAGE', {}).get('max_side', 4096)
+    if hasattr(file, 'temporary_file_path'):
+        path = file.temporary_file_path()
+    else:
+        path = getattr(getattr(file, 'file', None), 'name', None)
+    on_disk = isinstance(path, str) and os.path.isfile(path)
+    
+    if large_image.is_tiff(file.name):
+        if on_disk:
+            return large_image.read_tiff_rgb(path, max_side)
+        file.seek(0)
+        return large_image.read_tiff_rgb(file.file, max_side)
+    
+    if on_disk:
+        img = sam_utils.read_image_rgb(path)
+    elif hasattr(getattr(file, 'file', None), 'getbuffer'):
+        with file.file.getbuffer() as buf:
+            img = sam_utils.decode_image_rgb(buf)
     else:
-        return 'Low'
+        file.seek(0)
+        try:
+            img = sam_utils.decode_image_rgb(file.read())
+        finally:
+            file.seek(0)
+    return img, img.shape[:2]
+
+def _analyze_image(img_rgb, filename, progress=None, preview=False, points=None):
+    """
+    Run SAM, segment metrics, the mineral map and the overlay on a decoded image.
+    
+    Args:
+        img_rgb: Decoded RGB image
+        filename: Name the stored artifacts are keyed by
+        progress: Optional callback(stage, percent) for job status
+        preview: Also store the analysed pixels for display (sources browsers cannot show)
+        points: (x, y) prompts to segment at instead of the full point grid (see dedup.warm_start_points)
+        
+    Returns:
+        tuple: masks, metrics_data, overlay paths and mineral map, in _build_image_result order
+    """
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    checkpoint_path = get_sam_checkpoint()
+    logger.info(f"🤖 Loading SAM model from: {checkpoint_path}")
+    logger.info(f"🔍 SAM weights exist: {os.path.exists(checkpoint_path)}")
+    
+    # Load SAM model with the correct checkpoint path
+    logger.info("⚡ Initializing SAM model...")
+    _report_progress(progress, 'Loading SAM model', 15)
+    mask_gen = load_sam()
+    logger.info("✅ SAM model loaded successfully")
+    
+    # Run SAM on the image
+    logger.info("🔬 Running SAM segmentation...")
+    _report_progress(progress, 'Segmenting image', 30)
+    masks = [m for m in sam_utils.segment_at_points(img_rgb, points) if m['area']] if points else []
+    if not masks:
+        masks = sam_utils.run_sam_on_image(img_rgb, max_masks=20)
+    logger.info(f"🎯 SAM detected {len(masks)} segments")
+    
+    # Get detailed metrics for detected segments
+    logger.info("📊 Computing segment metrics...")
+    _report_progress(progress, 'Computing segment metrics', 75)
+    metrics_data = sam_utils.metrics_dashboard(
+        img_rgb, 
+        masks, 
+        refs=get_mineral_library(),
+        max_masks=10,
+        top_n=getattr(settings, 'NIKA_MINERAL_LIBRARY', {}).get('top_n', 3)
+    )
+    logger.info(f"📈 Computed metrics for {len(metrics_data)} segments")
+    
+    _report_progress(progress, 'Mapping minerals', 80)
+    key = _artifact_key(img_rgb, masks, filename)
+    mineral_map = build_mineral_map(img_rgb)
+    
+    _report_progress(progress, 'Rendering overlay', 85)
+    overlay = save_overlay(img_rgb, masks, filename, key=key) or {}
+    if mineral_map is not None:
+        overlay['mineral_map_path'] = save_mineral_map(mineral_map, key)
+    if preview:
+        overlay['preview_image_path'] = save_preview(img_rgb, key)
+    
+    return masks, metrics_data, overlay, mineral_map
 
-def process_image(file):
+def process_image(file, progress=None, uploader=None):
     """
     Process image files using real SAM (Segment Anything Model) for mineral anomaly detection.
     
     Args:
         file: Uploaded image file
+        progress: Optional callback(stage, percent) for job status
+        uploader: AnalysisJob of the upload; near-duplicates of this user's or session's
+            earlier images warm-start SAM from their zones
         
     Returns:
         dict: Contains anomaly zones, confidence scores, mineral predictions, and overlay image path
     """
-    import tempfile
-    import shutil
     import logging
-    from django.core.files.storage import default_storage
-    from django.core.files.base import ContentFile
     
     # Set up logging
     logger = logging.getLogger(__name__)
@@ -315,188 +448,511 @@ def process_image(file):
         
         logger.info("✅ ML models available, attempting SAM processing")
         
-        # Save uploaded file temporarily for processing
-        temp_dir = tempfile.mkdtemp()
-        temp_file_path = os.path.join(temp_dir, file.name)
-        logger.info(f"📁 Created temporary file: {temp_file_path}")
+        # Decode once; segmentation, metrics and the overlay share the array
+        _report_progress(progress, 'Decoding image', 5)
+        img_rgb, source_shape = _decode_upload(file)
+        logger.info(f"🧩 Decoded {file.name} ({source_shape[1]}x{source_shape[0]}) to {img_rgb.shape[1]}x{img_rgb.shape[0]}")
         
-        with open(temp_file_path, 'wb') as temp_file:
-            for chunk in file.chunks():
-                temp_file.write(chunk)
-        
-        logger.info(f"💾 Saved {file.size} bytes to temporary file")
-        
-        # Reset file pointer for Django's file handling
-        file.seek(0)
+        # Re-exposures and re-framings of an analysed image are segmented where its zones were
+        from . import dedup
+        fingerprint = dedup.fingerprint(img_rgb)
+        duplicate = None
+        if uploader is not None:
+            duplicate = dedup.find_near_duplicate(fingerprint, uploader.user_id, uploader.owner_key)
+        points = dedup.warm_start_points(duplicate[0], img_rgb.shape) if duplicate is not None else None
+        if points:
+            logger.info(f"♻️ {file.name} is a near-duplicate of {duplicate[0].original_name}, warm-starting SAM")
         
         # Run SAM on the image
         try:
-            checkpoint_path = os.path.join(settings.BASE_DIR, 'nika_pipeline', 'content', 'sam_weights', 'sam_vit_h.pth')
-            logger.info(f"🤖 Loading SAM model from: {checkpoint_path}")
-            logger.info(f"🔍 SAM weights exist: {os.path.exists(checkpoint_path)}")
-            
-            # Load SAM model with the correct checkpoint path
-            logger.info("⚡ Initializing SAM model...")
-            mask_gen = sam_utils.load_model_once(checkpoint=checkpoint_path)
-            logger.info("✅ SAM model loaded successfully")
-            
-            # Run SAM on the image
-            logger.info("🔬 Running SAM segmentation...")
-            masks = sam_utils.run_sam_on_image(temp_file_path, max_masks=20)
-            logger.info(f"🎯 SAM detected {len(masks)} segments")
-            
-            # Get detailed metrics for detected segments
-            logger.info("📊 Computing segment metrics...")
-            metrics_data = sam_utils.metrics_dashboard(
-                temp_file_path, 
-                masks, 
-                refs=sam_utils.ref_colors,
-                max_masks=10
+            # Browsers cannot show a (huge) TIFF, so keep the analysed pixels as its preview
+            analysis = _analyze_image(
+                img_rgb, file.name, progress, preview=large_image.is_tiff(file.name), points=points
             )
-            logger.info(f"📈 Computed metrics for {len(metrics_data)} segments")
-            
         except Exception as e:
             logger.error(f"❌ Error running SAM: {e}")
             logger.info("🔄 Falling back to mock processing")
             return process_image_fallback(file)
         
-        # Convert SAM results to anomaly zones format
-        logger.info("🧮 Converting SAM results to anomaly zones...")
-        anomaly_zones = []
+        _report_progress(progress, 'Building results', 90)
+        result = _build_image_result(file.name, file.size, *analysis, source_shape=source_shape)
+        result['file_info']['phash'] = fingerprint
+        if points:
+            result['near_duplicate_of'] = dedup.near_duplicate_info(*duplicate)
+        
+    except Exception as e:
+        logger.error(f"❌ Error in image processing: {e}")
+        import traceback
+        logger.error(f"Stack trace: {traceback.format_exc()}")
+        logger.info("🔄 Falling back to mock processing")
+        return process_image_fallback(file)
+    
+    logger.info(f"🎉 Successfully processed {file.name} with {len(result['anomaly_zones'])} anomaly zones")
+    return result
+
+def process_image_batch(paths, batch_size=None):
+    """
+    Process a queue of image files with batched SAM encoder inference.
+    
+    Args:
+        paths: Iterable of image file paths
+        batch_size: Images per encoder batch (sized to free memory when None)
+        
+    Returns:
+        list: One result dict per image, in the same format as process_image
+    """
+    import logging
+    from django.core.files import File
+    
+    logger = logging.getLogger(__name__)
+    paths = list(paths)
+    
+    def _fallback(path):
+        with open(path, 'rb') as fh:
+            return process_image_fallback(File(fh, name=os.path.basename(path)))
+    
+    if not ML_MODELS_AVAILABLE:
+        logger.warning("⚠️ ML models not available, using fallback processing")
+        return [_fallback(path) for path in paths]
+    
+    results = []
+    try:
+        load_sam()
+        batch_size = batch_size or sam_utils.encoder_batch_size()
+        logger.info(f"📦 Running SAM on {len(paths)} images in encoder batches of {batch_size}")
         
-        for i, (mask_data, metrics) in enumerate(zip(masks[:3], metrics_data[:3])):
-            # Extract bounding box from mask
-            seg = mask_data['segmentation']
-            y_coords, x_coords = np.where(seg)
+        for path, (img_rgb, masks) in zip(paths, sam_utils.run_sam_on_images(paths, batch_size=batch_size)):
+            metrics_data = sam_utils.metrics_dashboard(
+                img_rgb, masks, refs=get_mineral_library(), max_masks=10,
+                top_n=getattr(settings, 'NIKA_MINERAL_LIBRARY', {}).get('top_n', 3)
+            )
+            name = os.path.basename(path)
+            key = _artifact_key(img_rgb, masks, name)
+            mineral_map = build_mineral_map(img_rgb)
+            overlay = save_overlay(img_rgb, masks, name, key=key) or {}
+            if mineral_map is not None:
+                overlay['mineral_map_path'] = save_mineral_map(mineral_map, key)
+            results.append(_build_image_result(name, os.path.getsize(path), masks, metrics_data, overlay, mineral_map))
+            logger.info(f"🎯 {os.path.basename(path)}: {len(masks)} segments")
+        return results
+    except Exception as e:
+        logger.error(f"❌ Error running batched SAM: {e}")
+        logger.info("🔄 Falling back to mock processing for the remaining images")
+        return results + [_fallback(path) for path in paths[len(results):]]
+
+def process_video(file, progress=None):
+    """
+    Analyse inspection footage: SAM runs only on the sharpest frame of each scene.
+    
+    The video is streamed frame by frame; sampled frames are scored for scene
+    change and blur (NIKA_VIDEO), so compute follows the number of scenes,
+    not the number of frames.
+    
+    Args:
+        file: Uploaded or stored video file
+        progress: Optional callback(stage, percent) for job status
+        
+    Returns:
+        dict: The keyframe result with the most anomaly zones (process_image format),
+              plus 'video' metadata and a 'timeline' of zones per keyframe
+    """
+    import copy
+    import logging
+    import tempfile
+    
+    logger = logging.getLogger(__name__)
+    logger.info(f"🎞️ Starting video processing for: {file.name} (size: {file.size} bytes)")
+    
+    if not ML_MODELS_AVAILABLE:
+        logger.warning("⚠️ ML models not available, using fallback processing")
+        return {**process_image_fallback(file), 'timeline': []}
+    
+    # OpenCV reads from a path: use the file on disk, spooling in-memory uploads
+    if hasattr(file, 'temporary_file_path'):
+        path, spooled = file.temporary_file_path(), None
+    elif isinstance(getattr(getattr(file, 'file', None), 'name', None), str) and os.path.isfile(file.file.name):
+        path, spooled = file.file.name, None
+    else:
+        spooled = tempfile.NamedTemporaryFile(suffix=os.path.splitext(file.name)[1])
+        for chunk in file.chunks():
+            spooled.write(chunk)
+        spooled.flush()
+        path = spooled.name
+    
+    options = getattr(settings, 'NIKA_VIDEO', {})
+    stem = os.path.splitext(os.path.basename(file.name))[0]
+    info, timeline, results = {}, [], []
+    try:
+        _report_progress(progress, 'Scanning video for keyframes', 5)
+        for n, keyframe in enumerate(video_frames.keyframes(
+            path,
+            sample_fps=options.get('sample_fps', 2.0),
+            scene_threshold=options.get('scene_threshold', 0.4),
+            min_scene_seconds=options.get('min_scene_seconds', 1.0),
+            max_keyframes=options.get('max_keyframes', 50),
+            info=info,
+        )):
+            seconds = keyframe['time']
+            timestamp = f"{int(seconds // 60):02d}:{seconds % 60:04.1f}"
+            done = seconds / info['duration'] if info.get('duration') else 0
+            _report_progress(progress, f'Analysing keyframe {n + 1} at {timestamp}', 10 + int(80 * done))
             
-            if len(x_coords) == 0 or len(y_coords) == 0:
-                logger.warning(f"⚠️ Empty segment {i+1}, skipping")
+            frame_name = f"{stem}_{keyframe['frame']:06d}.jpg"
+            img_rgb = keyframe.pop('image')
+            try:
+                masks, metrics_data, overlay, mineral_map = _analyze_image(img_rgb, frame_name, preview=True)
+            except Exception as e:
+                logger.error(f"❌ Error analysing keyframe {keyframe['frame']}: {e}")
                 continue
-                
-            x_min, x_max = int(x_coords.min()), int(x_coords.max())
-            y_min, y_max = int(y_coords.min()), int(y_coords.max())
-            
-            # Determine mineral type based on color similarity
-            mineral_type = 'Unknown'
-            max_sim = 0
-            
-            if metrics.get('color_sims'):
-                logger.info(f"🎨 Analyzing colors for segment {i+1}: {metrics['color_sims']}")
-                for mineral, sim_score in metrics['color_sims'].items():
-                    if sim_score > max_sim:
-                        max_sim = sim_score
-                        if mineral == 'iron_oxide':
-                            mineral_type = 'Hematite'
-                        elif mineral == 'copper':
-                            mineral_type = 'Malachite'
-                        elif mineral == 'sulfur':
-                            mineral_type = 'Pyrite'
-                logger.info(f"🔍 Best match: {mineral_type} (similarity: {max_sim:.3f})")
-            
-            # Calculate confidence based on anomaly score and area
-            confidence = min(metrics.get('anomaly_score', 50) / 100.0, 0.95)
-            logger.info(f"📊 Zone {i+1}: {mineral_type} @ {confidence:.2f} confidence")
+            result = _build_image_result(frame_name, 0, masks, metrics_data, overlay, mineral_map)
+            results.append(result)
+            timeline.append({
+                **keyframe,
+                'timestamp': timestamp,
+                'frame_image_path': result['preview_image_path'],
+                'overlay_image_path': result['overlay_image_path'],
+                'overlay_thumbnail_path': result['overlay_thumbnail_path'],
+                'total_zones': len(result['anomaly_zones']),
+                'anomaly_zones': result['anomaly_zones'],
+            })
+            logger.info(f"🎯 Keyframe {keyframe['frame']} ({timestamp}): {len(result['anomaly_zones'])} zones")
+    except Exception as e:
+        logger.error(f"❌ Error reading video {file.name}: {e}")
+    finally:
+        if spooled is not None:
+            spooled.close()
+    
+    if not results:
+        logger.info("🔄 No keyframe could be analysed, falling back to mock processing")
+        return {**process_image_fallback(file), 'timeline': timeline}
+    
+    # The dashboard shows the most eventful keyframe; the timeline holds them all
+    best = max(results, key=lambda r: (len(r['anomaly_zones']), max([z['confidence'] for z in r['anomaly_zones']] or [0])))
+    result = copy.deepcopy(best)
+    result['original_image_path'] = f"uploads/{file.name}"
+    result['file_info'].update({
+        'filename': file.name,
+        'size_bytes': file.size,
+        'format': file.name.split('.')[-1].upper(),
+    })
+    result['video'] = {
+        **info,
+        'keyframes': len(timeline),
+        'representative_frame': timeline[results.index(best)]['frame'],
+    }
+    result['timeline'] = timeline
+    logger.info(f"🎉 Processed {file.name}: {len(timeline)} keyframes from {info.get('frames_scored')} scored frames")
+    return result
+
+def _zone_masks(masks):
+    """The SAM masks reported as anomaly zones (first three non-empty)."""
+    return [m for m in masks[:3] if m['segmentation'].area]
+
+def _artifact_key(img_rgb, masks, filename):
+    """Name for files derived from one analysis: image stem plus a hash of the pixels and zones."""
+    import hashlib
+    digest = hashlib.sha1(np.ascontiguousarray(img_rgb).data)
+    digest.update(repr([m['segmentation'].bbox for m in _zone_masks(masks)]).encode())
+    return f"{os.path.splitext(os.path.basename(filename))[0]}_{digest.hexdigest()[:12]}"
+
+def save_overlay(img_rgb, masks, filename, key=None):
+    """
+    Render the zone overlay and its thumbnail into media once.
+    
+    Files are keyed by the image content and zone masks, so a re-analysis of
+    the same image reuses them and page views never render anything.
+    
+    Args:
+        img_rgb: Decoded RGB image
+        masks: SAM mask records with CompactMask segmentations
+        filename: Original name of the analysed image
+        key: Precomputed _artifact_key, if the caller has one
+        
+    Returns:
+        dict: overlay_image_path and overlay_thumbnail_path, or None if rendering failed
+    """
+    import logging
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    
+    logger = logging.getLogger(__name__)
+    options = getattr(settings, 'NIKA_OVERLAY', {})
+    fmt = options.get('format', 'webp')
+    zones = _zone_masks(masks)
+    stem = f"overlays/{key or _artifact_key(img_rgb, masks, filename)}"
+    
+    try:
+        paths = {}
+        for field, suffix in (('overlay_image_path', 'overlay'), ('overlay_thumbnail_path', 'thumb')):
+            for ext in dict.fromkeys((fmt, 'jpg')):
+                if default_storage.exists(f"{stem}_{suffix}.{ext}"):
+                    paths[field] = f"{stem}_{suffix}.{ext}"
+                    break
+        if len(paths) == 2:
+            logger.info(f"🖼️ Reusing rendered overlay {paths['overlay_image_path']}")
+            return paths
+        
+        rendered = overlay_renderer.render_overlay(
+            img_rgb, zones, max_side=options.get('max_side', 2048), alpha=options.get('alpha', 0.45)
+        )
+        images = {
+            'overlay_image_path': ('overlay', rendered),
+            'overlay_thumbnail_path': ('thumb', overlay_renderer.thumbnail(rendered, options.get('thumb_side', 320))),
+        }
+        for field, (suffix, image) in images.items():
+            data, ext = overlay_renderer.encode_image(image, fmt, options.get('quality', 85))
+            paths[field] = default_storage.save(f"{stem}_{suffix}.{ext}", ContentFile(data))
+        logger.info(f"🖼️ Rendered overlay {paths['overlay_image_path']}")
+        return paths
+    except Exception as e:
+        logger.error(f"❌ Error rendering overlay: {e}")
+        return None
+
+def build_mineral_map(img_rgb):
+    """
+    Classify every pixel against the mineral library with the colour LUT.
+    
+    Args:
+        img_rgb: Decoded RGB image
+        
+    Returns:
+        np.ndarray: uint8 mineral ids (library.mineral_names), or None when disabled
+    """
+    options = getattr(settings, 'NIKA_MINERAL_LIBRARY', {})
+    if not options.get('pixel_map', True):
+        return None
+    return get_mineral_library().mineral_map(
+        img_rgb, bins=options.get('lut_bins', 32), min_similarity=options.get('min_similarity', 0.0)
+    )
+
+def save_preview(img_rgb, key):
+    """
+    Store the analysed (downscaled) pixels of a large image for display, once per key.
+    
+    Zone coordinates are in these pixels, so the dashboard boxes line up.
+    
+    Returns:
+        str: Storage path, or None if it could not be written
+    """
+    import logging
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    
+    options = getattr(settings, 'NIKA_OVERLAY', {})
+    fmt = options.get('format', 'webp')
+    try:
+        for ext in dict.fromkeys((fmt, 'jpg')):
+            if default_storage.exists(f"previews/{key}.{ext}"):
+                return f"previews/{key}.{ext}"
+        data, ext = overlay_renderer.encode_image(img_rgb, fmt, options.get('quality', 85))
+        return default_storage.save(f"previews/{key}.{ext}", ContentFile(data))
+    except Exception as e:
+        logging.getLogger(__name__).error(f"❌ Error saving preview: {e}")
+        return None
+
+def save_mineral_map(mineral_map, key):
+    """
+    Store the full-resolution mineral map as a lossless label PNG, once per key.
+    
+    Returns:
+        str: Storage path, or None if it could not be written
+    """
+    import cv2
+    import logging
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    
+    path = f"mineral_maps/{key}.png"
+    try:
+        if default_storage.exists(path):
+            return path
+        ok, buf = cv2.imencode('.png', mineral_map)
+        if not ok:
+            raise ValueError('PNG encoding failed')
+        return default_storage.save(path, ContentFile(buf.tobytes()))
+    except Exception as e:
+        logging.getLogger(__name__).error(f"❌ Error saving mineral map: {e}")
+        return None
+
+def _build_image_result(filename, size_bytes, masks, metrics_data, overlay=None, mineral_map=None, source_shape=None):
+    """
+    Convert SAM masks and their segment metrics into the image results format.
+    
+    Args:
+        filename: Original name of the analysed image
+        size_bytes: Size of the uploaded file
+        masks: SAM mask records with CompactMask segmentations
+        metrics_data: Per-segment metrics from sam_utils.metrics_dashboard
+        overlay: Rendered overlay paths from save_overlay, if any
+        mineral_map: Per-pixel mineral ids from build_mineral_map, if any
+        source_shape: (H, W) of the full-resolution source when it was analysed downscaled
+        
+    Returns:
+        dict: Contains anomaly zones, analysis results and overlay image path
+    """
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    # Convert SAM results to anomaly zones format
+    logger.info("🧮 Converting SAM results to anomaly zones...")
+    anomaly_zones = []
+    library = get_mineral_library() if mineral_map is not None else None
+    
+    for i, (mask_data, metrics) in enumerate(zip(masks[:3], metrics_data[:3])):
+        # Extract bounding box from the compact mask
+        seg = mask_data['segmentation']
+        
+        if seg.area == 0:
+            logger.warning(f"⚠️ Empty segment {i+1}, skipping")
+            continue
             
-            zone = {
-                'id': f'zone_{i+1}',
-                'name': f'Anomaly Zone {i+1}',
-                'confidence': round(confidence, 2),
-                'mineral_type': mineral_type,
-                'bounding_box': {
-                    'x': x_min,
-                    'y': y_min,
-                    'width': x_max - x_min,
-                    'height': y_max - y_min
-                },
-                'center_coordinates': {
-                    'x': (x_min + x_max) // 2,
-                    'y': (y_min + y_max) // 2
-                },
-                'characteristics': [
-                    f'Area: {metrics.get("area_%", 0)}% of image',
-                    f'Compactness: {metrics.get("compactness", 0)}',
-                    f'Texture contrast: {metrics.get("texture_contrast", 0)}',
-                    f'Color similarity: {max_sim:.2f}'
-                ],
-                'composition': {
-                    'primary_mineral': round(confidence, 2),
-                    'secondary_minerals': round(1 - confidence, 2)
-                },
-                'ml_metrics': {
-                    'sam_area': mask_data.get('area', 0),
-                    'sam_stability_score': round(mask_data.get('stability_score', 0), 3),
-                    'predicted_iou': round(mask_data.get('predicted_iou', 0), 3),
-                    'texture_homogeneity': round(metrics.get('texture_homogeneity', 0), 3)
-                }
-            }
-            anomaly_zones.append(zone)
-        
-        # Clean up temp file
-        shutil.rmtree(temp_dir)
-        
-        # Create overlay image path (placeholder - in real implementation, generate actual overlay)
-        overlay_image_path = f"uploads/overlays/{file.name.rsplit('.', 1)[0]}_overlay.png"
-        
-        # Generate analysis results
-        analysis_results = {
-            'total_zones': len(anomaly_zones),
-            'high_confidence_zones': len([z for z in anomaly_zones if z['confidence'] > 0.75]),
-            'mineral_types_detected': len(set(z['mineral_type'] for z in anomaly_zones)),
-            'processing_time': round(np.random.uniform(2.1, 12.5), 2),
-            'image_quality': {
-                'resolution': f"{masks[0]['segmentation'].shape[1]}x{masks[0]['segmentation'].shape[0]}" if masks else "800x600",
-                'clarity_score': round(np.random.uniform(0.75, 0.95), 3),
-                'noise_level': round(np.random.uniform(0.05, 0.25), 3),
-                'contrast_score': round(np.random.uniform(0.70, 0.90), 3)
+        x_min, y_min, x_max, y_max = seg.bbox
+        
+        # Determine mineral type based on color similarity
+        mineral_type = 'Unknown'
+        max_sim = 0
+        
+        # Candidates come from the mineral library, best first
+        candidates = metrics.get('mineral_matches', [])
+        if candidates:
+            logger.info(f"🎨 Analyzing colors for segment {i+1}: {metrics['color_sims']}")
+            mineral_type = candidates[0]['mineral']
+            max_sim = candidates[0]['similarity']
+            logger.info(f"🔍 Best match: {mineral_type} (similarity: {max_sim:.3f})")
+        
+        # Calculate confidence based on anomaly score and area
+        confidence = min(metrics.get('anomaly_score', 50) / 100.0, 0.95)
+        logger.info(f"📊 Zone {i+1}: {mineral_type} @ {confidence:.2f} confidence")
+        
+        zone = {
+            'id': f'zone_{i+1}',
+            'name': f'Anomaly Zone {i+1}',
+            'confidence': round(confidence, 2),
+            'mineral_type': mineral_type,
+            'mineral_candidates': [
+                {'mineral': c['mineral'], 'reference': c['key'], 'similarity': c['similarity']}
+                for c in candidates
+            ],
+            'bounding_box': {
+                'x': x_min,
+                'y': y_min,
+                'width': x_max - x_min,
+                'height': y_max - y_min
             },
-            'detection_metrics': {
-                'sensitivity': round(np.random.uniform(0.82, 0.94), 3),
-                'specificity': round(np.random.uniform(0.88, 0.96), 3),
-                'precision': round(np.random.uniform(0.79, 0.91), 3),
-                'detection_threshold': round(np.random.uniform(0.65, 0.75), 3)
+            'center_coordinates': {
+                'x': (x_min + x_max) // 2,
+                'y': (y_min + y_max) // 2
             },
-            'sam_metrics': {
-                'total_masks_generated': len(masks),
-                'masks_analyzed': len(metrics_data),
-                'average_stability': round(np.mean([m.get('stability_score', 0) for m in masks[:10]]), 3),
-                'model_type': 'SAM ViT-H'
+            'characteristics': [
+                f'Area: {metrics.get("area_%", 0)}% of image',
+                f'Compactness: {metrics.get("compactness", 0)}',
+                f'Texture contrast: {metrics.get("texture_contrast", 0)}',
+                f'Color similarity: {max_sim:.2f}'
+            ],
+            'composition': _zone_composition(seg, mineral_map, library, confidence),
+            'ml_metrics': {
+                'sam_area': mask_data.get('area', 0),
+                'sam_stability_score': round(mask_data.get('stability_score', 0), 3),
+                'predicted_iou': round(mask_data.get('predicted_iou', 0), 3),
+                'texture_homogeneity': round(metrics.get('texture_homogeneity', 0), 3)
             }
         }
-        
-        # Build result dictionary
-        result = {
-            'status': 'success',
-            'anomaly_zones': anomaly_zones,
-            'overlay_image_path': overlay_image_path,
-            'original_image_path': f"uploads/{file.name}",
-            'analysis_results': analysis_results,
-            'file_info': {
-                'filename': file.name,
-                'size_bytes': file.size,
-                'format': file.name.split('.')[-1].upper(),
-                'processed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            },
-            'recommendations': generate_mineral_recommendations(anomaly_zones)
+        anomaly_zones.append(zone)
+    
+    # Rendered overlay, or the old placeholder path if rendering failed
+    overlay = overlay or {}
+    overlay_image_path = overlay.get(
+        'overlay_image_path', f"uploads/overlays/{filename.rsplit('.', 1)[0]}_overlay.png"
+    )
+    
+    # Generate analysis results
+    analysis_results = {
+        'total_zones': len(anomaly_zones),
+        'high_confidence_zones': len([z for z in anomaly_zones if z['confidence'] > 0.75]),
+        'mineral_types_detected': len(set(z['mineral_type'] for z in anomaly_zones)),
+        'processing_time': round(np.random.uniform(2.1, 12.5), 2),
+        'image_quality': {
+            'resolution': f"{masks[0]['segmentation'].shape[1]}x{masks[0]['segmentation'].shape[0]}" if masks else "800x600",
+            'clarity_score': round(np.random.uniform(0.75, 0.95), 3),
+            'noise_level': round(np.random.uniform(0.05, 0.25), 3),
+            'contrast_score': round(np.random.uniform(0.70, 0.90), 3)
+        },
+        'detection_metrics': {
+            'sensitivity': round(np.random.uniform(0.82, 0.94), 3),
+            'specificity': round(np.random.uniform(0.88, 0.96), 3),
+            'precision': round(np.random.uniform(0.79, 0.91), 3),
+            'detection_threshold': round(np.random.uniform(0.65, 0.75), 3)
+        },
+        'sam_metrics': {
+            'total_masks_generated': len(masks),
+            'masks_analyzed': len(metrics_data),
+            'average_stability': round(np.mean([m.get('stability_score', 0) for m in masks[:10]]), 3),
+            **_sam_model_metrics()
         }
-        
-    except Exception as e:
-        logger.error(f"❌ Error in image processing: {e}")
-        import traceback
-        logger.error(f"Stack trace: {traceback.format_exc()}")
-        logger.info("🔄 Falling back to mock processing")
-        return process_image_fallback(file)
-    finally:
-        # Cleanup temporary files
-        try:
-            if 'temp_dir' in locals() and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-                logger.info("🧹 Cleaned up temporary files")
-        except Exception as e:
-            logger.warning(f"⚠️ Failed to cleanup temp files: {e}")
+    }
+    if mineral_map is not None:
+        analysis_results['mineral_composition'] = library.composition(mineral_map)
+    
+    # Build result dictionary
+    result = {
+        'status': 'success',
+        'anomaly_zones': anomaly_zones,
+        'overlay_image_path': overlay_image_path,
+        'overlay_thumbnail_path': overlay.get('overlay_thumbnail_path'),
+        'preview_image_path': overlay.get('preview_image_path'),
+        'mineral_map': {
+            'path': overlay.get('mineral_map_path'),
+            'minerals': library.mineral_names,
+            'unknown_id': 255
+        } if mineral_map is not None else None,
+        'original_image_path': f"uploads/{filename}",
+        'analysis_results': analysis_results,
+        'file_info': {
+            'filename': filename,
+            'size_bytes': size_bytes,
+            'format': filename.split('.')[-1].upper(),
+            'processed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        },
+        'recommendations': generate_mineral_recommendations(anomaly_zones)
+    }
+    if source_shape is not None and masks:
+        # Zone coordinates are in analysed pixels; this maps them back to the source
+        height, width = source_shape
+        result['file_info']['source_resolution'] = f"{width}x{height}"
+        result['file_info']['analysis_scale'] = round(masks[0]['segmentation'].shape[1] / width, 6)
     
-    logger.info(f"🎉 Successfully processed {file.name} with {len(anomaly_zones)} anomaly zones")
     return result
 
+def _zone_composition(seg, mineral_map, library, confidence):
+    """Mineral fractions under a zone from the pixel map (confidence split without one)."""
+    if mineral_map is None:
+        return {
+            'primary_mineral': round(confidence, 2),
+            'secondary_minerals': round(1 - confidence, 2)
+        }
+    minerals = library.composition(seg.gather(mineral_map))
+    primary = next(iter(minerals.values()), 0.0)
+    return {
+        'primary_mineral': round(primary, 2),
+        'secondary_minerals': round(1 - primary, 2),
+        'minerals': minerals
+    }
+
+def _sam_model_metrics():
+    """Describe the loaded SAM model (type, quantization, acceleration) for the results."""
+    info = getattr(sam_utils, 'MODEL_INFO', {}) if ML_MODELS_AVAILABLE else {}
+    backbone = {'vit_h': 'ViT-H', 'vit_l': 'ViT-L', 'vit_b': 'ViT-B'}.get(info.get('model_type', 'vit_h'), 'ViT-H')
+    model_name = f'SAM {backbone}'
+    if info.get('quantized'):
+        model_name += ' (INT8)'
+    return {
+        'model_type': model_name,
+        'quantized': bool(info.get('quantized')),
+        'cpu_accel': bool(info.get('cpu_accel')),
+        'device': info.get('device', 'cpu'),
+        'backend': info.get('backend', 'torch'),
+    }
+
 def process_image_fallback(file):
     """Fallback image processing when ML models are not available."""
     import logging
@@ -679,11 +1135,24 @@ def generate_report(results, report_type='csv'):
         response.write("PDF report generation is not available. Please install ReportLab: pip install reportlab")
         return response
     
-    # Create PDF buffer
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
+    build_report(results, report_type, buffer)
+    
+    response = HttpResponse(content_type='application/pdf')
+    filename = f"NIKA_ML_Report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.write(buffer.getvalue())
+    buffer.close()
+    
+    return response
+
+@functools.lru_cache(maxsize=1)
+def _report_styles():
+    """Sample stylesheet plus the report's title and heading styles, built once per process."""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.enums import TA_CENTER
     
-    # Get styles
     styles = getSampleStyleSheet()
     title_style = ParagraphStyle(
         'CustomTitle',
@@ -702,6 +1171,28 @@ def generate_report(results, report_type='csv'):
         spaceBefore=20,
         spaceAfter=10
     )
+    return styles, title_style, heading_style
+
+def build_report(results, report_type, output, full=False):
+    """
+    Render the PDF report into ``output``.
+    
+    Args:
+        results: Dict containing analysis results from process_csv or process_image
+        report_type: 'csv' or 'image' to determine report format
+        output: File path or writable binary file object
+        full: Also list every anomaly (or zone) and embed the overlay image
+    """
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("PDF report generation is not available. Please install ReportLab: pip install reportlab")
+    
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    
+    doc = SimpleDocTemplate(output, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
+    styles, title_style, heading_style = _report_styles()
     
     # Build PDF content
     story = []
@@ -739,22 +1230,18 @@ def generate_report(results, report_type='csv'):
     else:
         story.extend(_generate_image_report_content(results, styles, heading_style))
     
+    story.extend(report_figures.map_page(results, report_type, heading_style))
+    if full:
+        story.extend(report_figures.full_pages(results, report_type, styles, heading_style))
+    
     # Build PDF
     doc.build(story)
-    
-    # Return PDF response
-    pdf_data = buffer.getvalue()
-    buffer.close()
-    
-    response = HttpResponse(content_type='application/pdf')
-    filename = f"NIKA_ML_Report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    response.write(pdf_data)
-    
-    return response
 
 def _generate_csv_report_content(results, styles, heading_style):
     """Generate content specific to CSV analysis reports."""
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
     story = []
     
     # Executive Summary
@@ -837,6 +1324,9 @@ def _generate_csv_report_content(results, styles, heading_style):
 
 def _generate_image_report_content(results, styles, heading_style):
     """Generate content specific to image analysis reports."""
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
     story = []
     
     # Executive Summary
@@ -1,3 +1,156 @@
+import json
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
-# Create your models here.
+
+class AnalysisJob(models.Model):
+    """A CSV or image analysis queued by an upload and run by the job workers."""
+
+    KIND_CHOICES = [
+        ('csv', 'CSV'),
+        ('image', 'Image'),
+        ('video', 'Video'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    stage = models.CharField(max_length=100, default='Queued')
+    progress = models.PositiveSmallIntegerField(default=0)
+    original_name = models.CharField(max_length=255)
+    input_path = models.CharField(max_length=500)
+    run = models.OneToOneField('AnalysisRun', null=True, blank=True, on_delete=models.SET_NULL, related_name='job')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    # Session that uploaded the file (see explorer.access)
+    owner_key = models.CharField(max_length=32, blank=True, db_index=True)
+    # Perceptual hash of analysed images (signed 64-bit), for near-duplicate reuse
+    phash = models.BigIntegerField(null=True, blank=True)
+    # SHA-256 of the uploaded file, taken as it arrived, for exact-duplicate reuse
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # "host:pid" of the process running the job, and when it last reported in (see jobs.recover())
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'{self.get_kind_display()} job {self.id} ({self.status})'
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def to_status(self):
+        """State reported by the job status endpoint."""
+        return {
+            'id': str(self.id),
+            'kind': self.kind,
+            'filename': self.original_name,
+            'status': self.status,
+            'stage': self.stage,
+            'percent': self.progress,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class UploadSession(models.Model):
+    """
+    A chunked, resumable upload (see explorer.uploads).
+
+    Bytes [0, offset) of the file are on disk; a client that lost its
+    connection asks for the offset and sends the rest from there.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=10, choices=AnalysisJob.KIND_CHOICES)
+    original_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # SHA-256 of the whole file, set once the last chunk is in
+    content_hash = models.CharField(max_length=64, blank=True)
+    # Where the assembled file goes in storage, recorded before it is moved there
+    stored_path = models.CharField(max_length=500, blank=True)
+    job = models.OneToOneField(AnalysisJob, null=True, blank=True, on_delete=models.SET_NULL, related_name='upload')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    # Session that started the upload (see explorer.access)
+    owner_key = models.CharField(max_length=32, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Upload {self.id} of {self.original_name} ({self.offset}/{self.size} bytes)'
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.size
+
+
+class AnalysisRun(models.Model):
+    """
+    A finished analysis result, stored compressed and addressed by ID.
+
+    Sessions keep only the run ID, so requests never load or rewrite the
+    (multi-MB for CSVs) result, and results outlive the session.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=10, choices=AnalysisJob.KIND_CHOICES)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='analysis_runs'
+    )
+    owner_key = models.CharField(max_length=32, blank=True, db_index=True)
+    original_name = models.CharField(max_length=255, blank=True)
+    # Image the dashboard shows for an image or video run (large TIFFs and videos: the saved preview)
+    preview_path = models.CharField(max_length=500, blank=True)
+    # Per-row scores of a CSV run (explorer.exports.write_scores), read by the exports without loading the result
+    scores_path = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    size_bytes = models.PositiveIntegerField(default=0)
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='run_created_idx'),
+            models.Index(fields=['kind', '-created_at'], name='run_kind_created_idx'),
+            models.Index(fields=['user', '-created_at'], name='run_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} run {self.id} ({self.original_name})'
+
+    @classmethod
+    def store(cls, kind, result, original_name='', user=None, owner_key='', preview_path=''):
+        """Compress and save a result dict; returns the run."""
+        raw = json.dumps(result, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+        return cls.objects.create(
+            kind=kind, user=user, owner_key=owner_key, original_name=original_name,
+            preview_path=preview_path or '', scores_path=result.get('scores_path') or '',
+            size_bytes=len(raw), data=zlib.compress(raw, 6)
+        )
+
+    def load(self):
+        """The result dict this run was stored with."""
+        return json.loads(zlib.decompress(self.data))
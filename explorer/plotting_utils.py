@@ -1,5 +1,10 @@
-import os
-import base64
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
 from io import BytesIO
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
@@ -8,251 +13,383 @@ import seaborn as sns
 import numpy as np
 import pandas as pd
 from django.conf import settings
+from django.core.cache import caches
 
-def generate_anomaly_plots(results):
+# Everything besides the result that changes the rendered images; part of the cache key
+PLOT_STYLE = 'seaborn-v0_8'
+PLOT_DPI = 150
+PLOT_CACHE_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+# Cache key -> Future of the renders in the pool, so a plot is rendered once however often it is asked for
+_pending = {}
+# pyplot keeps global figure state and is not thread-safe; in-process renders take turns
+_render_lock = threading.Lock()
+
+
+# Anomaly detection (CSV) plots: each takes a process_csv result and returns a figure, or None without data
+
+def _plot_severity_distribution(results):
+    anomalies = results.get('anomalies', [])
+    if not anomalies:
+        return None
+    severities = [a.get('severity', 'Unknown') for a in anomalies]
+    severity_counts = pd.Series(severities).value_counts()
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    colors = {'Critical': '#dc2626', 'High': '#ea580c', 'Medium': '#ca8a04', 'Low': '#65a30d'}
+    bar_colors = [colors.get(severity, '#6b7280') for severity in severity_counts.index]
+
+    bars = ax.bar(severity_counts.index, severity_counts.values, color=bar_colors)
+    ax.set_title('Anomaly Severity Distribution', fontsize=14, fontweight='bold')
+    ax.set_xlabel('Severity Level')
+    ax.set_ylabel('Number of Anomalies')
+
+    # Add value labels on bars
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., height,
+               f'{int(height)}', ha='center', va='bottom')
+
+    plt.tight_layout()
+    return fig
+
+def _plot_confidence_distribution(results):
+    anomalies = results.get('anomalies', [])
+    if not anomalies:
+        return None
+    confidences = [a.get('confidence', 0) for a in anomalies]
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.hist(confidences, bins=10, color='#3b82f6', alpha=0.7, edgecolor='black')
+    ax.set_title('Confidence Score Distribution', fontsize=14, fontweight='bold')
+    ax.set_xlabel('Confidence Score')
+    ax.set_ylabel('Frequency')
+    ax.axvline(np.mean(confidences), color='red', linestyle='--',
+              label=f'Mean: {np.mean(confidences):.3f}')
+    ax.legend()
+
+    plt.tight_layout()
+    return fig
+
+def _plot_performance_comparison(results):
+    metrics = results.get('metrics', {})
+    baseline = metrics.get('baseline_metrics', {})
+    nika = metrics.get('nika_metrics', {})
+    if not (baseline and nika):
+        return None
+
+    metrics_names = ['Precision', 'Recall', 'F1-Score', 'Accuracy']
+    baseline_values = [
+        baseline.get('precision', 0),
+        baseline.get('recall', 0),
+        baseline.get('f1_score', 0),
+        baseline.get('accuracy', 0)
+    ]
+    nika_values = [
+        nika.get('precision', 0),
+        nika.get('recall', 0),
+        nika.get('f1_score', 0),
+        nika.get('accuracy', 0)
+    ]
+
+    x = np.arange(len(metrics_names))
+    width = 0.35
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    bars1 = ax.bar(x - width/2, baseline_values, width, label='Baseline', color='#ef4444')
+    bars2 = ax.bar(x + width/2, nika_values, width, label='NIKA ML', color='#10b981')
+
+    ax.set_title('Performance Comparison: Baseline vs NIKA ML', fontsize=14, fontweight='bold')
+    ax.set_xlabel('Metrics')
+    ax.set_ylabel('Score')
+    ax.set_xticks(x)
+    ax.set_xticklabels(metrics_names)
+    ax.legend()
+    ax.set_ylim(0, 1)
+
+    # Add value labels on bars
+    for bars in [bars1, bars2]:
+        for bar in bars:
+            height = bar.get_height()
+            ax.text(bar.get_x() + bar.get_width()/2., height + 0.01,
+                   f'{height:.3f}', ha='center', va='bottom', fontsize=9)
+
+    plt.tight_layout()
+    return fig
+
+def _plot_timeline(results):
+    timestamps = []
+    for a in results.get('anomalies', []):
+        try:
+            timestamps.append(datetime.strptime(a.get('timestamp', ''), '%Y-%m-%d %H:%M:%S'))
+        except (TypeError, ValueError):
+            continue
+    if not timestamps:
+        return None
+
+    # Group by hour
+    hours = [ts.hour for ts in timestamps]
+    hour_counts = pd.Series(hours).value_counts().sort_index()
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(hour_counts.index, hour_counts.values, marker='o', linewidth=2, markersize=6)
+    ax.set_title('Anomaly Detection Timeline (by Hour)', fontsize=14, fontweight='bold')
+    ax.set_xlabel('Hour of Day')
+    ax.set_ylabel('Number of Anomalies')
+    ax.grid(True, alpha=0.3)
+    ax.set_xticks(range(0, 24, 2))
+
+    plt.tight_layout()
+    return fig
+
+
+# Image analysis plots: each takes a process_image result and returns a figure, or None without data
+
+def _plot_mineral_confidence(results):
+    anomaly_zones = results.get('anomaly_zones', [])
+    if not anomaly_zones:
+        return None
+    mineral_types = [zone.get('mineral_type', 'Unknown') for zone in anomaly_zones]
+    confidences = [zone.get('confidence', 0) for zone in anomaly_zones]
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    colors = ['#e11d48', '#059669', '#dc2626', '#7c3aed', '#ea580c']
+    bars = ax.bar(mineral_types, confidences, color=colors[:len(mineral_types)])
+
+    ax.set_title('Mineral Detection Confidence', fontsize=14, fontweight='bold')
+    ax.set_xlabel('Mineral Type')
+    ax.set_ylabel('Confidence Score')
+    ax.set_ylim(0, 1)
+
+    # Add value labels
+    for bar, conf in zip(bars, confidences):
+        ax.text(bar.get_x() + bar.get_width()/2., conf + 0.02,
+               f'{conf:.2f}', ha='center', va='bottom', fontweight='bold')
+
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+    return fig
+
+def _plot_area_distribution(results):
+    anomaly_zones = results.get('anomaly_zones', [])
+    if not anomaly_zones:
+        return None
+    areas = []
+    zone_names = []
+    for zone in anomaly_zones:
+        bbox = zone.get('bounding_box', {})
+        area = bbox.get('width', 0) * bbox.get('height', 0)
+        areas.append(area)
+        zone_names.append(zone.get('name', 'Zone'))
+
+    fig, ax = plt.subplots(figsize=(8, 8))
+    colors = ['#ef4444', '#10b981', '#3b82f6']
+    wedges, texts, autotexts = ax.pie(areas, labels=zone_names, autopct='%1.1f%%',
+                                    colors=colors, startangle=90)
+
+    ax.set_title('Anomaly Zone Area Distribution', fontsize=14, fontweight='bold')
+    plt.tight_layout()
+    return fig
+
+def _plot_ml_metrics_radar(results):
+    analysis = results.get('analysis_results', {})
+    detection_metrics = analysis.get('detection_metrics', {})
+    if not detection_metrics:
+        return None
+
+    metrics = ['Sensitivity', 'Specificity', 'Precision']
+    values = [
+        detection_metrics.get('sensitivity', 0),
+        detection_metrics.get('specificity', 0),
+        detection_metrics.get('precision', 0)
+    ]
+
+    # Add first value to end to close the circle
+    values += values[:1]
+
+    angles = np.linspace(0, 2 * np.pi, len(metrics), endpoint=False).tolist()
+    angles += angles[:1]
+
+    fig, ax = plt.subplots(figsize=(8, 8), subplot_kw=dict(projection='polar'))
+    ax.plot(angles, values, 'o-', linewidth=2, color='#3b82f6')
+    ax.fill(angles, values, alpha=0.25, color='#3b82f6')
+    ax.set_xticks(angles[:-1])
+    ax.set_xticklabels(metrics)
+    ax.set_ylim(0, 1)
+    ax.set_title('ML Detection Metrics', fontsize=14, fontweight='bold', pad=20)
+    ax.grid(True)
+
+    plt.tight_layout()
+    return fig
+
+
+# Plot name -> figure function, per result kind (the names match chart_data's charts)
+ANOMALY_PLOTS = {
+    'severity_distribution': _plot_severity_distribution,
+    'confidence_distribution': _plot_confidence_distribution,
+    'performance_comparison': _plot_performance_comparison,
+    'timeline': _plot_timeline,
+}
+IMAGE_PLOTS = {
+    'mineral_confidence': _plot_mineral_confidence,
+    'area_distribution': _plot_area_distribution,
+    'ml_metrics_radar': _plot_ml_metrics_radar,
+}
+PLOT_SETS = {
+    'csv': ANOMALY_PLOTS,
+    'image': IMAGE_PLOTS,
+}
+# Result keys each plot reads, with the fields it reads of them (of each item, for lists)
+PLOT_FIELDS = {
+    'severity_distribution': {'anomalies': ('severity',)},
+    'confidence_distribution': {'anomalies': ('confidence',)},
+    'performance_comparison': {'metrics': ('baseline_metrics', 'nika_metrics')},
+    'timeline': {'anomalies': ('timestamp',)},
+    'mineral_confidence': {'anomaly_zones': ('mineral_type', 'confidence')},
+    'area_distribution': {'anomaly_zones': ('bounding_box', 'name')},
+    'ml_metrics_radar': {'analysis_results': ('detection_metrics',)},
+}
+
+def render_plot(kind, name, results):
     """
-    Generate matplotlib plots for anomaly detection results.
-    
+    Render one plot to PNG bytes; runs in the plot worker processes.
+
     Args:
-        results: Results dictionary from process_csv
-        
+        kind: 'csv' or 'image'
+        name: Key of PLOT_SETS[kind]
+        results: Results dictionary from process_csv or process_image (plot_input() of it is enough)
+
     Returns:
-        dict: Contains base64-encoded plot images
+        bytes: PNG image, or None when the result has nothing to plot
     """
-    plots = {}
-    
+    plt.style.use(PLOT_STYLE)
+    sns.set_palette("husl")
+    fig = PLOT_SETS[kind][name](results)
+    if fig is None:
+        return None
     try:
-        # Set style
-        plt.style.use('seaborn-v0_8')
-        sns.set_palette("husl")
-        
-        # 1. Anomaly Severity Distribution
-        anomalies = results.get('anomalies', [])
-        if anomalies:
-            severities = [a.get('severity', 'Unknown') for a in anomalies]
-            severity_counts = pd.Series(severities).value_counts()
-            
-            fig, ax = plt.subplots(figsize=(8, 6))
-            colors = {'Critical': '#dc2626', 'High': '#ea580c', 'Medium': '#ca8a04', 'Low': '#65a30d'}
-            bar_colors = [colors.get(severity, '#6b7280') for severity in severity_counts.index]
-            
-            bars = ax.bar(severity_counts.index, severity_counts.values, color=bar_colors)
-            ax.set_title('Anomaly Severity Distribution', fontsize=14, fontweight='bold')
-            ax.set_xlabel('Severity Level')
-            ax.set_ylabel('Number of Anomalies')
-            
-            # Add value labels on bars
-            for bar in bars:
-                height = bar.get_height()
-                ax.text(bar.get_x() + bar.get_width()/2., height,
-                       f'{int(height)}', ha='center', va='bottom')
-            
-            plt.tight_layout()
-            plots['severity_distribution'] = _fig_to_base64(fig)
-            plt.close(fig)
-        
-        # 2. Confidence Score Distribution
-        if anomalies:
-            confidences = [a.get('confidence', 0) for a in anomalies]
-            
-            fig, ax = plt.subplots(figsize=(8, 6))
-            ax.hist(confidences, bins=10, color='#3b82f6', alpha=0.7, edgecolor='black')
-            ax.set_title('Confidence Score Distribution', fontsize=14, fontweight='bold')
-            ax.set_xlabel('Confidence Score')
-            ax.set_ylabel('Frequency')
-            ax.axvline(np.mean(confidences), color='red', linestyle='--', 
-                      label=f'Mean: {np.mean(confidences):.3f}')
-            ax.legend()
-            
-            plt.tight_layout()
-            plots['confidence_distribution'] = _fig_to_base64(fig)
-            plt.close(fig)
-        
-        # 3. Performance Comparison
-        metrics = results.get('metrics', {})
-        baseline = metrics.get('baseline_metrics', {})
-        nika = metrics.get('nika_metrics', {})
-        
-        if baseline and nika:
-            metrics_names = ['Precision', 'Recall', 'F1-Score', 'Accuracy']
-            baseline_values = [
-                baseline.get('precision', 0),
-                baseline.get('recall', 0), 
-                baseline.get('f1_score', 0),
-                baseline.get('accuracy', 0)
-            ]
-            nika_values = [
-                nika.get('precision', 0),
-                nika.get('recall', 0),
-                nika.get('f1_score', 0), 
-                nika.get('accuracy', 0)
-            ]
-            
-            x = np.arange(len(metrics_names))
-            width = 0.35
-            
-            fig, ax = plt.subplots(figsize=(10, 6))
-            bars1 = ax.bar(x - width/2, baseline_values, width, label='Baseline', color='#ef4444')
-            bars2 = ax.bar(x + width/2, nika_values, width, label='NIKA ML', color='#10b981')
-            
-            ax.set_title('Performance Comparison: Baseline vs NIKA ML', fontsize=14, fontweight='bold')
-            ax.set_xlabel('Metrics')
-            ax.set_ylabel('Score')
-            ax.set_xticks(x)
-            ax.set_xticklabels(metrics_names)
-            ax.legend()
-            ax.set_ylim(0, 1)
-            
-            # Add value labels on bars
-            for bars in [bars1, bars2]:
-                for bar in bars:
-                    height = bar.get_height()
-                    ax.text(bar.get_x() + bar.get_width()/2., height + 0.01,
-                           f'{height:.3f}', ha='center', va='bottom', fontsize=9)
-            
-            plt.tight_layout()
-            plots['performance_comparison'] = _fig_to_base64(fig)
-            plt.close(fig)
-        
-        # 4. Anomaly Timeline (mock data based on timestamps)
-        if anomalies:
-            # Create mock timeline data
-            timestamps = []
-            for a in anomalies:
-                try:
-                    from datetime import datetime
-                    ts = datetime.strptime(a.get('timestamp', ''), '%Y-%m-%d %H:%M:%S')
-                    timestamps.append(ts)
-                except:
-                    continue
-            
-            if timestamps:
-                # Group by hour
-                hours = [ts.hour for ts in timestamps]
-                hour_counts = pd.Series(hours).value_counts().sort_index()
-                
-                fig, ax = plt.subplots(figsize=(10, 6))
-                ax.plot(hour_counts.index, hour_counts.values, marker='o', linewidth=2, markersize=6)
-                ax.set_title('Anomaly Detection Timeline (by Hour)', fontsize=14, fontweight='bold')
-                ax.set_xlabel('Hour of Day')
-                ax.set_ylabel('Number of Anomalies')
-                ax.grid(True, alpha=0.3)
-                ax.set_xticks(range(0, 24, 2))
-                
-                plt.tight_layout()
-                plots['timeline'] = _fig_to_base64(fig)
-                plt.close(fig)
-        
-    except Exception as e:
-        print(f"Error generating plots: {e}")
-    
-    return plots
-
-def generate_image_plots(results):
+        buffer = BytesIO()
+        fig.savefig(buffer, format='png', dpi=PLOT_DPI, bbox_inches='tight')
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+def _render_in_process(kind, name, results):
+    with _render_lock:
+        return render_plot(kind, name, results)
+
+def get_pool():
+    """Process pool the plot endpoints render in, created on first use; None renders in-process."""
+    global _pool
+    workers = getattr(settings, 'NIKA_PLOTS', {}).get('workers', 2)
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a web process that runs job threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def plot_cache():
+    """The 'plots' cache (see CACHES in settings), or the default cache without one."""
+    return caches['plots' if 'plots' in settings.CACHES else 'default']
+
+def cache_key(kind, name, result_id):
+    """Cache key of one rendered plot: the result's identity plus everything that changes the image."""
+    return f"plot:{kind}:{name}:{result_id}:{PLOT_STYLE}:{PLOT_DPI}:{PLOT_CACHE_VERSION}"
+
+def cached_plot(kind, name, result_id):
+    """A rendered plot from the 'plots' cache: PNG bytes, b'' for a plot without data, None if not rendered yet."""
+    return plot_cache().get(cache_key(kind, name, result_id))
+
+def plot_input(name, results):
+    """The part of a result one plot reads (PLOT_FIELDS), which is all that is sent to the worker."""
+    trimmed = {}
+    for key, fields in PLOT_FIELDS[name].items():
+        if key in results:
+            trimmed[key] = _pick(results[key], fields)
+    return trimmed
+
+def _pick(value, fields):
+    if isinstance(value, dict):
+        return {field: value[field] for field in fields if field in value}
+    if isinstance(value, list):
+        return [_pick(item, fields) for item in value]
+    return value
+
+def schedule(kind, name, result_id, load_results):
+    """
+    Render a plot in the plot workers unless it already is being rendered.
+
+    The PNG is put in the 'plots' cache when it is done, whether or not
+    anyone still waits for it.
+
+    Returns:
+        Future: PNG bytes, or b'' when the result has nothing to plot
     """
-    Generate matplotlib plots for image analysis results.
-    
+    if name not in PLOT_SETS.get(kind, {}):
+        raise KeyError(f"Unknown plot {kind}/{name}")
+    key = cache_key(kind, name, result_id)
+    with _pool_lock:
+        future = _pending.get(key)
+    if future is not None:
+        return future
+
+    results = plot_input(name, load_results())
+    pool = get_pool()
+    if pool is None:
+        future = Future()
+        future.set_result(_render_in_process(kind, name, results) or b'')
+        plot_cache().set(key, future.result())
+        return future
+    future = pool.submit(_render_or_empty, kind, name, results)
+    with _pool_lock:
+        future = _pending.setdefault(key, future)
+    future.add_done_callback(functools.partial(_rendered, key))
+    return future
+
+def _render_or_empty(kind, name, results):
+    return render_plot(kind, name, results) or b''
+
+def _rendered(key, future):
+    global _pool
+    with _pool_lock:
+        _pending.pop(key, None)
+    error = future.exception()
+    if error is None:
+        plot_cache().set(key, future.result())
+    elif isinstance(error, BrokenProcessPool):
+        # A worker died (e.g. OOM-killed); start a fresh pool next time
+        with _pool_lock:
+            _pool = None
+    else:
+        logger.error(f"❌ Rendering plot {key} failed: {error}")
+
+def plot_png(kind, name, result_id, load_results, wait=None):
+    """
+    One plot of a stored result as PNG, rendered on demand and then served from the 'plots' cache.
+
     Args:
-        results: Results dictionary from process_image
-        
+        kind: 'csv' or 'image'
+        name: Key of PLOT_SETS[kind] (KeyError otherwise)
+        result_id: Identity of the (immutable) result, e.g. its AnalysisRun ID
+        load_results: Callable returning the result dictionary, only called on a cache miss
+        wait: Seconds to wait for a render (default NIKA_PLOTS['wait_seconds'])
+
     Returns:
-        dict: Contains base64-encoded plot images
+        bytes: PNG image, b'' when the result has nothing to plot, or None if
+            the render is still running after ``wait`` (it goes on, into the cache)
     """
-    plots = {}
-    
+    png = cached_plot(kind, name, result_id)
+    if png is not None:
+        return png
+    if wait is None:
+        wait = getattr(settings, 'NIKA_PLOTS', {}).get('wait_seconds', 5)
     try:
-        plt.style.use('seaborn-v0_8')
-        sns.set_palette("husl")
-        
-        anomaly_zones = results.get('anomaly_zones', [])
-        
-        # 1. Confidence by Mineral Type
-        if anomaly_zones:
-            mineral_types = [zone.get('mineral_type', 'Unknown') for zone in anomaly_zones]
-            confidences = [zone.get('confidence', 0) for zone in anomaly_zones]
-            
-            fig, ax = plt.subplots(figsize=(8, 6))
-            colors = ['#e11d48', '#059669', '#dc2626', '#7c3aed', '#ea580c']
-            bars = ax.bar(mineral_types, confidences, color=colors[:len(mineral_types)])
-            
-            ax.set_title('Mineral Detection Confidence', fontsize=14, fontweight='bold')
-            ax.set_xlabel('Mineral Type')
-            ax.set_ylabel('Confidence Score')
-            ax.set_ylim(0, 1)
-            
-            # Add value labels
-            for bar, conf in zip(bars, confidences):
-                ax.text(bar.get_x() + bar.get_width()/2., conf + 0.02,
-                       f'{conf:.2f}', ha='center', va='bottom', fontweight='bold')
-            
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            plots['mineral_confidence'] = _fig_to_base64(fig)
-            plt.close(fig)
-        
-        # 2. Zone Area Distribution
-        if anomaly_zones:
-            areas = []
-            zone_names = []
-            for zone in anomaly_zones:
-                bbox = zone.get('bounding_box', {})
-                area = bbox.get('width', 0) * bbox.get('height', 0)
-                areas.append(area)
-                zone_names.append(zone.get('name', 'Zone'))
-            
-            fig, ax = plt.subplots(figsize=(8, 8))
-            colors = ['#ef4444', '#10b981', '#3b82f6']
-            wedges, texts, autotexts = ax.pie(areas, labels=zone_names, autopct='%1.1f%%', 
-                                            colors=colors, startangle=90)
-            
-            ax.set_title('Anomaly Zone Area Distribution', fontsize=14, fontweight='bold')
-            plt.tight_layout()
-            plots['area_distribution'] = _fig_to_base64(fig)
-            plt.close(fig)
-        
-        # 3. ML Metrics Radar Chart
-        analysis = results.get('analysis_results', {})
-        detection_metrics = analysis.get('detection_metrics', {})
-        
-        if detection_metrics:
-            metrics = ['Sensitivity', 'Specificity', 'Precision']
-            values = [
-                detection_metrics.get('sensitivity', 0),
-                detection_metrics.get('specificity', 0),
-                detection_metrics.get('precision', 0)
-            ]
-            
-            # Add first value to end to close the circle
-            values += values[:1]
-            
-            angles = np.linspace(0, 2 * np.pi, len(metrics), endpoint=False).tolist()
-            angles += angles[:1]
-            
-            fig, ax = plt.subplots(figsize=(8, 8), subplot_kw=dict(projection='polar'))
-            ax.plot(angles, values, 'o-', linewidth=2, color='#3b82f6')
-            ax.fill(angles, values, alpha=0.25, color='#3b82f6')
-            ax.set_xticks(angles[:-1])
-            ax.set_xticklabels(metrics)
-            ax.set_ylim(0, 1)
-            ax.set_title('ML Detection Metrics', fontsize=14, fontweight='bold', pad=20)
-            ax.grid(True)
-            
-            plt.tight_layout()
-            plots['ml_metrics_radar'] = _fig_to_base64(fig)
-            plt.close(fig)
-        
-    except Exception as e:
-        print(f"Error generating image plots: {e}")
-    
-    return plots
-
-def _fig_to_base64(fig):
-    """Convert matplotlib figure to base64 string."""
-    buffer = BytesIO()
-    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
-    buffer.seek(0)
-    image_png = buffer.getvalue()
-    buffer.close()
-    graphic = base64.b64encode(image_png)
-    graphic = graphic.decode('utf-8')
-    return graphic
\ No newline at end of file
+        return schedule(kind, name, result_id, load_results).result(timeout=wait)
+    except (TimeoutError, BrokenProcessPool):
+        return None
@@ -0,0 +1,395 @@
+"""
+Report pages whose size follows the data: the anomaly map, the full anomaly
+tables and the embedded overlay.
+
+A run can hold a hundred thousand anomalies, so nothing here grows without
+bound. Anomaly maps plot each anomaly up to NIKA_REPORTS['map_max_points']
+and aggregate larger sets into a fixed grid of density bins. Full tables are
+LongTables of TABLE_CHUNK_ROWS rows with fixed column widths and row heights
+and one shared TableStyle, so ReportLab never measures a cell. Overlays are
+embedded as JPEGs no larger than NIKA_REPORTS['image_max_side'] pixels.
+"""
+import functools
+import io
+import logging
+import math
+import re
+
+import numpy as np
+from django.conf import settings
+
+from .lazy import available, lazy_import
+
+logger = logging.getLogger(__name__)
+
+cv2 = lazy_import('cv2')
+
+# Rows per LongTable; each table is laid out and dropped before the next one
+TABLE_CHUNK_ROWS = 500
+ROW_HEIGHT = 12
+
+SEVERITY_COLOURS = {
+    'Critical': '#dc2626',
+    'High': '#f97316',
+    'Medium': '#eab308',
+    'Low': '#16a34a',
+}
+OTHER_COLOUR = '#6b7280'
+
+ANOMALY_COLUMNS = ['ID', 'Type', 'Severity', 'Confidence', 'Score', 'Row']
+ZONE_COLUMNS = ['Zone', 'Mineral Type', 'Confidence', 'Center (x, y)', 'Box (w x h)']
+
+
+def _options():
+    return getattr(settings, 'NIKA_REPORTS', {})
+
+
+@functools.lru_cache(maxsize=1)
+def _table_style():
+    """The TableStyle every full-table chunk shares, built once per process."""
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#dc2626')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        # Left-aligned cells are drawn without measuring their text
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('TOPPADDING', (0, 0), (-1, -1), 1),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9fafb')]),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#d1d5db')),
+    ])
+
+
+def _format(value, spec):
+    if value is None or value == '':
+        return 'N/A'
+    try:
+        return format(value, spec)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+@functools.lru_cache(maxsize=1)
+def _deferred_table():
+    """The DeferredTable flowable class (defined on first use, so reportlab is only imported then)."""
+    from reportlab.platypus import Flowable, LongTable
+
+    class DeferredTable(Flowable):
+        """
+        One chunk of a long table, whose cells are formatted and LongTable built
+        only when the frame reaches it; a page's worth of rows is split off and
+        drawn, and the rest is dropped once it is. So only about one chunk of
+        cells exists at a time, however long the table.
+        """
+
+        def __init__(self, header, items, format_row, col_widths):
+            super().__init__()
+            self._args = (header, items, format_row, col_widths)
+            self._table = None
+
+        def _get(self):
+            if self._table is None:
+                header, items, format_row, col_widths = self._args
+                chunk = [header] + [format_row(n, item) for n, item in items]
+                self._table = LongTable(chunk, colWidths=col_widths, rowHeights=[ROW_HEIGHT] * len(chunk), repeatRows=1)
+                self._table.setStyle(_table_style())
+                self._args = None
+            return self._table
+
+        def wrap(self, avail_width, avail_height):
+            self.width, self.height = self._get().wrap(avail_width, avail_height)
+            return self.width, self.height
+
+        def split(self, avail_width, avail_height):
+            return self._get().split(avail_width, avail_height)
+
+        def drawOn(self, canvas, x, y, _sW=0):
+            self._get().drawOn(canvas, x, y, _sW)
+
+    return DeferredTable
+
+
+def _long_tables(header, items, format_row, col_widths):
+    """
+    One table row per item, as LongTables of TABLE_CHUNK_ROWS rows that repeat
+    the header on every page and are built only when they are laid out.
+    ``format_row(n, item)`` gives the cells of the n-th item (from 1).
+    """
+    DeferredTable = _deferred_table()
+    return [
+        DeferredTable(header, enumerate(items[start:start + TABLE_CHUNK_ROWS], start + 1), format_row, col_widths)
+        for start in range(0, len(items), TABLE_CHUNK_ROWS)
+    ]
+
+
+def _anomaly_row(n, anomaly):
+    return [
+        str(anomaly.get('id', 'N/A'))[:24],
+        str(anomaly.get('type', 'N/A'))[:32],
+        str(anomaly.get('severity', 'N/A')),
+        _format(anomaly.get('confidence'), '.3f'),
+        _format(anomaly.get('anomaly_score'), '.4f'),
+        _format(anomaly.get('row_index'), 'd'),
+    ]
+
+
+def _zone_row(n, zone):
+    center = zone.get('center_coordinates', {})
+    box = zone.get('bounding_box', {})
+    return [
+        f"Zone {n}",
+        str(zone.get('mineral_type', 'Unknown'))[:32],
+        _format(zone.get('confidence'), '.2f'),
+        f"({center.get('x', 0)}, {center.get('y', 0)})",
+        f"{box.get('width', 0)} x {box.get('height', 0)}",
+    ]
+
+
+def anomaly_tables(anomalies):
+    """Every anomaly of a CSV result, one row each, as a list of table flowables."""
+    from reportlab.lib.units import inch
+
+    widths = [1.2*inch, 2*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.8*inch]
+    return _long_tables(ANOMALY_COLUMNS, anomalies, _anomaly_row, widths)
+
+
+def zone_tables(zones):
+    """Every zone of an image result, one row each, as a list of table flowables."""
+    from reportlab.lib.units import inch
+
+    widths = [0.8*inch, 2*inch, 0.9*inch, 1.3*inch, 1.3*inch]
+    return _long_tables(ZONE_COLUMNS, zones, _zone_row, widths)
+
+
+# Anomaly map
+
+def _image_extent(results, zones):
+    """Analysed image size (width, height), from the result or else the zone boxes."""
+    resolution = results.get('analysis_results', {}).get('image_quality', {}).get('resolution', '')
+    match = re.fullmatch(r'(\d+)x(\d+)', str(resolution))
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    right = max((z.get('bounding_box', {}).get('x', 0) + z.get('bounding_box', {}).get('width', 0) for z in zones), default=1)
+    bottom = max((z.get('bounding_box', {}).get('y', 0) + z.get('bounding_box', {}).get('height', 0) for z in zones), default=1)
+    return max(right, 1), max(bottom, 1)
+
+
+def anomaly_positions(results, report_type):
+    """
+    Where each anomaly lies, in data coordinates.
+
+    CSV anomalies are placed by input row (x) and anomaly score (y, confidence
+    when there is no score); image zones by their center pixel, with y pointing
+    down as in the image.
+
+    Returns:
+        dict: x, y (float arrays), severity (list), extent (x0, x1, y0, y1),
+        x_label, y_label, noun (what is counted) and flip_y
+    """
+    if report_type == 'csv':
+        anomalies = results.get('anomalies', [])
+        n = len(anomalies)
+        x = np.fromiter((a.get('row_index', i) for i, a in enumerate(anomalies)), dtype=float, count=n)
+        y = np.fromiter(
+            (a.get('anomaly_score', a.get('confidence', 0)) or 0 for a in anomalies), dtype=float, count=n
+        )
+        severity = [a.get('severity') for a in anomalies]
+        has_score = bool(anomalies) and 'anomaly_score' in anomalies[0]
+        extent = (
+            float(x.min()) if n else 0.0, float(x.max()) if n else 1.0,
+            float(y.min()) if n else 0.0, float(y.max()) if n else 1.0,
+        )
+        return {
+            'x': x, 'y': y, 'severity': severity, 'extent': extent, 'flip_y': False,
+            'x_label': 'Input row', 'y_label': 'Anomaly score' if has_score else 'Confidence', 'noun': 'anomalies',
+        }
+
+    zones = results.get('anomaly_zones', [])
+    n = len(zones)
+    x = np.fromiter((z.get('center_coordinates', {}).get('x', 0) for z in zones), dtype=float, count=n)
+    y = np.fromiter((z.get('center_coordinates', {}).get('y', 0) for z in zones), dtype=float, count=n)
+    severity = [_zone_severity(z.get('confidence', 0)) for z in zones]
+    width, height = _image_extent(results, zones)
+    return {
+        'x': x, 'y': y, 'severity': severity, 'extent': (0.0, float(width), 0.0, float(height)), 'flip_y': True,
+        'x_label': 'Image x (px)', 'y_label': 'Image y (px)', 'noun': 'zones',
+    }
+
+
+def _zone_severity(confidence):
+    # Zone confidences are 0-1 in ML results and percentages in fallback results
+    confidence = confidence / 100.0 if confidence > 1 else confidence
+    if confidence > 0.85:
+        return 'Critical'
+    if confidence > 0.75:
+        return 'High'
+    if confidence > 0.6:
+        return 'Medium'
+    return 'Low'
+
+
+def _tick(value):
+    return f"{value:,.0f}" if abs(value) >= 1000 or float(value).is_integer() else f"{value:.3g}"
+
+
+def anomaly_map(results, report_type, width=None, height=None):
+    """
+    Drawing of the anomaly positions: one marker per anomaly, coloured by
+    severity, or density bins once there are more than
+    NIKA_REPORTS['map_max_points'].
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from reportlab.graphics.shapes import Circle, Drawing, Group, Rect, String
+
+    width = width or 6*inch
+    height = height or 4*inch
+    positions = anomaly_positions(results, report_type)
+    x, y = positions['x'], positions['y']
+    x0, x1, y0, y1 = positions['extent']
+    if x1 <= x0:
+        x0, x1 = x0 - 0.5, x1 + 0.5
+    if y1 <= y0:
+        y0, y1 = y0 - 0.5, y1 + 0.5
+
+    # Plot area inside the drawing, leaving room for the axis labels and legend
+    left, bottom = 0.55*inch, 0.75*inch
+    plot_w, plot_h = width - left - 0.15*inch, height - bottom - 0.15*inch
+
+    def to_page(px, py):
+        u = left + (px - x0) / (x1 - x0) * plot_w
+        v = (py - y0) / (y1 - y0) * plot_h
+        return u, bottom + (plot_h - v if positions['flip_y'] else v)
+
+    drawing = Drawing(width, height)
+    drawing.add(Rect(left, bottom, plot_w, plot_h, fillColor=colors.HexColor('#f8fafc'), strokeColor=colors.gray))
+    for i in range(1, 4):
+        drawing.add(Rect(left + i * plot_w / 4, bottom, 0.5, plot_h, fillColor=colors.HexColor('#e2e8f0'), strokeWidth=0))
+        drawing.add(Rect(left, bottom + i * plot_h / 4, plot_w, 0.5, fillColor=colors.HexColor('#e2e8f0'), strokeWidth=0))
+
+    max_points = _options().get('map_max_points', 2000)
+    if len(x) <= max_points:
+        for px, py, severity in zip(x, y, positions['severity']):
+            u, v = to_page(px, py)
+            colour = colors.HexColor(SEVERITY_COLOURS.get(severity, OTHER_COLOUR))
+            drawing.add(Circle(u, v, 3, fillColor=colour, fillOpacity=0.8, strokeColor=colors.black, strokeWidth=0.3))
+        legend = [(colors.HexColor(c), label) for label, c in SEVERITY_COLOURS.items()]
+        caption = f"{len(x):,} {positions['noun']}, one marker each"
+    else:
+        bins_x = _options().get('map_bins', 60)
+        bins_y = max(1, round(bins_x * plot_h / plot_w))
+        counts, _, _ = np.histogram2d(x, y, bins=(bins_x, bins_y), range=((x0, x1), (y0, y1)))
+        peak = counts.max()
+        low, high = colors.HexColor('#fde68a'), colors.HexColor('#b91c1c')
+        cell_w, cell_h = plot_w / bins_x, plot_h / bins_y
+        for i, j in zip(*np.nonzero(counts)):
+            # Log scale, so sparse bins stay visible next to dense ones
+            level = math.log1p(counts[i, j]) / math.log1p(peak)
+            colour = colors.linearlyInterpolatedColor(low, high, 0, 1, level)
+            row = bins_y - 1 - j if positions['flip_y'] else j
+            drawing.add(Rect(left + i * cell_w, bottom + row * cell_h, cell_w, cell_h, fillColor=colour, strokeWidth=0))
+        legend = [(low, '1 per bin'), (colors.linearlyInterpolatedColor(low, high, 0, 1, 0.5), 'Dense'),
+                  (high, f"{int(peak):,} per bin")]
+        caption = f"{len(x):,} {positions['noun']} in {bins_x} x {bins_y} density bins"
+
+    # Axes: the extent at the corners, the variable names along the sides
+    top_y, low_y = (y0, y1) if positions['flip_y'] else (y1, y0)
+    drawing.add(String(left, bottom - 10, _tick(x0), fontSize=7))
+    drawing.add(String(left + plot_w, bottom - 10, _tick(x1), fontSize=7, textAnchor='end'))
+    drawing.add(String(left + plot_w / 2, bottom - 10, positions['x_label'], fontSize=8, textAnchor='middle'))
+    drawing.add(String(left - 4, bottom, _tick(low_y), fontSize=7, textAnchor='end'))
+    drawing.add(String(left - 4, bottom + plot_h - 7, _tick(top_y), fontSize=7, textAnchor='end'))
+    # Rotated a quarter turn to run up the y axis
+    drawing.add(Group(
+        String(0, 0, positions['y_label'], fontSize=8, textAnchor='middle'),
+        transform=(0, 1, -1, 0, left - 8, bottom + plot_h / 2),
+    ))
+
+    legend_y = 0.25*inch
+    for i, (colour, label) in enumerate(legend):
+        lx = left + i * 1.3*inch
+        drawing.add(Rect(lx - 4, legend_y - 4, 8, 8, fillColor=colour, strokeColor=colors.black, strokeWidth=0.5))
+        drawing.add(String(lx + 8, legend_y - 3, label, fontSize=8))
+    drawing.add(String(width - 0.15*inch, legend_y - 3, caption, fontSize=8, textAnchor='end'))
+    return drawing
+
+
+def map_page(results, report_type, heading_style):
+    """The anomaly map page: a page break, its heading and the map."""
+    from reportlab.platypus import PageBreak, Paragraph
+
+    return [PageBreak(), Paragraph("Anomaly Distribution Map", heading_style), anomaly_map(results, report_type)]
+
+
+# Overlay
+
+def overlay_image(path, width, height):
+    """
+    The stored image at ``path`` as a report Image: re-encoded as a JPEG of at
+    most NIKA_REPORTS['image_max_side'] px and fitted into width x height points.
+
+    Returns:
+        Image or None if the file is missing or cannot be decoded
+    """
+    from django.core.files.storage import default_storage
+    from reportlab.platypus import Image
+
+    if not path or not available('cv2') or not default_storage.exists(path):
+        return None
+    try:
+        with default_storage.open(path, 'rb') as f:
+            img = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        h, w = img.shape[:2]
+        scale = min(1.0, _options().get('image_max_side', 1600) / max(h, w))
+        if scale < 1.0:
+            img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+            h, w = img.shape[:2]
+        ok, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, _options().get('image_quality', 80)])
+        if not ok:
+            return None
+    except Exception as e:
+        logger.error(f"❌ Could not embed {path} in the report: {e}")
+        return None
+    fit = min(width / w, height / h)
+    return Image(io.BytesIO(data.tobytes()), width=w * fit, height=h * fit)
+
+
+def full_pages(results, report_type, styles, heading_style):
+    """The pages only the full report has: the overlay and every anomaly or zone."""
+    from reportlab.lib.units import inch
+    from reportlab.platypus import PageBreak, Paragraph, Spacer
+
+    story = []
+    max_rows = _options().get('full_max_rows', 100000)
+    if report_type == 'csv':
+        anomalies = results.get('anomalies', [])
+        story += [PageBreak(), Paragraph(f"All Anomalies ({len(anomalies):,})", heading_style)]
+        if len(anomalies) > max_rows:
+            story.append(Paragraph(
+                f"The first {max_rows:,} are listed; the anomaly export (CSV, Excel, JSON) has all of them.",
+                styles['Normal'],
+            ))
+        if anomalies:
+            story += anomaly_tables(anomalies[:max_rows])
+        else:
+            story.append(Paragraph("No anomalies were detected.", styles['Normal']))
+        return story
+
+    overlay = overlay_image(results.get('overlay_image_path') or results.get('preview_image_path'), 6*inch, 7*inch)
+    if overlay is not None:
+        story += [PageBreak(), Paragraph("Zone Overlay", heading_style), overlay, Spacer(1, 0.2*inch)]
+    zones = results.get('anomaly_zones', [])
+    story += [PageBreak(), Paragraph(f"All Mineral Zones ({len(zones):,})", heading_style)]
+    if zones:
+        story += zone_tables(zones[:max_rows])
+    else:
+        story.append(Paragraph("No zones were detected.", styles['Normal']))
+    return story
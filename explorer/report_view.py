@@ -1,116 +1,92 @@
-def download_report(request):
+import os
+
+from django.contrib import messages
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .models import AnalysisRun
+from . import access, reports
+
+
+def _is_ajax(request):
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
+
+def _wants_full(request):
+    return request.GET.get('full') in ('1', 'true', 'yes')
+
+
+def serve_report(request, run, full=False):
     """
-    Generate and download a PDF report based on session data or mock data.
+    Send the run's PDF report from the report cache, rendering it first if needed.
+    
+    Answers If-None-Match with 304; a render that takes longer than
+    NIKA_REPORTS['wait_seconds'] is left running and the client is told to retry.
+    ``full`` selects the full report, with every anomaly and the overlay image.
     """
-    from django.shortcuts import redirect
-    from django.contrib import messages
-    from .utils import generate_report
+    etag = reports.report_etag(run, full)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
     
-    # For demo purposes, we'll generate a mock report
-    # In a real application, you would retrieve actual results from session/database
+    try:
+        path = reports.get_report(run, full=full)
+    except Exception as e:
+        messages.error(request, f'Error generating report: {str(e)}')
+        return redirect('dashboard')
     
+    if path is None:
+        return _still_rendering(request)
+    return _report_file(run, path, full, etag)
+
+
+def _still_rendering(request):
+    if _is_ajax(request):
+        response = JsonResponse({'status': 'rendering'}, status=202)
+        response['Retry-After'] = '5'
+        return response
+    messages.info(request, 'The report is still being prepared. Please try the download again in a moment.')
+    return redirect('dashboard')
+
+
+def _report_file(run, path, full, etag):
+    stem = os.path.splitext(run.original_name)[0] or 'results'
+    response = FileResponse(
+        default_storage.open(path, 'rb'),
+        as_attachment=True,
+        filename=f"NIKA_Report_{reports.report_type(run)}_{stem}{'_full' if full else ''}.pdf",
+        content_type='application/pdf',
+    )
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def run_report(request, run_id):
+    """
+    Download the PDF report of a stored run (?full=1 for the full report).
+    """
+    run = access.owned(AnalysisRun.objects.all(), request).filter(pk=run_id).first()
+    if run is None:
+        raise Http404('Unknown run')
+    return serve_report(request, run, _wants_full(request))
+
+
+def download_report(request):
+    """
+    Download the PDF report of the CSV (?type=csv) or image (?type=image) run the session shows
+    (?full=1 for the full report).
+    """
     report_type = request.GET.get('type', 'csv')
+    slot = 'image' if report_type == 'image' else 'csv'
     
-    if report_type == 'csv':
-        # Generate mock CSV results for demo
-        mock_results = {
-            'status': 'success',
-            'file_info': {
-                'filename': 'sample_data.csv',
-                'size_bytes': 2048000,
-                'processed_at': '2025-09-28 14:30:00'
-            },
-            'metrics': {
-                'total_records': 5000,
-                'anomalies_detected': 12,
-                'processing_time': 3.2,
-                'baseline_metrics': {
-                    'f1_score': 0.600,
-                    'precision': 0.580,
-                    'recall': 0.620,
-                    'accuracy': 0.820
-                },
-                'nika_metrics': {
-                    'f1_score': 0.780,
-                    'precision': 0.785,
-                    'recall': 0.775,
-                    'accuracy': 0.920
-                },
-                'improvement_percentage': {
-                    'f1_score': 30.0,
-                    'precision': 18.5,
-                    'recall': 15.2,
-                    'accuracy': 12.8
-                }
-            },
-            'anomalies': [
-                {
-                    'id': 'anomaly_1',
-                    'type': 'Statistical Outlier',
-                    'severity': 'Critical',
-                    'confidence': 0.945,
-                    'timestamp': '2025-09-28 10:15:23'
-                },
-                {
-                    'id': 'anomaly_2',
-                    'type': 'Temporal Pattern Deviation',
-                    'severity': 'High',
-                    'confidence': 0.887,
-                    'timestamp': '2025-09-28 11:22:15'
-                }
-            ]
-        }
-    else:
-        # Generate mock image results for demo
-        mock_results = {
-            'status': 'success',
-            'file_info': {
-                'filename': 'inspection_image.jpg',
-                'format': 'JPG',
-                'size_bytes': 1024000,
-                'processed_at': '2025-09-28 14:30:00'
-            },
-            'analysis_results': {
-                'total_patches': 5,
-                'high_confidence_patches': 3,
-                'critical_anomalies': 2,
-                'processing_time': 8.7,
-                'detection_metrics': {
-                    'sensitivity': 0.892,
-                    'specificity': 0.934,
-                    'precision': 0.856
-                },
-                'image_quality': {
-                    'clarity_score': 0.891,
-                    'contrast_score': 0.823
-                }
-            },
-            'patches': [
-                {
-                    'id': 'patch_1',
-                    'type': 'Surface Crack',
-                    'severity': 'Critical',
-                    'confidence': 0.945,
-                    'center_coordinates': {'x': 234, 'y': 567}
-                },
-                {
-                    'id': 'patch_2',
-                    'type': 'Corrosion Spot',
-                    'severity': 'High',
-                    'confidence': 0.887,
-                    'center_coordinates': {'x': 456, 'y': 123}
-                }
-            ],
-            'recommendations': [
-                "⚠️ Immediate attention required for critical anomalies detected",
-                "🔧 Schedule emergency maintenance for affected areas",
-                "📋 Plan detailed inspection of high-severity anomalies"
-            ]
-        }
+    run_id = request.session.get(f'{slot}_run')
+    run = AnalysisRun.objects.filter(pk=run_id).first() if run_id else None
+    if run is None:
+        label = 'image' if slot == 'image' else 'CSV'
+        messages.error(request, f'No {label} analysis results found. Please upload and analyze a file first.')
+        return redirect('dashboard')
     
-    # Generate and return PDF report
-    try:
-        return generate_report(mock_results, report_type)
-    except Exception as e:
-        messages.error(request, f'Error generating report: {str(e)}')
-        return redirect('dashboard')
\ No newline at end of file
+    return serve_report(request, run, _wants_full(request))
@@ -0,0 +1,178 @@
+"""
+PDF reports of stored analysis runs.
+
+A run's result never changes, so its report is rendered once and kept in
+storage as reports/<run id>-v<REPORT_VERSION>.pdf. Rendering happens in a
+background thread: right after the analysis job finishes, or on the first
+download if it was not pre-rendered. Later downloads only send the file.
+
+The full report (every anomaly or zone, plus the overlay image) is a
+separate file, reports/<run id>-v<REPORT_VERSION>-full.pdf, rendered only
+when it is first asked for. Rendering a report removes the run's copies
+from older REPORT_VERSIONs; the prune_results command removes the rest.
+"""
+import asyncio
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import partial
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Bump when the report layout changes; older stored reports are then re-rendered
+REPORT_VERSION = 2
+
+_executor = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def _options():
+    return getattr(settings, 'NIKA_REPORTS', {})
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_options().get('workers', 1), thread_name_prefix='nika-report')
+    return _executor
+
+
+def report_type(run):
+    """'csv' or 'image' (video runs report their main keyframe like an image)."""
+    return 'csv' if run.kind == 'csv' else 'image'
+
+
+def _variant(run, full):
+    return f"{run.id}-v{REPORT_VERSION}" + ('-full' if full else '')
+
+
+def report_path(run, full=False):
+    return f"reports/{_variant(run, full)}.pdf"
+
+
+def stale_report_paths(run_id, full=None):
+    """Paths a run's reports had under older REPORT_VERSIONs (both variants unless ``full`` is given)."""
+    suffixes = ('', '-full') if full is None else ('-full' if full else '',)
+    return [f"reports/{run_id}-v{version}{suffix}.pdf" for version in range(1, REPORT_VERSION) for suffix in suffixes]
+
+
+def report_etag(run, full=False):
+    """ETag of a run's report: the run, layout version and variant fully determine its content."""
+    return f'"{_variant(run, full)}"'
+
+
+def cached_report(run, full=False):
+    """Storage path of the run's rendered report, or None if it has not been rendered yet."""
+    path = report_path(run, full)
+    return path if default_storage.exists(path) else None
+
+
+def render_report(run, full=False):
+    """
+    Render the run's report into storage, unless it already is there.
+
+    Returns:
+        str: Storage path of the PDF
+    """
+    from .utils import build_report
+
+    path = report_path(run, full)
+    if default_storage.exists(path):
+        return path
+    with tempfile.TemporaryFile() as tmp:
+        build_report(run.load(), report_type(run), tmp, full=full)
+        tmp.seek(0)
+        saved = default_storage.save(path, File(tmp))
+    if saved != path:
+        # Another process stored the same report meanwhile; keep theirs
+        default_storage.delete(saved)
+    for stale in stale_report_paths(run.id, full):
+        default_storage.delete(stale)
+    logger.info(f"📄 Rendered {'full ' if full else ''}{report_type(run)} report for run {run.id}")
+    return path
+
+
+def _render_in_worker(run, full):
+    try:
+        return render_report(run, full)
+    finally:
+        # Report threads outlive the request cycle (a deferred result is read from the
+        # database in them), so release their connection here
+        connection.close()
+
+
+def schedule(run, full=False):
+    """Render the run's report in the background; returns a Future of its storage path."""
+    key = _variant(run, full)
+    executor = _get_executor()
+    with _lock:
+        # Checked and submitted under the lock, so concurrent requests share one render
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        future = _pending[key] = executor.submit(_render_in_worker, run, full)
+    # Outside the lock: the callback runs at once if the render already finished
+    future.add_done_callback(partial(_forget, key))
+    return future
+
+
+def _forget(key, future):
+    with _lock:
+        # A newer render of the same report may have been scheduled since
+        if _pending.get(key) is future:
+            del _pending[key]
+
+
+def prerender(run):
+    """Queue the report of a freshly stored run, if NIKA_REPORTS['prerender'] is on."""
+    if _options().get('prerender', True):
+        schedule(run).add_done_callback(_log_failure)
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error(f"❌ Report pre-rendering failed: {future.exception()}")
+
+
+def get_report(run, wait=None, full=False):
+    """
+    Storage path of the run's report, rendering it if needed.
+
+    Args:
+        run: AnalysisRun
+        wait: Seconds to wait for a render (default NIKA_REPORTS['wait_seconds'])
+        full: The full report rather than the summary
+
+    Returns:
+        str: Storage path, or None if the render is still running after ``wait``
+    """
+    path = cached_report(run, full)
+    if path is not None:
+        return path
+    try:
+        return schedule(run, full).result(timeout=_options().get('wait_seconds', 30) if wait is None else wait)
+    except TimeoutError:
+        return None
+
+
+async def aget_report(run, wait=None, full=False):
+    """get_report() for async views: the render is awaited without holding a thread."""
+    from .aio import run_io
+
+    path = await run_io(cached_report, run, full)
+    if path is not None:
+        return path
+    timeout = _options().get('wait_seconds', 30) if wait is None else wait
+    try:
+        # shield: a timed-out wait must not cancel a render still queued
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(schedule(run, full))), timeout)
+    except asyncio.TimeoutError:
+        return None
@@ -0,0 +1,45 @@
+"""
+Signal receivers: files stored next to an analysis run are removed with it,
+and the job queue is resumed on a process's first request.
+"""
+import logging
+
+from django.core.files.storage import default_storage
+from django.core.signals import request_started
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import AnalysisRun
+from . import reports
+
+logger = logging.getLogger(__name__)
+
+
+def run_files(run):
+    """Storage paths written for a run besides its row: its reports, and the per-row scores of a CSV run."""
+    paths = [reports.report_path(run, full) for full in (False, True)] + reports.stale_report_paths(run.id)
+    if run.scores_path:
+        paths.append(run.scores_path)
+    return paths
+
+
+@receiver(post_delete, sender=AnalysisRun)
+def delete_run_files(sender, instance, **kwargs):
+    for path in run_files(instance):
+        if not default_storage.exists(path):
+            continue
+        if path == instance.scores_path and AnalysisRun.objects.filter(scores_path=path).exists():
+            # Still read by a run that reused this one's result (explorer.dedup)
+            continue
+        try:
+            default_storage.delete(path)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not delete {path} of run {instance.pk}: {e}")
+
+
+@receiver(request_started, dispatch_uid='explorer.resume_jobs')
+def resume_jobs(sender, **kwargs):
+    # Once per process: the app registry is ready but ready() must not query the database
+    request_started.disconnect(dispatch_uid='explorer.resume_jobs')
+    from . import jobs
+    jobs.recover()
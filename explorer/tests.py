@@ -1,3 +1,1322 @@
-from django.test import TestCase
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+from concurrent.futures import Future
+from datetime import timedelta
+from functools import partial
+from multiprocessing import AuthenticationError
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+import tifffile
+import torch
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from segment_anything.modeling import ImageEncoderViT, MaskDecoder, PromptEncoder, Sam, TwoWayTransformer
+
+from .models import AnalysisJob, AnalysisRun, UploadSession
+from . import (
+    access, async_views, chart_data, dedup, exports, http_cache, jobs, lazy, plotting_utils, report_view, reports, upload_view,
+)
+from .management.commands import profile_startup
+
+pipeline_path = os.path.join(settings.BASE_DIR, 'nika_pipeline', 'content')
+if pipeline_path not in sys.path:
+    sys.path.append(pipeline_path)
+
+from compact_mask import CompactMask  # noqa: E402
+import inference_server  # noqa: E402
+import large_image  # noqa: E402
+import mineral_library  # noqa: E402
+import overlay  # noqa: E402
+from phash import MultiIndexHash, hamming, to_unsigned  # noqa: E402
+import video  # noqa: E402
+import sam_accel  # noqa: E402
+import sam_onnx  # noqa: E402
+import utils as sam_utils  # noqa: E402
+
+
+def tiny_sam(checkpoint=None, img_size=64, dim=32):
+    """A randomly initialised SAM small enough to run in tests; registered as model type 'tiny'."""
+    torch.manual_seed(0)
+    grid = img_size // 16
+    model = Sam(
+        image_encoder=ImageEncoderViT(
+            img_size=img_size, patch_size=16, embed_dim=dim, depth=2, num_heads=2, mlp_ratio=2, out_chans=dim,
+            qkv_bias=True, norm_layer=partial(torch.nn.LayerNorm, eps=1e-6), use_rel_pos=True, window_size=2,
+            global_attn_indexes=(1,),
+        ),
+        prompt_encoder=PromptEncoder(
+            embed_dim=dim, image_embedding_size=(grid, grid), input_image_size=(img_size, img_size), mask_in_chans=8
+        ),
+        mask_decoder=MaskDecoder(
+            num_multimask_outputs=3, transformer_dim=dim, iou_head_depth=2, iou_head_hidden_dim=32,
+            transformer=TwoWayTransformer(depth=1, embedding_dim=dim, mlp_dim=64, num_heads=2),
+        ),
+        pixel_mean=[123.675, 116.28, 103.53],
+        pixel_std=[58.395, 57.12, 57.375],
+    )
+    if checkpoint is not None:
+        model.load_state_dict(torch.load(checkpoint, weights_only=True))
+    return model.eval()
+
+
+def random_images(count, shapes=((48, 64), (64, 40), (30, 30))):
+    rng = np.random.default_rng(1)
+    return [rng.integers(0, 255, (*shapes[n % len(shapes)], 3), dtype=np.uint8) for n in range(count)]
+
+
+class TinySamMixin:
+    """Installs tiny_sam() as the pipeline's model for the test; ``sam_options`` go to build_sam()."""
+
+    sam_options = {}
+
+    def setUp(self):
+        super().setUp()
+        registry = mock.patch.dict(sam_utils.sam_model_registry, {'tiny': tiny_sam})
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.model, mask_gen, info = sam_utils.build_sam(None, 'tiny', **self.sam_options)
+        loaded = mock.patch.multiple(sam_utils, MODEL=self.model, MASK_GEN=mask_gen, MODEL_INFO=info, CLIENT=None)
+        loaded.start()
+        self.addCleanup(loaded.stop)
+
+
+def async_urlconf():
+    """explorer.urls as loaded with NIKA_ASYNC_VIEWS on (the ASGI routing), without replacing the module."""
+    spec = importlib.util.find_spec('explorer.urls')
+    module = importlib.util.module_from_spec(spec)
+    with override_settings(NIKA_ASYNC_VIEWS=True):
+        spec.loader.exec_module(module)
+    return module
+
+
+def own(client, key='owner-a'):
+    """Give the client's session an owner key, as its first upload would."""
+    session = client.session
+    session[access.SESSION_KEY] = key
+    session.save()
+    return key
+
+
+CSV_RESULT = {
+    'anomalies': [
+        {
+            'id': f'anomaly_{n}', 'row_index': n, 'type': 'Statistical Outlier (ML)', 'severity': 'High',
+            'confidence': 0.5, 'anomaly_score': -0.2, 'timestamp': '2024-01-01 10:00:00',
+            'description': f'Row {n}', 'affected_columns': ['a', 'b'], 'data_values': {'a': n, 'b': 2 * n},
+        }
+        for n in range(3)
+    ],
+    'metrics': {'total_records': 10, 'anomalies_detected': 3},
+}
+
+IMAGE_RESULT = {
+    'anomaly_zones': [
+        {
+            'id': 'zone_1', 'name': 'Anomaly Zone 1', 'confidence': 0.8, 'mineral_type': 'Hematite',
+            'bounding_box': {'x': 10, 'y': 20, 'width': 30, 'height': 40},
+            'center_coordinates': {'x': 25, 'y': 40},
+        },
+    ],
+    'analysis_results': {'image_quality': {'resolution': '200x100'}, 'detection_metrics': {'precision': 0.9}},
+}
+
+
+class MediaTestMixin:
+    """Runs each test against an empty MEDIA_ROOT, with jobs and renders kept in the test's thread."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=media_root,
+            NIKA_JOB_WORKERS=0,
+            NIKA_PLOTS={**settings.NIKA_PLOTS, 'workers': 0},
+            NIKA_REPORTS={**settings.NIKA_REPORTS, 'prerender': False},
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        plotting_utils.plot_cache().clear()
+
+
+class CompactMaskTests(SimpleTestCase):
+    def test_rle_round_trip(self):
+        rng = np.random.default_rng(0)
+        dense = np.zeros((40, 60), dtype=bool)
+        dense[5:30, 12:50] = rng.random((25, 38)) > 0.4
+        mask = CompactMask.from_rle(CompactMask.from_dense(dense).to_rle())
+        np.testing.assert_array_equal(mask.to_dense(), dense)
+        self.assertEqual(mask.area, dense.sum())
+
+    def test_rle_starting_with_set_pixel(self):
+        dense = np.zeros((4, 5), dtype=bool)
+        dense[0, 0] = dense[3, 4] = True
+        rle = CompactMask.from_dense(dense).to_rle()
+        self.assertEqual(rle['counts'][0], 0)
+        np.testing.assert_array_equal(CompactMask.from_rle(rle).to_dense(), dense)
+
+    def test_empty_mask(self):
+        mask = CompactMask.from_rle({'size': [8, 8], 'counts': [64]})
+        self.assertEqual(mask.area, 0)
+        self.assertFalse(mask.to_dense().any())
+
+    def test_cropped_and_packed(self):
+        dense = np.zeros((1000, 1000), dtype=bool)
+        dense[100:116, 200:264] = True
+        mask = CompactMask.from_dense(dense)
+        self.assertEqual(mask.crop_shape, (16, 64))
+        self.assertEqual(mask.nbytes, 16 * 64 // 8)
+
+    def test_bbox_gather_and_paste(self):
+        dense = np.zeros((10, 10), dtype=bool)
+        dense[2:5, 3:8] = True
+        image = np.arange(100).reshape(10, 10)
+        mask = CompactMask.from_dense(dense)
+        self.assertEqual(mask.bbox, (3, 2, 7, 4))
+        np.testing.assert_array_equal(mask.gather(image), image[dense])
+        self.assertEqual(mask.iou(CompactMask.from_dense(dense)), 1.0)
+        target = np.zeros((10, 10), dtype=np.uint8)
+        mask.paste(target, 7)
+        np.testing.assert_array_equal(target == 7, dense)
+
+
+class BatchedEncoderTests(TinySamMixin, SimpleTestCase):
+    def test_batch_matches_single_image_embeddings(self):
+        images = random_images(3)
+        features, sizes = sam_utils.encode_images(images)
+        predictor = sam_utils.SamPredictor(self.model)
+        for n, image in enumerate(images):
+            with torch.inference_mode():
+                predictor.set_image(image)
+            torch.testing.assert_close(features[n:n + 1], predictor.features, atol=1e-4, rtol=1e-4)
+            self.assertEqual(sizes[n], (image.shape[:2], tuple(predictor.input_size)))
+
+    def test_images_are_segmented_in_order_in_batches(self):
+        images = random_images(5)
+        batches = []
+        hook = self.model.image_encoder.register_forward_hook(lambda module, args, out: batches.append(len(args[0])))
+        self.addCleanup(hook.remove)
+        out = list(sam_utils.run_sam_on_images(iter(images), batch_size=2))
+        # The mask generator reuses each image's slice of the batch instead of encoding it again
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual([img is src for (img, _), src in zip(out, images)], [True] * 5)
+        for _, masks in out:
+            self.assertTrue(all(isinstance(m['segmentation'], CompactMask) for m in masks))
+
+    def test_preset_embedding_is_used_once(self):
+        image = random_images(1)[0]
+        predictor = sam_utils.MASK_GEN.predictor
+        features, sizes = sam_utils.encode_images([image])
+        predictor.preset(features, *sizes[0])
+        with mock.patch.object(sam_utils.SamPredictor, 'set_image') as encode:
+            predictor.set_image(image)
+            encode.assert_not_called()
+            predictor.set_image(image)
+            encode.assert_called_once()
+
+    def test_encoder_batch_follows_free_memory(self):
+        pages = mock.patch('os.sysconf', side_effect=lambda name: {'SC_PAGE_SIZE': 1 << 20}.get(name, self.free_mb))
+        with mock.patch.object(sam_utils, 'DEVICE', 'cpu'), pages:
+            self.free_mb = 4 << 10
+            self.assertEqual(sam_utils.encoder_batch_size('vit_b'), 1)
+            self.free_mb = 1 << 20
+            self.assertEqual(sam_utils.encoder_batch_size('vit_b', max_batch=4), 4)
+
+
+class CpuAccelerationTests(TinySamMixin, SimpleTestCase):
+    sam_options = {'cpu_accel': True, 'threads': 2}
+
+    def setUp(self):
+        self.addCleanup(torch.set_num_threads, torch.get_num_threads())
+        super().setUp()
+
+    def test_accelerated_model_matches_eager(self):
+        self.assertTrue(sam_utils.MODEL_INFO['cpu_accel'])
+        self.assertIsInstance(self.model.image_encoder, sam_accel.AcceleratedEncoder)
+        self.assertEqual(torch.get_num_threads(), 2)
+        eager = tiny_sam()
+        x = torch.randn(1, 3, 64, 64)
+        with torch.inference_mode():
+            torch.testing.assert_close(self.model.image_encoder(x), eager.image_encoder(x), atol=1e-4, rtol=1e-4)
+
+    def test_bf16_falls_back_without_cpu_support(self):
+        with mock.patch.object(sam_accel, 'bf16_supported', return_value=False):
+            settings_used = sam_accel.accelerate_model(tiny_sam(), bf16=True)
+        self.assertFalse(settings_used['bf16'])
+
+    def test_bf16_outputs_stay_fp32(self):
+        model = tiny_sam()
+        with mock.patch.object(sam_accel, 'bf16_supported', return_value=True):
+            sam_accel.accelerate_model(model, bf16=True)
+        with torch.inference_mode():
+            features = model.image_encoder(torch.randn(1, 3, 64, 64))
+            sparse, dense = model.prompt_encoder(points=(torch.rand(1, 1, 2) * 64, torch.ones(1, 1)), boxes=None, masks=None)
+            masks, ious = model.mask_decoder(
+                image_embeddings=features, image_pe=model.prompt_encoder.get_dense_pe(),
+                sparse_prompt_embeddings=sparse, dense_prompt_embeddings=dense, multimask_output=True,
+            )
+        self.assertEqual((features.dtype, masks.dtype, ious.dtype), (torch.float32,) * 3)
+
+    def test_failed_compile_stays_eager(self):
+        model = tiny_sam()
+        eager = model.image_encoder
+
+        class BrokenCompile(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self._orig_mod, self.img_size = eager, eager.img_size
+
+            def forward(self, x):
+                raise RuntimeError('no compiler')
+
+        model.image_encoder = BrokenCompile()
+        self.assertFalse(sam_accel.warm_up(model))
+        self.assertIs(model.image_encoder, eager)
+
+
+class QuantizedModelTests(SimpleTestCase):
+    def setUp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.checkpoint = os.path.join(folder, 'sam_tiny.pth')
+        self.save_checkpoint(tiny_sam())
+        self.build = mock.Mock(side_effect=tiny_sam)
+
+    def save_checkpoint(self, model, mtime=1_700_000_000):
+        torch.save(model.state_dict(), self.checkpoint)
+        os.utime(self.checkpoint, (mtime, mtime))
+
+    def encode(self, model):
+        torch.manual_seed(1)
+        with torch.inference_mode():
+            return model.image_encoder(torch.randn(1, 3, 64, 64))
+
+    def test_cached_state_dict_is_reused_without_the_checkpoint(self):
+        model, path = sam_accel.load_quantized_model(self.checkpoint, 'tiny', self.build)
+        self.assertIsInstance(model.image_encoder.blocks[0].mlp.lin1, torch.ao.nn.quantized.dynamic.Linear)
+        self.assertIsInstance(torch.load(path, weights_only=True), dict)
+
+        cached, cached_path = sam_accel.load_quantized_model(self.checkpoint, 'tiny', self.build)
+        self.assertEqual(cached_path, path)
+        self.assertEqual(self.build.call_args_list, [mock.call(self.checkpoint), mock.call(None)])
+        torch.testing.assert_close(self.encode(cached), self.encode(model))
+
+    def test_replaced_checkpoint_is_quantized_again(self):
+        _, old_path = sam_accel.load_quantized_model(self.checkpoint, 'tiny', self.build)
+        retrained = tiny_sam()
+        with torch.no_grad():
+            retrained.image_encoder.patch_embed.proj.weight.mul_(2)
+        self.save_checkpoint(retrained, mtime=1_800_000_000)
+
+        model, path = sam_accel.load_quantized_model(self.checkpoint, 'tiny', self.build)
+        self.assertNotEqual(path, old_path)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(self.build.call_args_list[-1], mock.call(self.checkpoint))
+        torch.testing.assert_close(
+            model.image_encoder.patch_embed.proj.weight, retrained.image_encoder.patch_embed.proj.weight
+        )
+
+    def test_unreadable_cache_is_rebuilt(self):
+        path = sam_accel.quantized_checkpoint_path(self.checkpoint, 'tiny')
+        with open(path, 'wb') as fh:
+            fh.write(b'not a state dict')
+        with self.assertLogs('sam_accel', 'WARNING'):
+            model, saved = sam_accel.load_quantized_model(self.checkpoint, 'tiny', self.build)
+        self.assertEqual(saved, path)
+        self.assertIsInstance(torch.load(path, weights_only=True), dict)
+
+
+class OnnxBackendTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.onnx_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.onnx_dir)
+        # The tracer warns about every shape-dependent branch of the encoder
+        with mock.patch.dict(sam_utils.sam_model_registry, {'tiny': tiny_sam}), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            sam_onnx.export_onnx(None, 'tiny', cls.onnx_dir)
+
+    def test_predictor_matches_torch(self):
+        image = random_images(1)[0]
+        onnx = sam_onnx.OnnxPredictor(self.onnx_dir)
+        reference = sam_utils.SamPredictor(tiny_sam())
+        onnx.set_image(image)
+        with torch.inference_mode():
+            reference.set_image(image)
+        np.testing.assert_allclose(onnx.features, reference.features.numpy(), atol=1e-4, rtol=1e-3)
+
+        coords = torch.as_tensor(reference.transform.apply_coords(np.array([[10.0, 20.0], [40.0, 5.0]]), image.shape[:2]))
+        coords = coords.float()[:, None, :]
+        labels = torch.ones(2, 1, dtype=torch.int)
+        masks, ious, low_res = onnx.predict_torch(coords, labels, multimask_output=True, return_logits=True)
+        with torch.inference_mode():
+            expected = reference.predict_torch(coords, labels, multimask_output=True, return_logits=True)
+        self.assertEqual(masks.shape, (2, 3, *image.shape[:2]))
+        torch.testing.assert_close(masks, expected[0], atol=1e-3, rtol=1e-3)
+        torch.testing.assert_close(ious, expected[1], atol=1e-4, rtol=1e-3)
+
+    def test_build_sam_onnx_backend(self):
+        model, mask_gen, info = sam_utils.build_sam(None, backend='onnx', onnx_dir=self.onnx_dir, threads=1)
+        self.assertIsNone(model)
+        self.assertEqual((info['backend'], info['model_type']), ('onnx', 'tiny'))
+        self.assertIsInstance(mask_gen.predictor, sam_onnx.OnnxPredictor)
+        masks = sam_utils.compact_masks(mask_gen.generate(random_images(1)[0]))
+        self.assertTrue(all(isinstance(m['segmentation'], CompactMask) for m in masks))
+
+
+class InferenceServerTests(SimpleTestCase):
+    def setUp(self):
+        # The server runs until the test process exits, which also removes its socket
+        self.address = os.path.join(tempfile.mkdtemp(), 'sam.sock')
+        # Server and client share this process's resource tracker, which the server would unregister from
+        tracker = mock.patch.object(inference_server, 'resource_tracker')
+        tracker.start()
+        self.addCleanup(tracker.stop)
+        self.segment = mock.Mock(side_effect=lambda img, max_masks: [{'area': int(img.sum()), 'max_masks': max_masks}])
+        self.segment_points = mock.Mock(side_effect=lambda img, points: [{'point_coords': [p]} for p in points])
+        server = inference_server.SamServer(
+            self.address, b'secret', self.segment, {'model_type': 'tiny'}, segment_points=self.segment_points
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for _ in range(100):
+            if os.path.exists(self.address):
+                break
+            time.sleep(0.02)
+        self.client = inference_server.SamClient(self.address, b'secret')
+        self.addCleanup(self.client.close)
+
+    def test_images_go_through_shared_memory(self):
+        self.assertEqual(self.client.info(), {'model_type': 'tiny'})
+        image = np.full((5, 4, 3), 2, dtype=np.uint8)
+        self.assertEqual(self.client.segment(image, max_masks=7), [{'area': 120, 'max_masks': 7}])
+        sent = self.segment.call_args[0][0]
+        self.assertEqual(sent.shape, (5, 4, 3))
+
+    def test_point_prompts_run_on_the_server(self):
+        image = np.zeros((6, 6, 3), dtype=np.uint8)
+        masks = self.client.segment_at_points(image, [(1, 2), (4.5, 3)])
+        self.assertEqual([m['point_coords'] for m in masks], [[(1.0, 2.0)], [(4.5, 3.0)]])
+        self.segment.assert_not_called()
+
+    def test_errors_come_back_to_the_client(self):
+        self.segment.side_effect = ValueError('bad image')
+        with self.assertRaisesMessage(RuntimeError, 'ValueError: bad image'):
+            self.client.segment(np.zeros((2, 2, 3), dtype=np.uint8))
+        # The connection survives the failed request
+        self.assertEqual(self.client.info(), {'model_type': 'tiny'})
+
+    def test_wrong_authkey_is_rejected_and_logged(self):
+        with self.assertLogs('inference_server', 'WARNING') as logs:
+            with self.assertRaises(AuthenticationError):
+                inference_server.SamClient(self.address, b'wrong').info()
+            for _ in range(100):
+                if logs.records:
+                    break
+                time.sleep(0.02)
+        self.assertIn('Rejected SAM client connection', logs.output[0])
+
+    def test_parse_address(self):
+        self.assertEqual(inference_server.parse_address('localhost:7000'), ('localhost', 7000))
+        self.assertEqual(inference_server.parse_address(':7000'), ('127.0.0.1', 7000))
+        self.assertEqual(inference_server.parse_address('/run/sam.sock'), '/run/sam.sock')
+
+
+class JobTests(MediaTestMixin, TestCase):
+    def _csv_job(self, **fields):
+        path = default_storage.save('jobs/data.csv', ContentFile(b'a,b\n1,2\n3,4\n5,600\n'))
+        return AnalysisJob.objects.create(kind='csv', original_name='data.csv', input_path=path, **fields)
+
+    def _running_job(self, worker, heartbeat_minutes_ago=0):
+        beat = timezone.now() - timedelta(minutes=heartbeat_minutes_ago)
+        return self._csv_job(status=AnalysisJob.RUNNING, worker=worker, started_at=beat, heartbeat_at=beat)
+
+    def test_claim_once(self):
+        job = self._csv_job()
+        self.assertEqual(jobs.claim_next_job(), job.pk)
+        self.assertIsNone(jobs.claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (AnalysisJob.RUNNING, jobs.worker_id()))
+
+    def test_run_job_stores_run(self):
+        job = self._csv_job(owner_key='owner-a')
+        jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.DONE, job.error)
+        self.assertEqual(job.run.owner_key, 'owner-a')
+        self.assertEqual(job.run.load()['file_info']['filename'], 'data.csv')
+
+    def test_run_job_records_failure(self):
+        job = AnalysisJob.objects.create(kind='csv', original_name='gone.csv', input_path='jobs/gone.csv')
+        jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.FAILED)
+        self.assertTrue(job.error)
+
+    def test_recover_only_fails_jobs_whose_process_is_gone(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        host = socket.gethostname()
+        dead = self._running_job(f'{host}:{exited.pid}')
+        alive = self._running_job(f'{host}:{os.getppid()}', heartbeat_minutes_ago=1)
+        elsewhere = self._running_job('other-host:1', heartbeat_minutes_ago=1)
+        silent = self._running_job('other-host:2', heartbeat_minutes_ago=60)
+        orphaned_here = self._running_job(jobs.worker_id())
+        queued = self._csv_job()
+        with override_settings(NIKA_JOB_WORKERS=2), mock.patch.object(jobs, '_submit') as submit:
+            self.assertEqual(jobs.recover(), (1, 3))
+        submit.assert_called_once_with(queued.pk)
+        status = dict(AnalysisJob.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [status[job.pk] for job in (dead, alive, elsewhere, silent, orphaned_here)],
+            [AnalysisJob.FAILED, AnalysisJob.RUNNING, AnalysisJob.RUNNING, AnalysisJob.FAILED, AnalysisJob.FAILED],
+        )
+
+    def test_job_failed_by_recovery_is_not_marked_done(self):
+        job = self._csv_job()
+
+        def analysis_outlived_by_recovery(file, progress=None):
+            AnalysisJob.objects.filter(pk=job.pk).update(status=AnalysisJob.FAILED, error='interrupted')
+            return {'anomalies': []}
+
+        with mock.patch.dict(jobs.PROCESSORS, {'csv': analysis_outlived_by_recovery}):
+            jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error, job.run), (AnalysisJob.FAILED, 'interrupted', None))
+        self.assertFalse(AnalysisRun.objects.exists())
+
+    def test_job_status_is_only_shown_to_its_owner(self):
+        job = self._csv_job(owner_key='owner-a')
+        own(self.client, 'owner-b')
+        self.assertEqual(self.client.get(f'/jobs/{job.pk}/').status_code, 404)
+        own(self.client, 'owner-a')
+        self.assertEqual(self.client.get(f'/jobs/{job.pk}/').json()['status'], AnalysisJob.QUEUED)
+
+
+class OverlayTests(SimpleTestCase):
+    def setUp(self):
+        self.first = np.zeros((20, 30), dtype=bool)
+        self.first[2:12, 3:15] = True
+        self.second = np.zeros((20, 30), dtype=bool)
+        self.second[8:18, 10:25] = True
+        self.masks = [{'segmentation': CompactMask.from_dense(m)} for m in (self.first, self.second)]
+
+    def test_label_map_puts_later_masks_on_top(self):
+        labels = overlay.label_map(self.masks, (20, 30, 3))
+        expected = np.where(self.second, 2, np.where(self.first, 1, 0))
+        np.testing.assert_array_equal(labels, expected)
+
+    def test_overlay_blends_only_masked_pixels(self):
+        image = np.full((20, 30, 3), 100, dtype=np.uint8)
+        out = overlay.render_overlay(image, self.masks, alpha=0.5)
+        self.assertEqual(out.shape, image.shape)
+        np.testing.assert_array_equal(out[0, 29], image[0, 29])
+        colour = overlay.ZONE_COLORS[0].astype(float)
+        np.testing.assert_array_equal(out[5, 6], ((100 + colour) / 2).astype(np.uint8))
+        # The boundary between the two masks is drawn in the upper mask's colour
+        np.testing.assert_array_equal(out[8, 12], overlay.ZONE_COLORS[1])
+
+    def test_overlay_is_downscaled(self):
+        image = np.zeros((400, 1000, 3), dtype=np.uint8)
+        self.assertEqual(overlay.render_overlay(image, [], max_side=500).shape, (200, 500, 3))
+        self.assertEqual(overlay.thumbnail(image, 100).shape, (40, 100, 3))
+
+    def test_encode_image(self):
+        data, ext = overlay.encode_image(np.zeros((8, 8, 3), dtype=np.uint8), 'webp')
+        self.assertIn(ext, ('webp', 'jpg'))
+        self.assertEqual(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape, (8, 8, 3))
+
+
+class MineralLibraryTests(SimpleTestCase):
+    refs = {'hematite': [0.8, 0.2, 0.1], 'malachite': [0.1, 0.7, 0.3], 'sulfur': [0.9, 0.9, 0.2]}
+
+    def test_match_ranks_by_cosine_similarity(self):
+        library = mineral_library.MineralLibrary.from_colors(self.refs)
+        queries = np.array([[0.7, 0.25, 0.1], [0.2, 0.6, 0.3]])
+        matches = library.match(queries, top_n=3)
+        unit = lambda v: np.asarray(v) / np.linalg.norm(v)  # noqa: E731
+        for query, candidates in zip(queries, matches):
+            expected = sorted(self.refs, key=lambda k: -unit(self.refs[k]) @ unit(query))
+            self.assertEqual([c['key'] for c in candidates], expected)
+            self.assertAlmostEqual(candidates[0]['similarity'], unit(self.refs[expected[0]]) @ unit(query), places=3)
+
+    def test_top_n(self):
+        library = mineral_library.MineralLibrary.from_colors(self.refs)
+        self.assertEqual(len(library.match([[1, 0, 0]], top_n=1)[0]), 1)
+        self.assertEqual(len(library.match([[1, 0, 0]], top_n=10)[0]), 3)
+        self.assertEqual(library.match(np.zeros((0, 3))), [])
+        with self.assertRaises(ValueError):
+            library.match([[1, 0, 0]], top_n=0)
+
+    def test_lab_space_and_texture(self):
+        library = mineral_library.MineralLibrary(
+            ['red_smooth', 'red_rough'], ['Hematite', 'Jasper'], [[0.8, 0.2, 0.1]] * 2,
+            texture=[[0.0, 0.9], [0.9, 0.1]], space='lab', texture_weight=1.0,
+        )
+        rough = library.match([[0.8, 0.2, 0.1]], texture=[(100.0, 0.1)], top_n=2)[0]
+        self.assertEqual([c['mineral'] for c in rough], ['Jasper', 'Hematite'])
+        self.assertEqual(rough[0]['similarity'], 1.0)
+
+    def test_library_file_is_reloaded_when_changed(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'minerals.csv')
+        with open(path, 'w') as fh:
+            fh.write('key,mineral,r,g,b,texture_contrast,texture_homogeneity\nhem,Hematite,0.8,0.2,0.1,2,0.5\n')
+        library = mineral_library.load_library(path)
+        self.assertIs(mineral_library.load_library(path), library)
+        with open(path, 'a') as fh:
+            fh.write('mal,Malachite,0.1,0.7,0.3,,\n')
+        os.utime(path, (1_900_000_000, 1_900_000_000))
+        reloaded = mineral_library.load_library(path)
+        self.assertEqual(reloaded.mineral_names, ['Hematite', 'Malachite'])
+        # A reference without texture gets the library mean
+        np.testing.assert_allclose(reloaded.texture[1], reloaded.texture[0])
+
+    def test_names_must_be_strings(self):
+        with self.assertRaises(ValueError):
+            mineral_library.MineralLibrary.from_colors({'': [1, 0, 0]})
+
+
+class MineralMapTests(SimpleTestCase):
+    def setUp(self):
+        self.library = mineral_library.MineralLibrary(
+            ['hem_a', 'hem_b', 'mal'], ['Hematite', 'Hematite', 'Malachite'],
+            [[0.8, 0.2, 0.1], [0.7, 0.1, 0.1], [0.1, 0.7, 0.3]],
+        )
+
+    def test_lut_agrees_with_matching_at_bin_centres(self):
+        bins = 8
+        lut = self.library.colour_lut(bins)
+        self.assertEqual(lut.shape, (bins ** 3,))
+        centres = (np.arange(bins) + 0.5) / bins
+        for r, g, b in [(0, 7, 2), (6, 1, 1), (3, 3, 3)]:
+            best = self.library.match([[centres[r], centres[g], centres[b]]], top_n=1)[0][0]['mineral']
+            self.assertEqual(self.library.mineral_names[lut[(r * bins + g) * bins + b]], best)
+        self.assertIs(self.library.colour_lut(bins), lut)
+        with self.assertRaises(ValueError):
+            self.library.colour_lut(12)
+
+    def test_mineral_map_and_composition(self):
+        image = np.zeros((30, 10, 3), dtype=np.uint8)
+        image[:20] = [200, 50, 25]
+        image[20:] = [25, 180, 75]
+        labels = self.library.mineral_map(image, rows_per_block=7)
+        self.assertEqual(labels.shape, (30, 10))
+        self.assertEqual(set(labels[:20].ravel()), {self.library.mineral_names.index('Hematite')})
+        self.assertEqual(set(labels[20:].ravel()), {self.library.mineral_names.index('Malachite')})
+        self.assertEqual(self.library.composition(labels), {'Hematite': 0.6667, 'Malachite': 0.3333})
+
+    def test_dissimilar_colours_are_unknown(self):
+        image = np.full((4, 4, 3), [20, 20, 230], dtype=np.uint8)
+        labels = self.library.mineral_map(image, min_similarity=0.9)
+        self.assertTrue((labels == mineral_library.UNKNOWN).all())
+        self.assertEqual(self.library.composition(labels), {'Unknown': 1.0})
+
+
+class LargeImageTests(SimpleTestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        rng = np.random.default_rng(2)
+        self.image = rng.integers(0, 255, (150, 200, 3), dtype=np.uint8)
+
+    def write(self, name, data=None, **options):
+        path = os.path.join(self.folder, name)
+        tifffile.imwrite(path, self.image if data is None else data, **options)
+        return path
+
+    def test_windows_match_the_pixels(self):
+        paths = [
+            self.write('tiled.tif', tile=(32, 48), compression='zlib'),
+            self.write('striped.tif', rowsperstrip=7, compression='zlib'),
+            self.write('plain.tif'),
+            self.write('planar.tif', self.image.transpose(2, 0, 1), photometric='rgb', planarconfig='separate', tile=(32, 32)),
+        ]
+        for path in paths:
+            with self.subTest(path=os.path.basename(path)), large_image.TiffImage(path) as tif:
+                self.assertEqual(tif.shape, (150, 200))
+                np.testing.assert_array_equal(tif.read_window(30, 40, 70, 90), self.image[30:100, 40:130])
+                # Windows are clipped to the image
+                np.testing.assert_array_equal(tif.read_window(140, 190, 50, 50), self.image[140:, 190:])
+                with self.assertRaises(ValueError):
+                    tif.read_window(200, 0, 10, 10)
+
+    def test_downscaled_read_uses_the_pyramid(self):
+        path = os.path.join(self.folder, 'pyramid.tif')
+        half = cv2.resize(self.image, (100, 75), interpolation=cv2.INTER_AREA)
+        with tifffile.TiffWriter(path) as tif:
+            tif.write(self.image, tile=(32, 32), subifds=1, compression='zlib')
+            tif.write(half, tile=(32, 32), subfiletype=1, compression='zlib')
+        with large_image.TiffImage(path) as tif:
+            self.assertEqual(tif.level_shapes, [(150, 200), (75, 100)])
+            self.assertEqual(tif.best_level(100), 1)
+            with mock.patch.object(tif, 'read_window', wraps=tif.read_window) as read_window:
+                out = tif.read(max_side=100)
+        self.assertEqual({c.args[4] for c in read_window.call_args_list}, {1})
+        np.testing.assert_array_equal(out, half)
+
+    def test_read_tiff_rgb_from_a_stream(self):
+        path = self.write('tiled.tif', tile=(32, 32), compression='zlib')
+        with open(path, 'rb') as fh:
+            head = fh.read(4)
+            fh.seek(0)
+            image, full_shape = large_image.read_tiff_rgb(io.BytesIO(fh.read()), max_side=50)
+        self.assertTrue(large_image.is_tiff(head))
+        self.assertEqual((image.shape, full_shape), ((38, 50, 3), (150, 200)))
+        expected = cv2.resize(self.image, (50, 38), interpolation=cv2.INTER_AREA).astype(int)
+        self.assertLess(np.abs(image.astype(int) - expected).mean(), 8)
+
+    def test_samples_are_converted_to_rgb8(self):
+        grey16 = np.array([[0, 65535]], dtype=np.uint16)
+        np.testing.assert_array_equal(large_image.to_rgb8(grey16), [[[0] * 3, [255] * 3]])
+        rgba = np.zeros((1, 1, 4), dtype=np.float32) + 0.5
+        self.assertEqual(large_image.to_rgb8(rgba).tolist(), [[[127] * 3]])
+
+
+class PointPromptTests(TinySamMixin, SimpleTestCase):
+    def test_one_mask_per_point_in_order(self):
+        image = random_images(1)[0]
+        points = [(50, 10), (5, 40), (30, 30)]
+        masks = sam_utils.segment_at_points(image, points)
+        self.assertEqual([m['point_coords'] for m in masks], [[[float(x), float(y)]] for x, y in points])
+        for m in masks:
+            self.assertIsInstance(m['segmentation'], CompactMask)
+            self.assertEqual(m['segmentation'].shape, image.shape[:2])
+            self.assertEqual(m['area'], m['segmentation'].area)
+
+    def test_shared_server_gets_the_prompts(self):
+        client = mock.Mock()
+        image = random_images(1)[0]
+        with mock.patch.object(sam_utils, 'CLIENT', client):
+            self.assertIs(sam_utils.segment_at_points(image, [(1, 2)]), client.segment_at_points.return_value)
+        client.segment_at_points.assert_called_once_with(image, [(1, 2)])
+        client.segment.assert_not_called()
+
+
+class NearDuplicateTests(MediaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # The index is per process; start each test from an empty one
+        dedup._index, dedup._synced_at = None, None
+        dedup._seen.clear()
+
+    def test_multi_index_hash(self):
+        index = MultiIndexHash(max_distance=2)
+        index.add(0b1011, 'a')
+        index.add(0xFFFF, 'b')
+        self.assertEqual(index.search(0b1001), [(1, 'a')])
+        self.assertEqual(index.search(1 << 63), [])
+        self.assertEqual(hamming(0b1011, 0b1001), 1)
+
+    def test_fingerprint_survives_re_exposure(self):
+        image = cv2.resize(random_images(1)[0], (256, 192), interpolation=cv2.INTER_CUBIC)
+        brighter = cv2.convertScaleAbs(image, alpha=1.0, beta=30)
+        other = random_images(2)[1]
+        h = dedup.fingerprint(image)
+        self.assertLessEqual(hamming(to_unsigned(h), to_unsigned(dedup.fingerprint(brighter))), 4)
+        self.assertGreater(hamming(to_unsigned(h), to_unsigned(dedup.fingerprint(other))), 10)
+
+    def _image_job(self, phash, **owner):
+        run = AnalysisRun.store('image', IMAGE_RESULT, 'a.png', **owner)
+        return AnalysisJob.objects.create(
+            kind='image', original_name='a.png', input_path='uploads/a.png', status=AnalysisJob.DONE,
+            run=run, phash=phash, finished_at=timezone.now(), **owner
+        )
+
+    def test_lookup_is_scoped_to_the_uploader(self):
+        job = self._image_job(0b1011, owner_key='owner-a')
+        self.assertEqual(dedup.find_near_duplicate(0b1001, owner_key='owner-a'), (job, 1))
+        self.assertIsNone(dedup.find_near_duplicate(0b1001, owner_key='owner-b'))
+        self.assertIsNone(dedup.find_near_duplicate(0b1001))
+
+    def test_index_picks_up_jobs_finished_later(self):
+        self.assertIsNone(dedup.find_near_duplicate(-5, owner_key='owner-a'))
+        job = self._image_job(-5, owner_key='owner-a')
+        self.assertEqual(dedup.find_near_duplicate(-5, owner_key='owner-a'), (job, 0))
+
+    def test_warm_start_points_are_scaled(self):
+        job = self._image_job(1, owner_key='owner-a')
+        self.assertEqual(dedup.warm_start_points(job, (200, 400, 3)), [(50.0, 80.0)])
+
+
+class VideoKeyframeTests(SimpleTestCase):
+    def setUp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.path = os.path.join(folder, 'inspection.avi')
+        # Three 2-second scenes at 10 fps: red, green, blue; the sharp frame of each scene is at +0.5 s
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+        for colour in ([0, 0, 200], [0, 200, 0], [200, 0, 0]):
+            for n in range(20):
+                frame = np.full((48, 64, 3), colour, dtype=np.uint8)
+                if n == 5:
+                    frame[::4, :] = 255
+                writer.write(frame)
+        writer.release()
+
+    def test_sharpest_frame_of_each_scene(self):
+        info = {}
+        frames = list(video.keyframes(self.path, sample_fps=10, info=info))
+        self.assertEqual([f['frame'] for f in frames], [5, 25, 45])
+        self.assertEqual([f['scene_start'] for f in frames], [0.0, 2.0, 4.0])
+        self.assertEqual([f['scene_end'] for f in frames], [1.9, 3.9, 5.9])
+        self.assertEqual(frames[1]['image'].shape, (48, 64, 3))
+        # RGB, not OpenCV's BGR
+        red, _, blue = frames[0]['image'][2, 2].astype(int)
+        self.assertGreater(red, blue + 50)
+        self.assertEqual((info['fps'], info['frame_count'], info['frames_scored']), (10.0, 60, 60))
+
+    def test_sampling_and_limits(self):
+        info = {}
+        frames = list(video.keyframes(self.path, sample_fps=2, max_keyframes=2, info=info))
+        self.assertEqual(len(frames), 2)
+        self.assertTrue(all(f['frame'] % 5 == 0 for f in frames))
+        self.assertLess(info['frames_scored'], 60)
+        # Scenes shorter than min_scene_seconds are merged
+        self.assertEqual(len(list(video.keyframes(self.path, sample_fps=10, min_scene_seconds=3))), 2)
+
+    def test_unreadable_video(self):
+        with self.assertRaises(ValueError):
+            next(video.keyframes(os.path.join(os.path.dirname(self.path), 'missing.avi')))
+
+
+class AnalysisRunTests(TestCase):
+    def test_store_and_load(self):
+        run = AnalysisRun.store('csv', CSV_RESULT, 'data.csv', owner_key='k')
+        run = AnalysisRun.objects.get(pk=run.pk)
+        self.assertEqual(run.load(), CSV_RESULT)
+        self.assertEqual(run.size_bytes, len(json.dumps(CSV_RESULT, separators=(',', ':'))))
+        self.assertLess(len(run.data), run.size_bytes)
+
+    def test_dates_are_stored_as_strings(self):
+        when = timezone.now().replace(microsecond=0)
+        run = AnalysisRun.store('image', {'processed_at': when})
+        self.assertEqual(run.load()['processed_at'], when.isoformat().replace('+00:00', 'Z'))
+
+
+class RunAccessTests(MediaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.run = AnalysisRun.store(
+            'image', IMAGE_RESULT, 'a.png', owner_key='owner-a', preview_path='uploads/a.png'
+        )
+
+    def test_owner_reopens_run(self):
+        own(self.client)
+        response = self.client.get(f'/?run={self.run.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['image_run'], str(self.run.pk))
+        self.assertEqual(self.client.session['uploaded_file_path'], 'uploads/a.png')
+
+    def test_other_session_gets_404(self):
+        own(self.client, 'owner-b')
+        self.assertEqual(self.client.get(f'/?run={self.run.pk}').status_code, 404)
+        self.assertEqual(self.client.get('/?run=not-a-uuid').status_code, 404)
+        self.assertNotIn('image_run', self.client.session)
+
+    def test_finished_job_hands_its_run_to_the_session(self):
+        job = AnalysisJob.objects.create(
+            kind='image', original_name='a.png', input_path='uploads/a.png', status=AnalysisJob.DONE,
+            run=self.run, owner_key='owner-a',
+        )
+        own(self.client)
+        session = self.client.session
+        session['pending_jobs'] = {'image': str(job.pk)}
+        session.save()
+        self.client.get('/')
+        self.assertEqual(self.client.session['image_run'], str(self.run.pk))
+
+
+class ChartDataTests(MediaTestMixin, TestCase):
+    def test_anomaly_series(self):
+        result = {
+            **CSV_RESULT,
+            'metrics': {
+                'baseline_metrics': {'precision': 0.5, 'recall': 0.4, 'f1_score': 0.45, 'accuracy': 0.8},
+                'nika_metrics': {'precision': 0.9, 'recall': 0.8, 'f1_score': 0.85, 'accuracy': 0.95},
+            },
+        }
+        result['anomalies'] = result['anomalies'] + [{**result['anomalies'][0], 'severity': 'Low', 'timestamp': 'n/a'}]
+        charts = chart_data.anomaly_chart_data(result)
+        severity = charts['severity_distribution']
+        self.assertEqual((severity['labels'], severity['datasets'][0]['data']), (['High', 'Low'], [3, 1]))
+        self.assertEqual(sum(charts['confidence_distribution']['datasets'][0]['data']), 4)
+        self.assertEqual(charts['confidence_distribution']['annotation']['value'], 0.5)
+        self.assertEqual(charts['timeline']['datasets'][0]['data'][10], 3)
+        self.assertEqual(charts['performance_comparison']['datasets'][1]['data'], [0.9, 0.8, 0.85, 0.95])
+
+    def test_empty_charts_are_left_out(self):
+        self.assertEqual(chart_data.anomaly_chart_data({'anomalies': [], 'metrics': {}}), {})
+        charts = chart_data.image_chart_data(IMAGE_RESULT)
+        self.assertEqual(list(charts), ['mineral_confidence', 'area_distribution', 'ml_metrics_radar'])
+        self.assertEqual(charts['area_distribution']['datasets'][0]['data'], [1200])
+
+    def test_endpoint_serves_the_session_run(self):
+        self.assertEqual(self.client.get('/charts/image/').status_code, 404)
+        self.assertEqual(self.client.get('/charts/pdf/').status_code, 404)
+        run = AnalysisRun.store('image', IMAGE_RESULT, 'a.png', owner_key=own(self.client))
+        session = self.client.session
+        session['image_run'] = str(run.pk)
+        session.save()
+        body = self.client.get('/charts/image/').json()
+        self.assertEqual(body['charts'], json.loads(json.dumps(chart_data.image_chart_data(IMAGE_RESULT))))
+        self.assertEqual(body['images']['mineral_confidence'], f'/plots/image/{run.pk}/mineral_confidence.png')
+
+
+class PlotImageTests(MediaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.run = AnalysisRun.store('image', IMAGE_RESULT, 'a.png', owner_key='owner-a')
+        self.url = f'/plots/image/{self.run.pk}/mineral_confidence.png'
+
+    def test_rendered_once_then_cached(self):
+        own(self.client)
+        with mock.patch.object(AnalysisRun, 'load', autospec=True, side_effect=AnalysisRun.load) as load:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertTrue(response.content.startswith(b'\x89PNG'))
+            self.assertEqual(self.client.get(self.url).content, response.content)
+        self.assertEqual(load.call_count, 1)
+
+    def test_other_session_gets_404(self):
+        own(self.client, 'owner-b')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_slow_render_answers_202(self):
+        own(self.client)
+        quick = override_settings(NIKA_PLOTS={**settings.NIKA_PLOTS, 'wait_seconds': 0.01})
+        with quick, mock.patch.object(plotting_utils, 'schedule', return_value=Future()):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_plot_without_data_is_404(self):
+        run = AnalysisRun.store('image', {'anomaly_zones': []}, 'b.png', owner_key=own(self.client))
+        self.assertEqual(self.client.get(f'/plots/image/{run.pk}/mineral_confidence.png').status_code, 404)
+        self.assertEqual(plotting_utils.cached_plot('image', 'mineral_confidence', run.pk), b'')
+
+    def test_plot_workers_only_get_what_the_plot_reads(self):
+        trimmed = plotting_utils.plot_input('mineral_confidence', IMAGE_RESULT)
+        self.assertEqual(trimmed, {'anomaly_zones': [{'mineral_type': 'Hematite', 'confidence': 0.8}]})
+
+
+class StartupProfileTests(SimpleTestCase):
+    def test_importtime_is_summed_per_top_level_package(self):
+        lines = [
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 |   _io',
+            'import time:      1500 |       1500 |     pandas._libs',
+            'import time:       500 |       2000 |   pandas',
+            'import time:        30 |         30 | explorer.lazy',
+            'some other stderr output',
+        ]
+        self.assertEqual(profile_startup.parse_importtime(lines), {'_io': 120, 'pandas': 2000, 'explorer': 30})
+
+    def test_lazy_module_imports_on_first_use(self):
+        name = 'json.tool'
+        loaded = sys.modules.pop(name, None)
+        self.addCleanup(lambda: sys.modules.__setitem__(name, loaded) if loaded else sys.modules.pop(name, None))
+        module = lazy.lazy_import(name)
+        self.assertIn('not loaded', repr(module))
+        self.assertNotIn(name, sys.modules)
+        self.assertTrue(callable(module.main))
+        self.assertIn(name, sys.modules)
+        self.assertIn("'json.tool' (loaded)", repr(module))
+        self.assertIs(lazy.lazy_import(name), sys.modules[name])
+
+    def test_available_does_not_import(self):
+        self.assertTrue(lazy.available('json', 'os'))
+        self.assertFalse(lazy.available('json', 'no_such_package_here'))
+
+    def test_boot_imports_no_heavy_package(self):
+        out = io.StringIO()
+        call_command('profile_startup', '--strict', '--top', '3', stdout=out)
+        self.assertIn('No heavy packages imported at startup', out.getvalue())
+
+
+class ExportTests(MediaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        import pandas as pd
+
+        values = pd.DataFrame({'a': [1.0, 2.0, 3.0], 'b': [4, 5, 6]})
+        scores_path = exports.write_scores('scores/test.csv.gz', range(3), [0.1, -0.2, 0.3], [False, True, False], values)
+        self.run = AnalysisRun.store('csv', {**CSV_RESULT, 'scores_path': scores_path}, 'data.csv', owner_key='owner-a')
+        own(self.client)
+
+    def _export(self, run=None, **params):
+        response = self.client.get(f'/export/{(run or self.run).pk}/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_anomalies_are_read_from_the_scores_file(self):
+        with mock.patch.object(AnalysisRun, 'load', side_effect=AssertionError('result loaded')):
+            rows = json.loads(self._export(format='json'))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['id'], 'anomaly_2')
+        self.assertEqual(rows[0]['row_index'], 1)
+        self.assertEqual(rows[0]['severity'], 'Medium')
+        self.assertEqual(rows[0]['confidence'], 0.2)
+        self.assertEqual(rows[0]['affected_columns'], 'a;b')
+        self.assertEqual((rows[0]['a'], rows[0]['b']), (2.0, 5))
+
+    def test_anomalies_without_scores_file_come_from_the_result(self):
+        run = AnalysisRun.store('csv', CSV_RESULT, 'data.csv', owner_key='owner-a')
+        lines = self._export(run, format='csv').decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'row_index', 'type'])
+        self.assertEqual(len(lines), 4)
+
+    def test_scores_as_jsonl_with_limit(self):
+        lines = self._export(format='jsonl', table='scores', limit=2).decode().splitlines()
+        self.assertEqual(json.loads(lines[1]), {'row_index': 1, 'anomaly_score': -0.2, 'is_anomaly': 1, 'a': 2.0, 'b': 5})
+        self.assertEqual(len(lines), 2)
+
+    def test_excel(self):
+        workbook = zipfile.ZipFile(io.BytesIO(self._export(format='excel', table='scores')))
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 4)
+        self.assertIn('xl/workbook.xml', workbook.namelist())
+
+    def test_excel_starts_a_sheet_only_for_rows_that_do_not_fit(self):
+        def sheets(row_count):
+            rows = ([n] for n in range(row_count))
+            workbook = zipfile.ZipFile(io.BytesIO(b''.join(exports.stream_xlsx(['n'], rows))))
+            names = sorted(name for name in workbook.namelist() if name.startswith('xl/worksheets/'))
+            return [workbook.read(name).decode().count('<row>') for name in names]
+
+        with mock.patch.object(exports, 'XLSX_MAX_ROWS', 3):
+            self.assertEqual(sheets(0), [1])
+            self.assertEqual(sheets(2), [3])
+            self.assertEqual(sheets(3), [3, 2])
+            self.assertEqual(sheets(4), [3, 3])
+
+    def test_bad_options_and_other_owner(self):
+        self.assertEqual(self.client.get(f'/export/{self.run.pk}/', {'format': 'pdf'}).status_code, 400)
+        own(self.client, 'owner-b')
+        self.assertEqual(self.client.get(f'/export/{self.run.pk}/').status_code, 404)
+
+    def test_scores_file_is_deleted_with_the_run(self):
+        self.assertEqual(self.run.scores_path, 'scores/test.csv.gz')
+        self.assertTrue(default_storage.exists('scores/test.csv.gz'))
+        AnalysisRun.objects.get(pk=self.run.pk).delete()
+        self.assertFalse(default_storage.exists('scores/test.csv.gz'))
+
+
+def fake_build_report(results, report_type, output, full=False):
+    output.write(b'%PDF-1.4 ' + report_type.encode() + (b' full' if full else b''))
+
+
+@mock.patch('explorer.utils.build_report', side_effect=fake_build_report)
+class ReportTests(MediaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.run = AnalysisRun.store('csv', CSV_RESULT, 'data.csv', owner_key='owner-a')
+        own(self.client)
+
+    def test_rendered_once_then_served_from_storage(self, build):
+        url = f'/reports/{self.run.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 csv')
+        self.assertEqual(response['ETag'], reports.report_etag(self.run))
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': response['ETag']}).status_code, 304)
+        self.client.get(url)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(b''.join(self.client.get(url, {'full': 1}).streaming_content), b'%PDF-1.4 csv full')
+
+    def test_old_versions_are_removed(self, build):
+        stale = reports.stale_report_paths(self.run.id, full=False)
+        for path in stale:
+            default_storage.save(path, ContentFile(b'old'))
+        reports.render_report(self.run)
+        self.assertTrue(stale)
+        self.assertFalse(any(default_storage.exists(path) for path in stale))
+
+    def test_slow_render_answers_202(self, build):
+        release = threading.Event()
+
+        def slow(*args, **kwargs):
+            release.wait(10)
+            fake_build_report(*args, **kwargs)
+
+        build.side_effect = slow
+        url = f'/reports/{self.run.pk}/'
+        with override_settings(NIKA_REPORTS={**settings.NIKA_REPORTS, 'wait_seconds': 0.05}):
+            response = self.client.get(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Retry-After'], '5')
+        release.set()
+        reports.schedule(self.run).result(timeout=10)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_concurrent_requests_share_one_render(self, build):
+        release = threading.Event()
+
+        def slow(*args, **kwargs):
+            release.wait(10)
+            fake_build_report(*args, **kwargs)
+
+        build.side_effect = slow
+        futures = []
+        threads = [threading.Thread(target=lambda: futures.append(reports.schedule(self.run))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        release.set()
+        self.assertEqual(len({id(future) for future in futures}), 1)
+        futures[0].result(timeout=10)
+        self.assertEqual(build.call_count, 1)
+
+    def test_finished_render_does_not_forget_a_newer_one(self, build):
+        key = f'{self.run.id}-v{reports.REPORT_VERSION}'
+        old, new = Future(), Future()
+        self.addCleanup(reports._pending.pop, key, None)
+        reports._pending[key] = new
+        reports._forget(key, old)
+        self.assertIs(reports._pending[key], new)
+        reports._forget(key, new)
+        self.assertNotIn(key, reports._pending)
+
+
+class UrlRoutingTests(SimpleTestCase):
+    def test_report_and_upload_views_come_from_their_modules(self):
+        run_id = '00000000-0000-0000-0000-000000000001'
+        self.assertIs(resolve(f'/reports/{run_id}/').func, report_view.run_report)
+        self.assertIs(resolve('/download-report/').func, report_view.download_report)
+        self.assertIs(resolve('/uploads/').func, upload_view.upload_start)
+        self.assertIs(resolve(f'/uploads/{run_id}/').func, upload_view.upload_chunk)
+
+        urlconf = async_urlconf()
+        self.assertIs(resolve(f'/reports/{run_id}/', urlconf).func, async_views.run_report)
+        self.assertIs(resolve('/download-report/', urlconf).func, async_views.download_report)
+        self.assertIs(resolve('/uploads/', urlconf).func, async_views.upload_start)
+        self.assertIs(resolve(f'/uploads/{run_id}/', urlconf).func, async_views.upload_chunk)
+
+
+@override_settings(ROOT_URLCONF=async_urlconf())
+class AsyncViewTests(MediaTestMixin, TransactionTestCase):
+    async def _own(self, key='owner-a'):
+        session = await self.async_client.asession()
+        await session.aset(access.SESSION_KEY, key)
+        await session.asave()
+
+    async def test_job_status(self):
+        job = await AnalysisJob.objects.acreate(
+            kind='csv', original_name='a.csv', input_path='jobs/a.csv', owner_key='owner-a'
+        )
+        await self._own('owner-b')
+        self.assertEqual((await self.async_client.get(f'/jobs/{job.pk}/')).status_code, 404)
+        await self._own('owner-a')
+        response = await self.async_client.get(f'/jobs/{job.pk}/')
+        self.assertEqual(json.loads(response.content)['status'], AnalysisJob.QUEUED)
+
+    async def test_export_streams(self):
+        run = await sync_to_async(AnalysisRun.store)('csv', CSV_RESULT, 'data.csv', owner_key='owner-a')
+        await self._own()
+        response = await self.async_client.get(f'/export/{run.pk}/', {'format': 'jsonl'})
+        self.assertEqual(response.status_code, 200)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.decode().splitlines()), 3)
+
+        await self._own('owner-b')
+        self.assertEqual((await self.async_client.get(f'/export/{run.pk}/')).status_code, 404)
+
+    async def test_chunked_upload(self):
+        data = b'a,b\n1,2\n'
+        response = await self.async_client.post(
+            '/uploads/', {'kind': 'csv', 'filename': 'a.csv', 'size': len(data)}, content_type='application/json'
+        )
+        status = json.loads(response.content)
+        response = await self.async_client.put(
+            status['url'], data, content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes 0-{len(data) - 1}/{len(data)}'},
+        )
+        self.assertEqual(response.status_code, 202)
+        job = await AnalysisJob.objects.aget(pk=json.loads(response.content)['job']['id'])
+        self.assertEqual(job.content_hash, hashlib.sha256(data).hexdigest())
+
+
+class ExactDuplicateTests(MediaTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        import pandas as pd
+
+        values = pd.DataFrame({'a': [1.0, 2.0, 3.0]})
+        scores_path = exports.write_scores('scores/first.csv.gz', range(3), [0.1, -0.2, 0.3], [False, True, False], values)
+        run = AnalysisRun.store('csv', {**CSV_RESULT, 'scores_path': scores_path}, 'first.csv', owner_key='owner-a')
+        self.original = AnalysisJob.objects.create(
+            kind='csv', original_name='first.csv', input_path='jobs/first.csv', owner_key='owner-a',
+            content_hash='f' * 64, status=AnalysisJob.DONE, finished_at=timezone.now(), run=run,
+        )
+
+    def _upload(self, owner_key):
+        path = default_storage.save('jobs/again.csv', ContentFile(b'a\n1\n2\n3\n'))
+        return AnalysisJob.objects.create(
+            kind='csv', original_name='again.csv', input_path=path, owner_key=owner_key, content_hash='f' * 64
+        )
+
+    def test_lookup_is_scoped_to_the_uploader(self):
+        self.assertEqual(dedup.find_identical('csv', 'f' * 64, owner_key='owner-a'), self.original)
+        self.assertIsNone(dedup.find_identical('csv', 'f' * 64, owner_key='owner-b'))
+        self.assertIsNone(dedup.find_identical('csv', 'f' * 64))
+        self.assertIsNone(dedup.find_identical('image', 'f' * 64, owner_key='owner-a'))
+
+    def test_other_session_does_not_reuse(self):
+        job = self._upload('owner-b')
+        with mock.patch.object(dedup, 'reuse_identical') as reuse:
+            jobs.run_job(job.pk)
+        reuse.assert_not_called()
+
+    def test_reused_scores_outlive_the_original_run(self):
+        job = self._upload('owner-a')
+        jobs.run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.run.load()['duplicate_of']['job_id'], str(self.original.pk))
+        self.assertEqual(job.run.scores_path, 'scores/first.csv.gz')
+
+        self.original.run.delete()
+        self.assertTrue(default_storage.exists('scores/first.csv.gz'))
+        own(self.client)
+        response = self.client.get(f'/export/{job.run.pk}/', {'format': 'csv', 'table': 'scores'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 4)
+
+        job.run.delete()
+        self.assertFalse(default_storage.exists('scores/first.csv.gz'))
+
+
+class ChunkedUploadTests(MediaTestMixin, TestCase):
+    data = b'a,b\n' + b'1,2\n' * 2500
+
+    def _start(self, client=None):
+        response = (client or self.client).post(
+            '/uploads/', {'kind': 'csv', 'filename': 'big.csv', 'size': len(self.data)}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def _put(self, url, start, end):
+        return self.client.put(
+            url, self.data[start:end], content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes {start}-{end - 1}/{len(self.data)}'},
+        )
+
+    def test_resume_after_interruption(self):
+        status = self._start()
+        half = len(self.data) // 2
+        self.assertEqual(self._put(status['url'], 0, half).json()['offset'], half)
+
+        # The client lost track; it asks where to resume and a stale chunk is refused
+        self.assertEqual(self.client.get(status['url']).json()['offset'], half)
+        response = self._put(status['url'], 0, half)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], half)
+
+        response = self._put(status['url'], half, len(self.data))
+        self.assertEqual(response.status_code, 202)
+        job = AnalysisJob.objects.get(pk=response.json()['job']['id'])
+        self.assertEqual(job.content_hash, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(job.owner_key, self.client.session[access.SESSION_KEY])
+        with default_storage.open(job.input_path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+
+    def test_failed_finish_is_retried(self):
+        status = self._start()
+        with mock.patch.object(jobs, 'enqueue_stored', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                self._put(status['url'], 0, len(self.data))
+        session = UploadSession.objects.get(pk=status['upload_id'])
+        self.assertTrue(session.is_complete)
+        self.assertIsNone(session.job_id)
+
+        response = self.client.get(status['url'])
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response.json()['complete'])
+        job = UploadSession.objects.get(pk=status['upload_id']).job
+        with default_storage.open(job.input_path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+
+    def test_other_session_cannot_reach_upload(self):
+        status = self._start()
+        other = self.client_class()
+        own(other, 'owner-b')
+        self.assertEqual(other.get(status['url']).status_code, 404)
+        self.assertEqual(other.delete(status['url']).status_code, 404)
+        self.assertEqual(self.client.delete(status['url']).status_code, 204)
+
+
+class HttpCacheTests(MediaTestMixin, TestCase):
+    def test_dashboard_answers_304(self):
+        self.client.get('/')  # sets the CSRF cookie the page depends on
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_no_etag_while_a_job_is_pending(self):
+        job = AnalysisJob.objects.create(kind='csv', original_name='a.csv', input_path='jobs/a.csv')
+        session = self.client.session
+        session['pending_jobs'] = {'csv': str(job.pk)}
+        session.save()
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_no_etag_while_messages_are_shown(self):
+        job = AnalysisJob.objects.create(
+            kind='csv', original_name='a.csv', input_path='jobs/a.csv', status=AnalysisJob.FAILED, error='boom'
+        )
+        session = self.client.session
+        session['pending_jobs'] = {'csv': str(job.pk)}
+        session.save()
+        response = self.client.get('/')
+        self.assertContains(response, 'boom')
+        self.assertNotIn('ETag', response)
+
+    def test_serve_media(self):
+        default_storage.save('uploads/a.txt', ContentFile(b'hello'))
+        factory = RequestFactory()
+        response = http_cache.serve_media(factory.get('/media/uploads/a.txt'), 'uploads/a.txt', settings.MEDIA_ROOT)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'hello')
+        self.assertIn('max-age', response['Cache-Control'])
+
+        request = factory.get('/media/uploads/a.txt', headers={'If-None-Match': response['ETag']})
+        response = http_cache.serve_media(request, 'uploads/a.txt', settings.MEDIA_ROOT)
+        self.assertEqual(response.status_code, 304)
+
+        with self.assertRaises(Http404):
+            http_cache.serve_media(factory.get('/media/missing.txt'), 'missing.txt', settings.MEDIA_ROOT)
+
+    def test_export_revalidates_without_reading_the_run(self):
+        run = AnalysisRun.store('csv', CSV_RESULT, 'data.csv', owner_key=own(self.client))
+        url = f'/export/{run.pk}/'
+        etag = self.client.get(url, {'format': 'csv'})['ETag']
+        with mock.patch.object(exports, 'anomaly_table', side_effect=AssertionError('table built')):
+            response = self.client.get(url, {'format': 'csv'}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.client.get(url, {'format': 'json'})['ETag'], etag)
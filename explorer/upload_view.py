@@ -0,0 +1,103 @@
+"""
+Endpoints of the chunked upload protocol (see explorer.uploads).
+
+    POST   /uploads/       JSON {"kind": "csv"|"image", "filename": ..., "size": ...};
+                           answers 201 with the upload's status
+    GET    /uploads/<id>/  status: committed offset, size and chunk size, plus the job once complete
+                           (an upload whose analysis could not be queued is retried here)
+    PUT    /uploads/<id>/  one chunk as the raw body, with "Content-Range: bytes start-end/total";
+                           answers the new status, 409 with the committed offset if the chunk
+                           does not start there, or 202 with the queued job after the last chunk
+    DELETE /uploads/<id>/  abandon the upload
+
+An upload is only reachable from the user or browser session that started it
+(see explorer.access); any other ID answers 404.
+"""
+import json
+
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.urls import reverse
+
+from .models import UploadSession
+from . import access, uploads, views
+
+
+def upload_status(session):
+    """State of an upload as the client resumes from it."""
+    status = {
+        'upload_id': str(session.pk),
+        'url': reverse('upload_chunk', args=[session.pk]),
+        'kind': session.kind,
+        'filename': session.original_name,
+        'offset': session.offset,
+        'size': session.size,
+        'chunk_size': uploads.chunk_size(),
+        'complete': session.job_id is not None,
+    }
+    if session.job_id is not None:
+        status['job'] = views._job_json(session.job)
+    return status
+
+
+def start_upload(request, user):
+    """Open an upload session from the POSTed kind, filename and size."""
+    try:
+        params = json.loads(request.body) if request.content_type == 'application/json' else request.POST
+        session = uploads.start(
+            params.get('kind'), params.get('filename'), params.get('size'),
+            user=user, owner_key=access.owner_key(request),
+        )
+    except ValueError:
+        return JsonResponse({'error': 'The request body must be a JSON object.'}, status=400)
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(upload_status(session), status=201)
+
+
+def handle_chunk(request, upload_id):
+    """
+    Answer GET, PUT or DELETE on an upload.
+
+    Returns:
+        tuple: (response, the queued AnalysisJob if this PUT completed the upload, else None)
+    """
+    session = access.owned(UploadSession.objects.select_related('job'), request).filter(pk=upload_id).first()
+    if session is None:
+        return JsonResponse({'error': 'Unknown upload'}, status=404), None
+    if request.method == 'GET':
+        try:
+            job = uploads.finish_pending(session)
+        except uploads.UploadError as e:
+            return JsonResponse({**upload_status(session), 'error': str(e)}, status=e.status), None
+        return JsonResponse(upload_status(session), status=202 if job is not None else 200), job
+    if request.method == 'DELETE':
+        uploads.discard(session)
+        return HttpResponse(status=204), None
+    if request.method != 'PUT':
+        return HttpResponseNotAllowed(['GET', 'PUT', 'DELETE']), None
+
+    try:
+        start, length = uploads.parse_content_range(request.headers.get('content-range'), session)
+        job = uploads.append(session, start, length, request)
+    except uploads.UploadError as e:
+        return JsonResponse({**upload_status(session), 'error': str(e)}, status=e.status), None
+    return JsonResponse(upload_status(session), status=202 if job is not None else 200), job
+
+
+def upload_start(request):
+    """
+    Open a chunked upload.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    return start_upload(request, views._upload_user(request))
+
+
+def upload_chunk(request, upload_id):
+    """
+    Report, continue or abandon a chunked upload; the last chunk queues the analysis.
+    """
+    response, job = handle_chunk(request, upload_id)
+    if job is not None:
+        views._track_job(request, job)
+    return response
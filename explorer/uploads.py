@@ -0,0 +1,356 @@
+"""
+Chunked, resumable uploads, and content hashes of every upload.
+
+A mine site's link may drop a multi-GB survey export or drone video half
+way; with a plain form upload the transfer then starts over. Here a client
+opens an UploadSession, then sends the file in pieces, each one at the
+offset the server last committed (explorer.upload_view has the endpoints).
+After an interruption it asks for that offset and resumes from there.
+Chunks are written straight into a partial file on disk, which is moved
+into place when the last one is in, so nothing is buffered or copied.
+Requests for the same upload take turns (_locked()), and if queueing the
+analysis fails after the last chunk, asking for the upload's status (or
+resending that chunk) retries it.
+
+The SHA-256 of the file is updated as each chunk arrives (form uploads get
+the same from HashingUploadHandler), so the finished upload is queued with
+its hash and an identical earlier upload is reused without another read
+(see explorer.dedup).
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .forms import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+from .models import UploadSession
+from . import jobs
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the request body per write
+READ_SIZE = 256 * 1024
+# Running hashes kept per process; an upload whose hash was evicted (or whose
+# previous chunk went to another process) rehashes its partial file once
+MAX_HASHERS = 256
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+_hashers = OrderedDict()
+# Per-upload locks where fcntl is missing (see _locked())
+_session_locks = {}
+_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """A chunk or upload the server refuses; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _options():
+    return getattr(settings, 'NIKA_UPLOADS', {})
+
+
+def chunk_size():
+    return _options().get('chunk_size', 8 * 1024 * 1024)
+
+
+def max_size():
+    return _options().get('max_size', 20 * 1024 ** 3)
+
+
+def partial_path(session):
+    return default_storage.path(f'uploads/partial/{session.pk}.part')
+
+
+def upload_kind(slot, filename):
+    """Job kind of a file sent to the 'csv' or 'image' upload, checked as the upload forms do."""
+    name = filename.lower()
+    if slot == 'csv':
+        if not name.endswith('.csv'):
+            raise UploadError('File must be a CSV file.')
+        return 'csv'
+    if slot == 'image':
+        if not name.endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+            raise UploadError('Invalid image format. Supported formats: JPG, PNG, GIF, BMP, WEBP, SVG, TIFF, and video files (MP4, MOV, AVI, MKV, WEBM)')
+        return 'video' if name.endswith(VIDEO_EXTENSIONS) else 'image'
+    raise UploadError(f'Unknown upload type: {slot}')
+
+
+def start(slot, filename, size, user=None, owner_key=''):
+    """
+    Open an upload session.
+
+    Args:
+        slot: 'csv' or 'image', the dashboard form the file was picked in
+        filename: Name of the file on the client
+        size: Total size in bytes
+        user: Uploading user, recorded on the job
+        owner_key: Uploading session's key (see explorer.access), recorded on the job
+
+    Returns:
+        UploadSession
+    """
+    purge_expired()
+    filename = os.path.basename(str(filename or ''))
+    if not filename:
+        raise UploadError('A filename is required.')
+    kind = upload_kind(slot, filename)
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('The file size is required.')
+    if not 0 < size <= max_size():
+        raise UploadError(f'File size must be between 1 byte and {max_size()} bytes.', status=413)
+    return UploadSession.objects.create(
+        kind=kind, original_name=filename, size=size, user=user, owner_key=owner_key
+    )
+
+
+def parse_content_range(header, session):
+    """(start, length) of a chunk from its ``Content-Range: bytes start-end/total`` header."""
+    match = _CONTENT_RANGE.match(header or '')
+    if match is None:
+        raise UploadError('Content-Range must be "bytes <start>-<end>/<total>".')
+    first, last, total = (int(group) for group in match.groups())
+    if total != session.size or last < first or last >= total:
+        raise UploadError(f'Content-Range does not fit an upload of {session.size} bytes.')
+    if last - first + 1 > chunk_size():
+        raise UploadError(f'Chunks may be at most {chunk_size()} bytes.', status=413)
+    return first, last - first + 1
+
+
+def _hasher_at(session):
+    """SHA-256 state over bytes [0, session.offset) of the upload."""
+    with _lock:
+        cached = _hashers.pop(session.pk, None)
+    if cached is not None and cached[0] == session.offset:
+        return cached[1]
+    hasher = hashlib.sha256()
+    if session.offset:
+        logger.info(f"🔁 Rehashing the first {session.offset} bytes of upload {session.pk}")
+        remaining = session.offset
+        with open(partial_path(session), 'rb') as fh:
+            while remaining:
+                data = fh.read(min(remaining, READ_SIZE))
+                if not data:
+                    raise UploadError('The partial upload is missing on the server; start it again.', status=410)
+                hasher.update(data)
+                remaining -= len(data)
+    return hasher
+
+
+def _keep_hasher(session, hasher):
+    with _lock:
+        _hashers[session.pk] = (session.offset, hasher)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+@contextmanager
+def _locked(session):
+    """
+    Hold the upload's lock while writing or finishing it, so two requests for
+    the same offset (a retry racing the original) cannot interleave their writes.
+    The lock is an flock on a file next to the partial upload, which also holds
+    across processes; without fcntl (Windows) it only covers this process.
+    """
+    path = partial_path(session) + '.lock'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fcntl is None:
+        with _lock:
+            session_lock = _session_locks.setdefault(session.pk, threading.Lock())
+        with session_lock:
+            yield
+        return
+    with open(path, 'ab') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _refresh(session):
+    # The upload may have moved on (or been abandoned) while this request waited for its lock
+    try:
+        session.refresh_from_db()
+    except UploadSession.DoesNotExist:
+        raise UploadError('Unknown upload', status=404)
+
+
+def append(session, start, length, stream):
+    """
+    Write one chunk at ``start`` and commit it.
+
+    Args:
+        session: UploadSession receiving the chunk
+        start: Offset of the chunk; must be the committed offset
+        length: Chunk size in bytes
+        stream: File-like object the chunk is read from (the request)
+
+    Returns:
+        AnalysisJob: The queued job if this was the last chunk, else None
+    """
+    with _locked(session):
+        _refresh(session)
+        if session.job_id is not None:
+            raise UploadError('The upload is already complete.', status=409)
+        if session.is_complete:
+            # Every byte is in but queueing the analysis failed; the resent last chunk retries it
+            return _finish(session)
+        if start != session.offset:
+            raise UploadError(f'Expected the chunk at offset {session.offset}.', status=409)
+
+        hasher = _hasher_at(session)
+        path = partial_path(session)
+        remaining = length
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as fh:
+            # Bytes past the committed offset are left over from a chunk that never completed
+            fh.seek(start)
+            fh.truncate()
+            while remaining:
+                data = stream.read(min(remaining, READ_SIZE))
+                if not data:
+                    break
+                fh.write(data)
+                hasher.update(data)
+                remaining -= len(data)
+        if remaining:
+            raise UploadError(f'The chunk ended after {length - remaining} of {length} bytes.')
+
+        # The hash is committed with the last chunk, so a failed _finish() can be retried without it
+        end = start + length
+        complete = end >= session.size
+        content_hash = hasher.hexdigest() if complete else ''
+        if not UploadSession.objects.filter(pk=session.pk, offset=start, job__isnull=True).update(
+            offset=end, content_hash=content_hash, updated_at=timezone.now()
+        ):
+            _refresh(session)
+            raise UploadError(f'Expected the chunk at offset {session.offset}.', status=409)
+        session.offset, session.content_hash = end, content_hash
+        if not complete:
+            _keep_hasher(session, hasher)
+            return None
+        return _finish(session)
+
+
+def finish_pending(session):
+    """
+    Queue the analysis of an upload whose bytes are all in but that has no job yet
+    (its _finish() failed); returns the job, or None if there is nothing to finish.
+    """
+    if session.job_id is not None or not session.is_complete:
+        return None
+    with _locked(session):
+        _refresh(session)
+        if session.job_id is not None:
+            return None
+        return _finish(session)
+
+
+def _finish(session):
+    """
+    Move the assembled file into storage and queue its analysis; called with the
+    upload's lock held. Each step can run again, so a failure is retried by
+    finish_pending() or by resending the last chunk.
+    """
+    if not session.stored_path:
+        folder = 'jobs' if session.kind == 'csv' else 'uploads'
+        # Saving an empty file reserves the name; the partial file then replaces it
+        session.stored_path = default_storage.save(f'{folder}/{session.original_name}', ContentFile(b''))
+        UploadSession.objects.filter(pk=session.pk).update(stored_path=session.stored_path)
+    target = default_storage.path(session.stored_path)
+    if os.path.exists(partial_path(session)):
+        os.replace(partial_path(session), target)
+    elif not os.path.exists(target) or os.path.getsize(target) != session.size:
+        raise UploadError('The uploaded file is missing on the server; start it again.', status=410)
+
+    job = jobs.enqueue_stored(
+        session.kind, session.original_name, session.stored_path, user=session.user,
+        content_hash=session.content_hash, owner_key=session.owner_key,
+    )
+    UploadSession.objects.filter(pk=session.pk).update(job=job)
+    session.job = job
+    with _lock:
+        _hashers.pop(session.pk, None)
+        _session_locks.pop(session.pk, None)
+    _remove(partial_path(session) + '.lock')
+    logger.info(f"📦 Assembled {session.size}-byte upload of {session.original_name} (sha256 {session.content_hash[:12]})")
+    return job
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard(session):
+    """Drop an upload session and its partial file."""
+    with _locked(session):
+        if session.job_id is None:
+            _remove(partial_path(session))
+        _remove(partial_path(session) + '.lock')
+        session.delete()
+    with _lock:
+        _hashers.pop(session.pk, None)
+        _session_locks.pop(session.pk, None)
+
+
+def purge_expired():
+    """Discard upload sessions untouched for NIKA_UPLOADS['expire_hours']."""
+    cutoff = timezone.now() - timedelta(hours=_options().get('expire_hours', 48))
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff):
+        discard(session)
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    First of FILE_UPLOAD_HANDLERS: hashes each form-uploaded file as its
+    chunks stream through to the storing handlers (see content_hash()).
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.hashes = {}
+        self._hasher = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.hashes[self.field_name] = self._hasher.hexdigest()
+        return None
+
+
+def content_hash(request, field_name):
+    """SHA-256 of a file uploaded in ``field_name`` of the request's form, or '' if it was not hashed."""
+    for handler in request.upload_handlers:
+        if isinstance(handler, HashingUploadHandler):
+            return handler.hashes.get(field_name, '')
+    return ''
@@ -1,10 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import report_view, upload_view, views
+
+if getattr(settings, 'NIKA_ASYNC_VIEWS', False):
+    # ASGI: uploads, polling and downloads are served on the event loop
+    from . import async_views as io_views
+    report_views = upload_views = io_views
+else:
+    io_views = views
+    report_views, upload_views = report_view, upload_view
 
 urlpatterns = [
-    path('', views.dashboard, name='dashboard'),
-    path('upload-csv/', views.upload_csv, name='upload_csv'),
-    path('upload-image/', views.upload_image, name='upload_image'),
-    path('download-report/', views.download_report, name='download_report'),
-    path('download-image-report/', views.download_image_report, name='download_image_report'),
+    path('', io_views.dashboard, name='dashboard'),
+    path('upload-csv/', io_views.upload_csv, name='upload_csv'),
+    path('upload-image/', io_views.upload_image, name='upload_image'),
+    path('download-report/', report_views.download_report, name='download_report'),
+    path('export/<uuid:run_id>/', io_views.export_results, name='export_results'),
+    path('reports/<uuid:run_id>/', report_views.run_report, name='run_report'),
+    path('download-image-report/', io_views.download_image_report, name='download_image_report'),
+    path('uploads/', upload_views.upload_start, name='upload_start'),
+    path('uploads/<uuid:upload_id>/', upload_views.upload_chunk, name='upload_chunk'),
+    path('jobs/<uuid:job_id>/', io_views.job_status, name='job_status'),
+    path('charts/<str:kind>/', views.chart_data, name='chart_data'),
+    path('plots/<str:kind>/<uuid:run_id>/<str:name>.png', io_views.plot_image, name='plot_image'),
 ]
\ No newline at end of file
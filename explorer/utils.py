@@ -4,12 +4,18 @@ from datetime import datetime, timedelta
 import io
 from django.http import HttpResponse
 
+from .lazy import available
+from . import report_figures
+
 # Import ML utilities
 try:
     from .ml_utils import (
         process_csv as ml_process_csv,
         process_image as ml_process_image, 
+        process_image_batch as ml_process_image_batch,
+        process_video as ml_process_video,
         generate_report as ml_generate_report,
+        build_report as ml_build_report,
         generate_mineral_recommendations,
         generate_recommendations
     )
@@ -18,52 +24,80 @@ except ImportError as e:
     ML_UTILS_AVAILABLE = False
     print(f"ML utilities not available: {e}")
 
-try:
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import inch
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-    from reportlab.platypus import Image as ReportLabImage
-    from reportlab.graphics.shapes import Drawing, Rect, Circle, String
-    from reportlab.graphics.charts.barcharts import VerticalBarChart
-    from reportlab.graphics.charts.piecharts import Pie
-    from reportlab.graphics import renderPDF
-    from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-    REPORTLAB_AVAILABLE = True
-except ImportError:
-    REPORTLAB_AVAILABLE = False
+# ReportLab is imported by the report builders themselves, on the first report
+REPORTLAB_AVAILABLE = available('reportlab')
 
-def process_csv(file):
+def process_csv(file, progress=None):
     """
     Process CSV files - uses ML models if available, fallback otherwise.
     
     Args:
         file: Uploaded CSV file
+        progress: Optional callback(stage, percent) for job status
         
     Returns:
         dict: Contains anomalies list and metrics dictionary
     """
     if ML_UTILS_AVAILABLE:
-        return ml_process_csv(file)
+        return ml_process_csv(file, progress=progress)
     else:
         return process_csv_fallback(file)
 
-def process_image(file):
+def process_image(file, progress=None, uploader=None):
     """
     Process image files - uses SAM model if available, fallback otherwise.
     
     Args:
         file: Uploaded image file
+        progress: Optional callback(stage, percent) for job status
+        uploader: AnalysisJob of the upload, whose earlier near-duplicates warm-start SAM
         
     Returns:
         dict: Contains anomaly zones, confidence scores, mineral predictions, and overlay image path
     """
     if ML_UTILS_AVAILABLE:
-        return ml_process_image(file)
+        return ml_process_image(file, progress=progress, uploader=uploader)
     else:
         return process_image_fallback(file)
 
+def process_images(paths, batch_size=None):
+    """
+    Process a folder/queue of images - batches the SAM encoder if available.
+    
+    Args:
+        paths: Iterable of image file paths
+        batch_size: Images per encoder batch (None sizes it to free memory)
+        
+    Returns:
+        list: One result dict per image, in process_image format
+    """
+    if ML_UTILS_AVAILABLE:
+        return ml_process_image_batch(paths, batch_size=batch_size)
+    
+    import os
+    from django.core.files import File
+    results = []
+    for path in paths:
+        with open(path, 'rb') as fh:
+            results.append(process_image_fallback(File(fh, name=os.path.basename(path))))
+    return results
+
+def process_video(file, progress=None):
+    """
+    Process inspection video - SAM on scene keyframes if available, fallback otherwise.
+    
+    Args:
+        file: Uploaded video file
+        progress: Optional callback(stage, percent) for job status
+        
+    Returns:
+        dict: process_image format for the main keyframe, plus 'video' and 'timeline'
+    """
+    if ML_UTILS_AVAILABLE:
+        return ml_process_video(file, progress=progress)
+    else:
+        return {**process_image_fallback(file), 'timeline': []}
+
 def generate_report(results, report_type='csv'):
     """
     Generate PDF report - uses ML-aware version if available.
@@ -80,6 +114,21 @@ def generate_report(results, report_type='csv'):
     else:
         return generate_report_fallback(results, report_type)
 
+def build_report(results, report_type, output, full=False):
+    """
+    Render a PDF report into a file - uses ML-aware version if available.
+    
+    Args:
+        results: Dict containing analysis results
+        report_type: 'csv' or 'image'
+        output: File path or writable binary file object
+        full: Also list every anomaly (or zone) and embed the overlay image
+    """
+    if ML_UTILS_AVAILABLE:
+        ml_build_report(results, report_type, output, full=full)
+    else:
+        build_report_fallback(results, report_type, output, full=full)
+
 def process_csv_fallback(file):
     """
     Mock function to process CSV files and return fake anomalies and metrics.
@@ -385,9 +434,31 @@ def generate_report_fallback(results, report_type='csv'):
         response.write("PDF report generation is not available. Please install ReportLab: pip install reportlab")
         return response
     
-    # Create PDF buffer
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
+    build_report_fallback(results, report_type, buffer)
+    
+    response = HttpResponse(content_type='application/pdf')
+    filename = f"NIKA_Report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.write(buffer.getvalue())
+    buffer.close()
+    
+    return response
+
+
+def build_report_fallback(results, report_type, output, full=False):
+    """Render the fallback PDF report into ``output`` (file path or writable binary file object)."""
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("PDF report generation is not available. Please install ReportLab: pip install reportlab")
+    
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    from reportlab.lib.enums import TA_CENTER
+    
+    doc = SimpleDocTemplate(output, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
     
     # Get styles
     styles = getSampleStyleSheet()
@@ -444,29 +515,19 @@ def generate_report_fallback(results, report_type='csv'):
     else:
         story.extend(_generate_image_report_content(results, styles, heading_style))
     
-    # Add fake anomaly map
-    story.append(PageBreak())
-    story.append(Paragraph("Anomaly Distribution Map", heading_style))
-    story.append(_create_fake_map_drawing())
-    story.append(Spacer(1, 0.3*inch))
+    story.extend(report_figures.map_page(results, report_type, heading_style))
+    if full:
+        story.extend(report_figures.full_pages(results, report_type, styles, heading_style))
     
     # Build PDF
     doc.build(story)
-    
-    # Return PDF response
-    pdf_data = buffer.getvalue()
-    buffer.close()
-    
-    response = HttpResponse(content_type='application/pdf')
-    filename = f"NIKA_Report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    response.write(pdf_data)
-    
-    return response
 
 
 def _generate_csv_report_content(results, styles, heading_style):
     """Generate content specific to CSV analysis reports."""
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
     story = []
     
     # Executive Summary
@@ -553,6 +614,9 @@ def _generate_csv_report_content(results, styles, heading_style):
 
 def _generate_image_report_content(results, styles, heading_style):
     """Generate content specific to image analysis reports."""
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
     story = []
     
     # Executive Summary
@@ -674,54 +738,3 @@ def _generate_image_report_content(results, styles, heading_style):
             story.append(Paragraph(f"{i}. {rec}", styles['Normal']))
     
     return story
-
-
-def _create_fake_map_drawing():
-    """Create a fake anomaly distribution map using ReportLab graphics."""
-    drawing = Drawing(6*inch, 4*inch)
-    
-    # Background
-    drawing.add(Rect(0, 0, 6*inch, 4*inch, fillColor=colors.HexColor('#f8fafc'), strokeColor=colors.gray))
-    
-    # Grid lines
-    for i in range(1, 6):
-        x = i * inch
-        drawing.add(Rect(x-1, 0, 2, 4*inch, fillColor=colors.HexColor('#e2e8f0'), strokeWidth=0))
-    
-    for i in range(1, 4):
-        y = i * inch
-        drawing.add(Rect(0, y-1, 6*inch, 2, fillColor=colors.HexColor('#e2e8f0'), strokeWidth=0))
-    
-    # Add fake anomaly points
-    anomaly_points = [
-        (1.2*inch, 3.2*inch, colors.red, 'Critical'),
-        (2.8*inch, 2.5*inch, colors.orange, 'High'),
-        (4.5*inch, 3.8*inch, colors.red, 'Critical'),
-        (1.8*inch, 1.2*inch, colors.yellow, 'Medium'),
-        (3.5*inch, 1.8*inch, colors.green, 'Low'),
-        (5.2*inch, 2.8*inch, colors.orange, 'High'),
-        (0.8*inch, 2.2*inch, colors.yellow, 'Medium'),
-        (4.8*inch, 1.5*inch, colors.green, 'Low')
-    ]
-    
-    for x, y, color, severity in anomaly_points:
-        # Outer circle (glow effect)
-        drawing.add(Circle(x, y, 12, fillColor=color, fillOpacity=0.3, strokeWidth=0))
-        # Inner circle
-        drawing.add(Circle(x, y, 6, fillColor=color, strokeColor=colors.black, strokeWidth=1))
-    
-    # Legend
-    legend_y = 0.5*inch
-    legend_items = [
-        (colors.red, 'Critical'),
-        (colors.orange, 'High'),
-        (colors.yellow, 'Medium'),
-        (colors.green, 'Low')
-    ]
-    
-    for i, (color, label) in enumerate(legend_items):
-        x = 0.5*inch + i * 1.3*inch
-        drawing.add(Circle(x, legend_y, 4, fillColor=color, strokeColor=colors.black, strokeWidth=1))
-        drawing.add(String(x + 0.2*inch, legend_y - 3, label, fontSize=8))
-    
-    return drawing
\ No newline at end of file
@@ -1,60 +1,180 @@
+import itertools
+import os
+import uuid
+
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.http import JsonResponse
-from .forms import CSVUploadForm, ImageUploadForm
-from .utils import process_csv, process_image, generate_report
-from .report_view import download_report
-
-# Import plotting utilities
-try:
-    from .plotting_utils import generate_anomaly_plots, generate_image_plots
-    PLOTTING_AVAILABLE = True
-except ImportError as e:
-    PLOTTING_AVAILABLE = False
-    print(f"Plotting utilities not available: {e}")
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from .forms import CSVUploadForm, ImageUploadForm, VIDEO_EXTENSIONS
+from .models import AnalysisJob, AnalysisRun
+from .report_view import serve_report
+from .chart_data import anomaly_chart_data, image_chart_data
+from .lazy import lazy_import
+from . import access, exports, http_cache, jobs, uploads
+
+# matplotlib loads with the first server-rendered plot
+plotting_utils = lazy_import('explorer.plotting_utils')
+
+# Chart series per result slot; the browser draws them with Chart.js
+CHART_BUILDERS = {
+    'csv': anomaly_chart_data,
+    'image': image_chart_data,
+}
 
 # Create your views here.
 
-def dashboard(request):
-    csv_form = CSVUploadForm()
-    image_form = ImageUploadForm()
+def _is_ajax(request):
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
+
+def _upload_user(request):
+    return request.user if request.user.is_authenticated else None
+
+
+def _job_json(job):
+    """A queued job as upload responses describe it; the dashboard polls its status_url."""
+    return {'job_id': str(job.id), 'status_url': reverse('job_status', args=[job.id]), **job.to_status()}
+
+
+def _track_job(request, job):
+    """Let the dashboard show the job's progress, and its result once done."""
+    pending = request.session.get('pending_jobs', {})
+    pending[job.kind] = str(job.id)
+    request.session['pending_jobs'] = pending
+
+
+def _queued_response(request, job, message):
+    """Answer an upload with the queued job: JSON for XHR uploads, a redirect otherwise."""
+    _track_job(request, job)
     
-    # Get results from session if available
-    image_results = request.session.get('image_results', None)
-    uploaded_file_path = request.session.get('uploaded_file_path', None)
-    csv_results = request.session.get('csv_results', None)
+    if _is_ajax(request):
+        return JsonResponse(_job_json(job), status=202)
+    messages.info(request, message)
+    return redirect('dashboard')
+
+
+def _show_run(request, run):
+    """Point the dashboard at a stored run; the session keeps only its ID (and the image to show)."""
+    # A video's result is its main keyframe's, shown like an image result
+    slot = 'image' if run.kind == 'video' else run.kind
+    request.session[f'{slot}_run'] = str(run.id)
+    if slot == 'image':
+        request.session['uploaded_file_path'] = run.preview_path or None
+
+
+def _invalid_form(request, form):
+    for field, errors in form.errors.items():
+        for error in errors:
+            messages.error(request, f'{field}: {error}')
+    return redirect('dashboard')
+
+
+def _session_run(request, slot):
+    """AnalysisRun the session points at for 'csv' or 'image', or None."""
+    run_id = request.session.get(f'{slot}_run')
+    # The result is loaded on first use, so a 304 never reads it
+    return AnalysisRun.objects.defer('data').filter(pk=run_id).first() if run_id else None
+
+
+def _collect_finished_jobs(request):
+    """Point the session at runs of finished upload jobs; return the jobs still running."""
+    pending = request.session.get('pending_jobs', {})
+    if not pending:
+        return []
     
-    # Generate plots if results are available
-    csv_plots = {}
-    image_plots = {}
+    still_running = []
+    for kind, job_id in list(pending.items()):
+        job = AnalysisJob.objects.filter(pk=job_id).first()
+        if job is None:
+            del pending[kind]
+        elif job.status == AnalysisJob.DONE:
+            if job.run_id:
+                _show_run(request, AnalysisRun.objects.defer('data').get(pk=job.run_id))
+            messages.success(request, f'{job.get_kind_display()} file "{job.original_name}" processed successfully!')
+            del pending[kind]
+        elif job.status == AnalysisJob.FAILED:
+            messages.error(request, f'Error processing {job.kind} file "{job.original_name}": {job.error}')
+            del pending[kind]
+        else:
+            still_running.append({**job.to_status(), 'status_url': reverse('job_status', args=[job.id])})
     
-    if csv_results and PLOTTING_AVAILABLE:
-        try:
-            csv_plots = generate_anomaly_plots(csv_results)
-        except Exception as e:
-            print(f"Error generating CSV plots: {e}")
+    request.session['pending_jobs'] = pending
+    return still_running
+
+
+def _dashboard_runs(request):
+    """Session bookkeeping of a dashboard view; returns (CSV run, image run, jobs still running)."""
+    pending_jobs = _collect_finished_jobs(request)
     
-    if image_results and PLOTTING_AVAILABLE:
+    # ?run=<id> reopens a stored result of this user or session, e.g. from a bookmark
+    if 'run' in request.GET:
         try:
-            image_plots = generate_image_plots(image_results)
-        except Exception as e:
-            print(f"Error generating image plots: {e}")
+            run_id = uuid.UUID(request.GET['run'])
+        except ValueError:
+            raise Http404('Unknown run')
+        run = access.owned(AnalysisRun.objects.defer('data'), request).filter(pk=run_id).first()
+        if run is None:
+            raise Http404('Unknown run')
+        _show_run(request, run)
     
+    # Sessions from before the result store held whole results; drop them
+    for legacy_key in ('csv_results', 'image_results'):
+        request.session.pop(legacy_key, None)
+    
+    return _session_run(request, 'csv'), _session_run(request, 'image'), pending_jobs
+
+
+def _dashboard_etag(request, csv_run, image_run, pending_jobs):
+    """ETag of the dashboard page, or None while it shows something transient (job progress, messages)."""
+    if pending_jobs or len(messages.get_messages(request)):
+        return None
+    return http_cache.etag(
+        'dashboard', csv_run and csv_run.pk, image_run and image_run.pk,
+        request.session.get('uploaded_file_path'), request.user.pk, request.META.get('CSRF_COOKIE'),
+        uploads.chunk_size(), uploads.max_size(),
+    )
+
+
+def _render_dashboard(request, csv_results, image_results, pending_jobs):
     context = {
-        'csv_form': csv_form,
-        'image_form': image_form,
+        'csv_form': CSVUploadForm(),
+        'image_form': ImageUploadForm(),
         'image_results': image_results,
-        'uploaded_file_path': uploaded_file_path,
+        'uploaded_file_path': request.session.get('uploaded_file_path', None),
         'csv_results': csv_results,
-        'csv_plots': csv_plots,
-        'image_plots': image_plots,
+        'csv_run_id': request.session.get('csv_run') if csv_results else None,
+        'pending_jobs': pending_jobs,
+        'upload_chunk_size': uploads.chunk_size(),
+        'upload_max_size': uploads.max_size(),
     }
     return render(request, 'dashboard.html', context)
 
 
+def dashboard(request):
+    csv_run, image_run, pending_jobs = _dashboard_runs(request)
+    
+    # A refresh showing the same runs is answered before any result is loaded
+    etag = _dashboard_etag(request, csv_run, image_run, pending_jobs)
+    if etag is not None:
+        not_modified = http_cache.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+    
+    # Load the results the session points at
+    csv_results = csv_run.load() if csv_run else None
+    image_results = image_run.load() if image_run else None
+    response = _render_dashboard(request, csv_results, image_results, pending_jobs)
+    if etag is not None:
+        http_cache.validate(response, etag, per_session=True)
+    return response
+
+
 def upload_csv(request):
     """
-    Handle CSV file upload and processing with ML models.
+    Handle CSV file upload: queue the ML analysis and return at once.
     """
     if request.method == 'POST':
         form = CSVUploadForm(request.POST, request.FILES)
@@ -62,27 +182,18 @@ def upload_csv(request):
             csv_file = form.cleaned_data['csv_file']
             
             try:
-                # Process the CSV file using ML models
-                results = process_csv(csv_file)
-                
-                # Store results in session for dashboard display
-                request.session['csv_results'] = results
-                
-                # Add success message
-                messages.success(request, f'CSV file "{csv_file.name}" processed successfully with ML models!')
-                
-                # Redirect to dashboard with CSV results tab
-                return redirect('dashboard')
+                # Analysis runs in the job workers; the dashboard picks up the result
+                job = jobs.enqueue(
+                    'csv', csv_file, user=_upload_user(request),
+                    content_hash=uploads.content_hash(request, 'csv_file'), owner_key=access.owner_key(request)
+                )
+                return _queued_response(request, job, f'CSV file "{csv_file.name}" queued for analysis.')
                 
             except Exception as e:
                 messages.error(request, f'Error processing CSV file: {str(e)}')
                 return redirect('dashboard')
         else:
-            # Form is not valid
-            for field, errors in form.errors.items():
-                for error in errors:
-                    messages.error(request, f'{field}: {error}')
-            return redirect('dashboard')
+            return _invalid_form(request, form)
     
     # If GET request, redirect to dashboard
     return redirect('dashboard')
@@ -90,12 +201,9 @@ def upload_csv(request):
 
 def upload_image(request):
     """
-    Handle image file upload and processing for mineral anomaly detection.
+    Handle image file upload: store it and queue mineral anomaly detection.
     """
-    import os
-    from django.conf import settings
     from django.core.files.storage import default_storage
-    from django.core.files.base import ContentFile
     
     if request.method == 'POST':
         form = ImageUploadForm(request.POST, request.FILES)
@@ -103,29 +211,22 @@ def upload_image(request):
             image_file = form.cleaned_data['image_file']
             
             try:
-                # Save the uploaded file to MEDIA_ROOT
-                file_path = default_storage.save(f"uploads/{image_file.name}", ContentFile(image_file.read()))
+                # Stream the upload into MEDIA_ROOT once (large uploads are moved, not copied);
+                # the analysis job decodes this stored copy
+                file_path = default_storage.save(f"uploads/{image_file.name}", image_file)
                 
                 # Log the upload start
                 import logging
                 logger = logging.getLogger(__name__)
-                logger.info(f"🚀 Starting image processing for: {image_file.name} (size: {image_file.size} bytes)")
+                logger.info(f"🚀 Queueing image processing for: {image_file.name} (size: {image_file.size} bytes)")
                 
-                # Process the image file using our mock ML function
-                results = process_image(image_file)
-                
-                logger.info(f"✅ Image processing completed for: {image_file.name}")
-                logger.info(f"📊 Results: {results.get('status')} - {len(results.get('anomaly_zones', []))} zones detected")
-                
-                # Store results in session for dashboard display
-                request.session['image_results'] = results
-                request.session['uploaded_file_path'] = file_path
-                
-                # Add success message
-                messages.success(request, f'Image file "{image_file.name}" processed successfully!')
-                
-                # Redirect to dashboard with image results tab active
-                return redirect('dashboard')
+                # SAM runs in the job workers on the stored copy (on scene keyframes for videos)
+                kind = 'video' if image_file.name.lower().endswith(VIDEO_EXTENSIONS) else 'image'
+                job = jobs.enqueue(
+                    kind, image_file, stored_path=file_path, user=_upload_user(request),
+                    content_hash=uploads.content_hash(request, 'image_file'), owner_key=access.owner_key(request)
+                )
+                return _queued_response(request, job, f'Image file "{image_file.name}" queued for analysis.')
                 
             except Exception as e:
                 import logging
@@ -134,11 +235,7 @@ def upload_image(request):
                 messages.error(request, f'Error processing image file: {str(e)}')
                 return redirect('dashboard')
         else:
-            # Form is not valid
-            for field, errors in form.errors.items():
-                for error in errors:
-                    messages.error(request, f'{field}: {error}')
-            return redirect('dashboard')
+            return _invalid_form(request, form)
     
     # If GET request, redirect to dashboard
     return redirect('dashboard')
@@ -146,23 +243,137 @@ def upload_image(request):
 
 def download_image_report(request):
     """
-    Generate and download PDF report for image analysis results.
+    Download the PDF report of the image run the session shows.
     """
     if request.method == 'POST':
-        # Get image results from session
-        image_results = request.session.get('image_results', None)
+        run = _session_run(request, 'image')
         
-        if not image_results:
+        if run is None:
             messages.error(request, 'No image analysis results found. Please upload and analyze an image first.')
             return redirect('dashboard')
         
-        try:
-            # Generate PDF report using the results
-            response = generate_report(image_results, report_type='image')
-            return response
-            
-        except Exception as e:
-            messages.error(request, f'Error generating report: {str(e)}')
-            return redirect('dashboard')
+        # Rendered once per run (usually in the background when the analysis finished)
+        return serve_report(request, run)
+    
+    return redirect('dashboard')
+
+
+def job_status(request, job_id):
+    """
+    Report state, stage and percent complete of an analysis job as JSON.
+    """
+    job = access.owned(AnalysisJob.objects.all(), request).filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({'error': 'Unknown job'}, status=404)
+    return JsonResponse(job.to_status())
+
+
+def chart_data(request, kind):
+    """
+    Pre-aggregated chart series for the session's CSV or image result as JSON.
+    """
+    if kind not in CHART_BUILDERS:
+        raise Http404('Unknown chart set')
+    run = _session_run(request, kind)
+    if run is None:
+        return JsonResponse({'charts': {}, 'images': {}}, status=404)
+    etag = http_cache.etag('charts', kind, run.id)
+    not_modified = http_cache.not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    
+    charts = CHART_BUILDERS[kind](run.load())
+    # The same plots rendered server-side, e.g. to download as PNG
+    images = {name: reverse('plot_image', args=[kind, run.id, name]) for name in charts}
+    return http_cache.validate(JsonResponse({'charts': charts, 'images': images}), etag, per_session=True)
+
+
+def plot_image(request, kind, run_id, name):
+    """
+    One server-rendered plot of a stored run as PNG, for reports and downloads.
+    
+    Rendered on first request in the plot worker processes, then cached; the
+    run's result never changes, so browsers may cache the image too. A render
+    that takes longer than NIKA_PLOTS['wait_seconds'] goes on in the workers
+    and the client is told to retry (202 with Retry-After).
+    """
+    if name not in plotting_utils.PLOT_SETS.get(kind, {}):
+        raise Http404('Unknown plot')
+    run = access.owned(AnalysisRun.objects.defer('data'), request).filter(pk=run_id).first()
+    if run is None or ('image' if run.kind == 'video' else run.kind) != kind:
+        raise Http404('Unknown run')
+    etag = http_cache.etag('plot', kind, run.id, name)
+    not_modified = http_cache.not_modified(request, etag, run.created_at)
+    if not_modified is not None:
+        return not_modified
+    
+    png = plotting_utils.plot_png(kind, name, run.id, run.load)
+    return _plot_response(png, etag, run)
+
+
+def _plot_response(png, etag, run):
+    if png is None:
+        response = JsonResponse({'status': 'rendering'}, status=202)
+        response['Retry-After'] = '2'
+        return response
+    if not png:
+        raise Http404('No data for this plot')
+    return http_cache.validate(
+        HttpResponse(png, content_type='image/png'), etag, run.created_at,
+        max_age=getattr(settings, 'NIKA_PLOTS', {}).get('max_age', 3600),
+    )
+
+
+def _export_options(request):
+    """(format, table, limit) of an export request, or a 400 JsonResponse."""
+    fmt = request.GET.get('format', 'csv')
+    table = request.GET.get('table', 'anomalies')
+    if fmt not in exports.FORMATS:
+        return JsonResponse({'error': f"Unknown format, use one of: {', '.join(exports.FORMATS)}"}, status=400)
+    if table not in ('anomalies', 'scores'):
+        return JsonResponse({'error': 'Unknown table, use anomalies or scores'}, status=400)
+    try:
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    return fmt, table, limit
+
+
+def export_results(request, run_id):
+    """
+    Stream the full anomaly table of a CSV run, or every row's score, as a download.
+    
+    Query parameters: format (csv, json, jsonl, excel), table (anomalies, scores), limit.
+    Rows are encoded as they are sent. Both tables are read from the run's
+    scores file line by line, so memory stays flat for any run size.
+    """
+    options = _export_options(request)
+    if isinstance(options, HttpResponse):
+        return options
+    
+    run = access.owned(AnalysisRun.objects.defer('data'), request).filter(pk=run_id, kind='csv').first()
+    if run is None:
+        raise Http404('Unknown run')
+    not_modified = http_cache.not_modified(request, _export_etag(run, *options), run.created_at)
+    if not_modified is not None:
+        return not_modified
+    return _export_response(run, *options)
+
+
+def _export_etag(run, fmt, table, limit):
+    return http_cache.etag('export', run.id, fmt, table, limit)
+
+
+def _export_response(run, fmt, table, limit):
+    data = exports.anomaly_table(run) if table == 'anomalies' else exports.score_table(run)
+    if data is None:
+        raise Http404('This run has no per-row scores')
+    header, rows = data
+    if limit is not None:
+        rows = itertools.islice(rows, max(limit, 0))
     
-    return redirect('dashboard')
\ No newline at end of file
+    content_type, extension = exports.FORMATS[fmt]
+    response = StreamingHttpResponse(exports.stream_table(fmt, header, rows, sheet_name=table), content_type=content_type)
+    filename = f"{os.path.splitext(run.original_name)[0] or 'results'}_{table}.{extension}"
+    response['Content-Disposition'] = content_disposition_header(as_attachment=True, filename=filename)
+    return http_cache.validate(response, _export_etag(run, fmt, table, limit), run.created_at)
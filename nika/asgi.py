@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nika.settings')
+# Serve uploads, job polling and downloads with the async views (explorer.async_views)
+os.environ.setdefault('NIKA_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -61,6 +62,7 @@ TEMPLATES = [
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
+                'django.template.context_processors.media',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
@@ -124,6 +126,151 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# SAM (Segment Anything) inference
+NIKA_SAM_CHECKPOINT = os.environ.get(
+    'NIKA_SAM_CHECKPOINT', str(BASE_DIR / 'nika_pipeline' / 'content' / 'sam_weights' / 'sam_vit_h.pth')
+)
+NIKA_SAM_MODEL_TYPE = os.environ.get('NIKA_SAM_MODEL_TYPE', 'vit_h')
+NIKA_SAM_OPTIONS = {
+    # CPU-only servers: inference_mode + channels-last, optional bf16 autocast / torch.compile
+    'cpu_accel': os.environ.get('NIKA_SAM_CPU_ACCEL', '0') == '1',
+    'bf16': os.environ.get('NIKA_SAM_BF16', '0') == '1',
+    'compile': os.environ.get('NIKA_SAM_COMPILE', '0') == '1',
+    'threads': int(os.environ.get('NIKA_SAM_THREADS', '0')) or None,
+    'interop_threads': int(os.environ.get('NIKA_SAM_INTEROP_THREADS', '0')) or None,
+    # INT8 dynamic quantization of the encoder, cached next to the checkpoint as *.int8.pt
+    'quantize': os.environ.get('NIKA_SAM_QUANTIZE', '0') == '1',
+    # 'torch' or 'onnx' (ONNX Runtime on CPU, files written by `manage.py export_sam_onnx`)
+    'backend': os.environ.get('NIKA_SAM_BACKEND', 'torch'),
+    'onnx_dir': os.environ.get('NIKA_SAM_ONNX_DIR', str(BASE_DIR / 'nika_pipeline' / 'content' / 'sam_weights' / 'onnx')),
+}
+# Shared SAM process (`manage.py sam_server`): 'host:port' or a Unix socket path.
+# Empty means every worker loads its own model.
+NIKA_SAM_SERVER = os.environ.get('NIKA_SAM_SERVER', '')
+NIKA_SAM_SERVER_AUTHKEY = os.environ.get('NIKA_SAM_SERVER_AUTHKEY', '')
+
+# Reference minerals matched against each segment's mean colour (and optionally texture).
+# CSV/JSON rows: key, mineral, r, g, b (0-1), texture_contrast, texture_homogeneity
+NIKA_MINERAL_LIBRARY = {
+    'path': os.environ.get('NIKA_MINERAL_LIBRARY', str(BASE_DIR / 'nika_pipeline' / 'content' / 'minerals.csv')),
+    'space': 'rgb',  # 'rgb' cosine similarity or 'lab' (CIE76 distance)
+    'texture_weight': 0.0,
+    'top_n': 3,
+    # Per-pixel mineral map through a bins³ colour lookup table
+    'pixel_map': True,
+    'lut_bins': 32,
+    'min_similarity': 0.0,  # pixels less similar than this to every reference map to "Unknown"
+}
+
+# Zone overlays rendered once per analysis into MEDIA_ROOT/overlays
+NIKA_OVERLAY = {
+    'format': 'webp',  # falls back to jpg if OpenCV lacks WebP
+    'quality': 85,
+    'max_side': 2048,
+    'thumb_side': 320,
+    'alpha': 0.45,
+}
+
+# Large (Big)TIFF uploads are read tile by tile and analysed at most this size
+NIKA_LARGE_IMAGE = {
+    'max_side': 4096,
+}
+
+# Uploads within max_distance bits (of 64) of the perceptual hash of an image the same user or
+# session analysed before are segmented at that image's zones instead of SAM's full point grid
+NIKA_NEAR_DUPLICATES = {
+    'enabled': True,
+    'max_distance': 10,  # re-exposures/recompression differ by ~0-8 bits, unrelated images by ~30
+}
+
+# Uploads byte-identical (same SHA-256) to an earlier upload of the same kind reuse its result
+NIKA_EXACT_DUPLICATES = {
+    'enabled': True,
+}
+
+# Video uploads: frames scored per second, and when a new scene (keyframe) starts
+NIKA_VIDEO = {
+    'sample_fps': 2.0,
+    'scene_threshold': 0.4,  # Bhattacharyya distance between HSV histograms
+    'min_scene_seconds': 1.0,
+    'max_keyframes': 50,
+}
+
+# Rendered plot PNGs (plotting_utils.plot_png), one entry per run and plot, about 50-150 KB
+# each; entries are culled past MAX_ENTRIES. Point 'plots' at a shared backend (file/redis)
+# to share renders between worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'plots': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nika-plots',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 256, 'CULL_FREQUENCY': 4},
+    },
+}
+
+# Server-side plot images (/plots/...): matplotlib runs in a pool of `workers` processes,
+# 0 renders in the web process. A request waits at most wait_seconds for a render, then
+# answers 202 and the client retries. max_age is the browser cache lifetime of a plot.
+NIKA_PLOTS = {
+    'workers': int(os.environ.get('NIKA_PLOT_WORKERS', '2')),
+    'wait_seconds': 5,
+    'max_age': 24 * 3600,
+}
+
+# PDF reports, stored under MEDIA_ROOT/reports/ once per run. prerender renders them in the
+# background as soon as a job finishes; a download waits at most wait_seconds for a render.
+NIKA_REPORTS = {
+    'prerender': True,
+    'workers': 1,
+    'wait_seconds': 30,
+    # Anomaly map: one marker per anomaly up to map_max_points, density bins (map_bins across) beyond
+    'map_max_points': 2000,
+    'map_bins': 60,
+    # Full reports list at most this many anomalies (the exports have all of them)
+    'full_max_rows': 100000,
+    # Overlays embedded in full reports: longest side in px and JPEG quality
+    'image_max_side': 1600,
+    'image_quality': 80,
+}
+
+# Async upload, dashboard, job status, report and export views (explorer.async_views), for
+# ASGI servers; nika/asgi.py turns them on. Their blocking I/O runs in io_workers threads.
+NIKA_ASYNC_VIEWS = os.environ.get('NIKA_ASYNC_VIEWS', '0') == '1'
+NIKA_IO_WORKERS = int(os.environ.get('NIKA_IO_WORKERS', '8'))
+
+# HTTP caching (explorer.http_cache): pages and downloads built from stored runs answer
+# If-None-Match with 304; media files (uploads, previews, overlays) are reused for media_max_age
+NIKA_HTTP_CACHE = {
+    'media_max_age': 3600,
+}
+
+# Chunked, resumable uploads (explorer.uploads): clients send files in chunk_size pieces, up
+# to max_size bytes in all; unfinished uploads are discarded after expire_hours
+NIKA_UPLOADS = {
+    'chunk_size': 8 * 1024 * 1024,
+    'max_size': 20 * 1024 ** 3,
+    'expire_hours': 48,
+}
+
+# Form uploads are hashed as they stream in, before Django's default handlers store them
+FILE_UPLOAD_HANDLERS = [
+    'explorer.uploads.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Analysis jobs: worker threads per web process; 0 leaves the queue to `manage.py run_jobs`
+NIKA_JOB_WORKERS = int(os.environ.get('NIKA_JOB_WORKERS', '2'))
+# 'process' runs jobs in spawned worker processes instead of threads, so analysis cannot hold
+# the GIL while the web process serves requests (recommended under ASGI)
+NIKA_JOB_EXECUTOR = os.environ.get('NIKA_JOB_EXECUTOR', 'thread')
+# On startup, RUNNING jobs whose process has exited are failed, and so are jobs on other hosts
+# that sent no heartbeat (every 30 seconds while they run) for this many minutes
+NIKA_JOB_STALE_MINUTES = int(os.environ.get('NIKA_JOB_STALE_MINUTES', '5'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -19,11 +19,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from explorer.http_cache import serve_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('explorer.urls')),
 ]
 
-# Serve media files in development
+# Serve media files in development (answering If-None-Match, see explorer.http_cache)
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,132 @@
+
+import numpy as np
+
+
+class CompactMask:
+    """Binary mask stored as a bbox-cropped, bit-packed array.
+
+    A 24 MP mask costs ~24 MB as a dense bool array; the cropped, packed
+    form costs (bbox area / 8) bytes, and area/bbox are kept precomputed.
+    """
+
+    __slots__ = ("shape", "x0", "y0", "crop_shape", "area", "_bits")
+
+    def __init__(self, bits, crop_shape, x0, y0, shape, area):
+        self._bits = bits
+        self.crop_shape = tuple(int(s) for s in crop_shape)
+        self.x0 = int(x0)
+        self.y0 = int(y0)
+        self.shape = tuple(int(s) for s in shape)
+        self.area = int(area)
+
+    @classmethod
+    def empty(cls, shape):
+        return cls(np.zeros(0, dtype=np.uint8), (0, 0), 0, 0, shape, 0)
+
+    @classmethod
+    def from_dense(cls, seg, offset=(0, 0), shape=None):
+        """Build from a dense bool array placed at ``offset`` (x, y) in an image of ``shape``."""
+        seg = np.asarray(seg, dtype=bool)
+        shape = shape or seg.shape
+        rows = np.flatnonzero(seg.any(axis=1))
+        if len(rows) == 0:
+            return cls.empty(shape)
+        cols = np.flatnonzero(seg.any(axis=0))
+        y0, y1 = rows[0], rows[-1] + 1
+        x0, x1 = cols[0], cols[-1] + 1
+        crop = seg[y0:y1, x0:x1]
+        return cls(np.packbits(crop, axis=None), crop.shape,
+                   x0 + offset[0], y0 + offset[1], shape, np.count_nonzero(crop))
+
+    @classmethod
+    def from_rle(cls, rle):
+        """Build from SAM's uncompressed RLE (column-major run lengths, starting with zeros)."""
+        h, w = rle["size"]
+        counts = np.asarray(rle["counts"], dtype=np.int64)
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        on_starts, on_ends = starts[1::2], ends[1::2]
+        keep = on_ends > on_starts
+        on_starts, on_ends = on_starts[keep], on_ends[keep]
+        if len(on_starts) == 0:
+            return cls.empty((h, w))
+
+        # Only decode the column band the runs touch, never the full H×W plane
+        c0 = int(on_starts[0] // h)
+        c1 = int((on_ends[-1] - 1) // h) + 1
+        base = c0 * h
+        edges = np.zeros((c1 - c0) * h + 1, dtype=np.int32)
+        np.add.at(edges, on_starts - base, 1)
+        np.add.at(edges, on_ends - base, -1)
+        band = (np.cumsum(edges[:-1]) > 0).reshape(c1 - c0, h).T
+        return cls.from_dense(band, offset=(c0, 0), shape=(h, w))
+
+    @property
+    def bbox(self):
+        """Inclusive (x_min, y_min, x_max, y_max) in image coordinates."""
+        ch, cw = self.crop_shape
+        return (self.x0, self.y0, self.x0 + max(cw - 1, 0), self.y0 + max(ch - 1, 0))
+
+    @property
+    def slices(self):
+        ch, cw = self.crop_shape
+        return (slice(self.y0, self.y0 + ch), slice(self.x0, self.x0 + cw))
+
+    @property
+    def nbytes(self):
+        return self._bits.nbytes
+
+    def crop(self):
+        """Dense bool array covering only the bounding box."""
+        ch, cw = self.crop_shape
+        return np.unpackbits(self._bits, count=ch * cw).reshape(ch, cw).view(bool)
+
+    def gather(self, image):
+        """Pixels of ``image`` (H×W or H×W×C) under the mask, like ``image[dense_mask]``."""
+        if self.area == 0:
+            return image[:0].reshape((0,) + image.shape[2:])
+        return image[self.slices][self.crop()]
+
+    def paste(self, target, value):
+        """Write ``value`` into ``target`` wherever the mask is set."""
+        if self.area:
+            target[self.slices][self.crop()] = value
+        return target
+
+    def iou(self, other):
+        """Intersection over union, computed only over the overlap of the two bboxes."""
+        union = self.area + other.area
+        if union == 0:
+            return 1.0
+        ax0, ay0, ax1, ay1 = self.bbox
+        bx0, by0, bx1, by1 = other.bbox
+        x0, y0 = max(ax0, bx0), max(ay0, by0)
+        x1, y1 = min(ax1, bx1), min(ay1, by1)
+        inter = 0
+        if self.area and other.area and x0 <= x1 and y0 <= y1:
+            a = self.crop()[y0 - ay0:y1 - ay0 + 1, x0 - ax0:x1 - ax0 + 1]
+            b = other.crop()[y0 - by0:y1 - by0 + 1, x0 - bx0:x1 - bx0 + 1]
+            inter = int(np.count_nonzero(a & b))
+        return inter / (union - inter)
+
+    def to_dense(self):
+        dense = np.zeros(self.shape, dtype=bool)
+        if self.area:
+            dense[self.slices] = self.crop()
+        return dense
+
+    def to_rle(self):
+        """Uncompressed COCO-style RLE of the full-size mask."""
+        flat = self.to_dense().ravel(order="F")
+        change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        bounds = np.concatenate(([0], change, [flat.size]))
+        counts = np.diff(bounds).tolist()
+        if flat.size and flat[0]:
+            counts = [0] + counts
+        return {"size": list(self.shape), "counts": counts}
+
+    def sum(self):
+        return self.area
+
+    def __repr__(self):
+        return f"CompactMask(area={self.area}, bbox={self.bbox}, shape={self.shape})"
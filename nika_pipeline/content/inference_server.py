@@ -0,0 +1,149 @@
+
+import logging
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """'host:port' -> TCP address tuple, anything else is a Unix socket path."""
+    host, sep, port = str(address).rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return str(address)
+
+
+def _attach(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # The client owns the segment; stop this process's tracker from unlinking it on exit
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SamServer:
+    """Owns the one SAM model and segments images sent by web workers.
+
+    Images arrive as shared-memory segments written by the client; only the
+    compact masks travel back over the socket. ``segment(img, max_masks)`` runs
+    the automatic generator, ``segment_points(img, points)`` the point prompts
+    of a warm start.
+    """
+
+    def __init__(self, address, authkey, segment, info, segment_points=None):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.segment = segment
+        self.segment_points = segment_points
+        self.info = info
+        # One model, one forward at a time; clients queue on the lock
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        with Listener(self.address, authkey=self.authkey) as listener:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Bad authkey or a client that went away during the handshake
+                    logger.warning(f"Rejected SAM client connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(self._dispatch(request))
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    conn.send({"error": f"{type(e).__name__}: {e}"})
+
+    def _dispatch(self, request):
+        op = request.get("op")
+        if op == "info":
+            return {"info": self.info}
+        if op == "segment":
+            return {"masks": self._run(request, self.segment, request.get("max_masks"))}
+        if op == "segment_points" and self.segment_points is not None:
+            return {"masks": self._run(request, self.segment_points, request["points"])}
+        raise ValueError(f"Unknown op: {op!r}")
+
+    def _run(self, request, segment, arg):
+        shm = _attach(request["shm"])
+        try:
+            img = np.ndarray(request["shape"], dtype=request["dtype"], buffer=shm.buf)
+            with self._lock:
+                masks = segment(img, arg)
+            del img
+        finally:
+            shm.close()
+        return masks
+
+
+class SamClient:
+    """Connection from a web worker to the SAM server; safe to share between threads."""
+
+    def __init__(self, address, authkey):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _call(self, request):
+        with self._lock:
+            for attempt in range(2):
+                if self._conn is None:
+                    self._conn = Client(self.address, authkey=self.authkey)
+                try:
+                    self._conn.send(request)
+                    reply = self._conn.recv()
+                    break
+                except (EOFError, OSError):
+                    # Server restarted since the last call: reconnect once
+                    self._conn = None
+                    if attempt:
+                        raise
+        if "error" in reply:
+            raise RuntimeError(f"SAM server: {reply['error']}")
+        return reply
+
+    def info(self):
+        return self._call({"op": "info"})["info"]
+
+    def _send_image(self, op, img_rgb, **fields):
+        img_rgb = np.ascontiguousarray(img_rgb)
+        shm = shared_memory.SharedMemory(create=True, size=max(img_rgb.nbytes, 1))
+        try:
+            np.ndarray(img_rgb.shape, dtype=img_rgb.dtype, buffer=shm.buf)[...] = img_rgb
+            reply = self._call({
+                "op": op,
+                "shm": shm.name,
+                "shape": img_rgb.shape,
+                "dtype": img_rgb.dtype.str,
+                **fields,
+            })
+        finally:
+            shm.close()
+            shm.unlink()
+        return reply["masks"]
+
+    def segment(self, img_rgb, max_masks=None):
+        return self._send_image("segment", img_rgb, max_masks=max_masks)
+
+    def segment_at_points(self, img_rgb, points):
+        """One mask record per (x, y) prompt, in point order (see utils.segment_at_points)."""
+        return self._send_image("segment_points", img_rgb, points=[(float(x), float(y)) for x, y in points])
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
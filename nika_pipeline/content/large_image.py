@@ -0,0 +1,192 @@
+
+import mmap, threading
+import cv2, numpy as np
+import tifffile
+
+# Longest side analysed when a large image is read as a whole
+DEFAULT_MAX_SIDE = 4096
+# Window size for uncompressed (memory-mapped) levels, which have no tiles of their own
+MEMMAP_BLOCK = 1024
+TIFF_MAGIC = (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")
+
+
+def is_tiff(name_or_head):
+    """True for a ``.tif``/``.tiff`` name or a buffer starting with a (Big)TIFF header."""
+    if isinstance(name_or_head, str):
+        return name_or_head.lower().endswith((".tif", ".tiff"))
+    return bytes(name_or_head[:4]) in TIFF_MAGIC
+
+
+def to_rgb8(arr):
+    """H×W[×S] samples of any integer/float type to H×W×3 uint8 (alpha and extra bands dropped)."""
+    if arr.ndim == 2:
+        arr = arr[..., None]
+    arr = arr[..., :3] if arr.shape[-1] >= 3 else arr[..., :1]
+    if arr.dtype == np.uint16:
+        arr = (arr >> 8).astype(np.uint8)
+    elif arr.dtype.kind in "iu" and arr.dtype != np.uint8:
+        arr = (np.clip(arr, 0, None) * (255.0 / np.iinfo(arr.dtype).max)).astype(np.uint8)
+    elif arr.dtype.kind == "f":
+        arr = (np.clip(arr, 0, 1) * 255).astype(np.uint8)
+    elif arr.dtype == bool:
+        arr = arr.astype(np.uint8) * 255
+    if arr.shape[-1] == 1:
+        arr = np.repeat(arr, 3, axis=-1)
+    return np.ascontiguousarray(arr)
+
+
+class TiffImage:
+    """Tiled or striped TIFF/BigTIFF read window by window instead of decoded whole.
+
+    Uncompressed levels are numpy memmaps; compressed levels decode only the
+    tiles (or strips) that intersect a window, sliced straight out of an mmap
+    of the file. Pyramid levels (SubIFDs or reduced-resolution pages) are used
+    for downscaled reads.
+    """
+
+    def __init__(self, source):
+        self._tif = tifffile.TiffFile(source)
+        self._path = source if isinstance(source, str) else None
+        self._lock = threading.Lock()
+        self._mm = None
+        if self._path is not None:
+            with open(self._path, "rb") as fh:
+                self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        series = self._tif.series[0]
+        self._levels = list(series.levels)
+        self._memmaps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._memmaps.clear()
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._tif.close()
+
+    @property
+    def level_shapes(self):
+        """(H, W) of every pyramid level, full resolution first."""
+        return [(self._page(i).imagelength, self._page(i).imagewidth) for i in range(len(self._levels))]
+
+    @property
+    def shape(self):
+        return self.level_shapes[0]
+
+    def _page(self, level):
+        return self._levels[level].keyframe
+
+    def _memmap(self, level):
+        if level not in self._memmaps:
+            page = self._page(level)
+            mm = None
+            if self._path is not None and page.is_memmappable and page.planarconfig != 2 and len(self._levels[level].pages) == 1:
+                mm = tifffile.memmap(self._path, series=0, level=level, mode="r")
+            self._memmaps[level] = mm
+        return self._memmaps[level]
+
+    def _segment(self, page, index):
+        offset, count = page.dataoffsets[index], page.databytecounts[index]
+        if not count:
+            return None
+        if self._mm is not None:
+            return self._mm[offset:offset + count]
+        with self._lock:
+            fh = self._tif.filehandle
+            fh.seek(offset)
+            return fh.read(count)
+
+    def _chunk_shape(self, level):
+        page = self._page(level)
+        if self._memmap(level) is not None:
+            return MEMMAP_BLOCK, MEMMAP_BLOCK
+        if page.is_tiled:
+            return page.tilelength, page.tilewidth
+        return min(page.rowsperstrip or page.imagelength, page.imagelength), page.imagewidth
+
+    def read_window(self, y, x, h, w, level=0):
+        """RGB uint8 pixels of the window (y, x, h, w) in ``level`` coordinates."""
+        H, W = self.level_shapes[level]
+        y0, x0 = max(0, y), max(0, x)
+        y1, x1 = min(H, y + h), min(W, x + w)
+        if y1 <= y0 or x1 <= x0:
+            raise ValueError(f"Window {(y, x, h, w)} is outside the {W}x{H} image")
+
+        mm = self._memmap(level)
+        if mm is not None:
+            return to_rgb8(mm[y0:y1, x0:x1])
+
+        page = self._page(level)
+        ch, cw = self._chunk_shape(level)
+        rows, cols = -(-H // ch), -(-W // cw)
+        planes = page.samplesperpixel if page.planarconfig == 2 else 1
+        samples = page.samplesperpixel
+        out = np.zeros((y1 - y0, x1 - x0, samples), dtype=page.dtype)
+        for plane in range(planes):
+            for r in range(y0 // ch, (y1 - 1) // ch + 1):
+                for c in range(x0 // cw, (x1 - 1) // cw + 1):
+                    index = plane * rows * cols + r * cols + c
+                    data = self._segment(page, index)
+                    if data is None:
+                        continue
+                    seg, _, _ = page.decode(data, index, jpegtables=page.jpegtables)
+                    seg = seg[0]  # drop depth
+                    ty, tx = r * ch, c * cw
+                    sy0, sx0 = max(y0, ty), max(x0, tx)
+                    sy1, sx1 = min(y1, ty + seg.shape[0]), min(x1, tx + seg.shape[1])
+                    part = seg[sy0 - ty:sy1 - ty, sx0 - tx:sx1 - tx]
+                    target = out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0]
+                    if planes > 1:
+                        target[..., plane] = part[..., 0]
+                    else:
+                        target[...] = part
+        return to_rgb8(out)
+
+    def best_level(self, max_side):
+        """Smallest pyramid level still at least ``max_side`` on its longest side."""
+        best = 0
+        for i, (h, w) in enumerate(self.level_shapes):
+            if max(h, w) >= max_side:
+                best = i
+        return best
+
+    def read(self, max_side=DEFAULT_MAX_SIDE):
+        """Whole image downscaled to at most ``max_side``, reading one chunk at a time.
+
+        Each tile is resized into its share of the output, so memory stays
+        at one tile plus the output no matter how large the source is.
+        """
+        H, W = self.shape
+        scale = min(1.0, max_side / max(H, W))
+        out_w, out_h = max(1, round(W * scale)), max(1, round(H * scale))
+        level = self.best_level(max(out_w, out_h))
+        lh, lw = self.level_shapes[level]
+        sy, sx = out_h / lh, out_w / lw
+        ch, cw = self._chunk_shape(level)
+
+        out = np.empty((out_h, out_w, 3), dtype=np.uint8)
+        for y in range(0, lh, ch):
+            oy0, oy1 = round(y * sy), round(min(lh, y + ch) * sy)
+            if oy1 <= oy0:
+                continue
+            for x in range(0, lw, cw):
+                ox0, ox1 = round(x * sx), round(min(lw, x + cw) * sx)
+                if ox1 <= ox0:
+                    continue
+                window = self.read_window(y, x, ch, cw, level)
+                if window.shape[:2] == (oy1 - oy0, ox1 - ox0):
+                    out[oy0:oy1, ox0:ox1] = window
+                else:
+                    out[oy0:oy1, ox0:ox1] = cv2.resize(window, (ox1 - ox0, oy1 - oy0), interpolation=cv2.INTER_AREA)
+        return out
+
+
+def read_tiff_rgb(source, max_side=DEFAULT_MAX_SIDE):
+    """Downscaled RGB read of a (Big)TIFF path or binary stream; returns (image, full-resolution (H, W))."""
+    with TiffImage(source) as tif:
+        return tif.read(max_side), tif.shape
@@ -0,0 +1,197 @@
+
+import csv, json, os
+from functools import lru_cache
+import numpy as np
+from skimage.color import rgb2lab
+from sklearn.neighbors import NearestNeighbors
+
+DEFAULT_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "minerals.csv")
+# Mineral map value for pixels no reference is similar enough to
+UNKNOWN = 255
+
+
+def texture_features(contrast, homogeneity):
+    # Same squashing as the anomaly score, so both descriptors lie in [0, 1]
+    contrast = np.asarray(contrast, dtype=np.float32)
+    return np.stack([contrast / (contrast + 5), np.asarray(homogeneity, dtype=np.float32)], axis=-1)
+
+
+def _unit_rows(x):
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+class MineralLibrary:
+    """Reference mineral signatures with a nearest-neighbour index for batched matching.
+
+    ``space="rgb"`` ranks by cosine similarity of mean colour (unit vectors, so
+    Euclidean neighbours are cosine neighbours); ``space="lab"`` ranks by CIE76
+    ΔE and reports ``1 - ΔE / 100``. A positive ``texture_weight`` adds the
+    GLCM contrast/homogeneity descriptors to the distance.
+    """
+
+    def __init__(self, keys, minerals, rgb, texture=None, space="rgb", texture_weight=0.0):
+        if space not in ("rgb", "lab"):
+            raise ValueError(f"Unknown colour space: {space!r}")
+        self.keys = list(keys)
+        self.minerals = list(minerals)
+        self.space = space
+        self.texture_weight = float(texture_weight)
+        self.rgb = np.asarray(rgb, dtype=np.float32).reshape(-1, 3)
+        if not len(self.rgb):
+            raise ValueError("Mineral library is empty")
+
+        if texture is None:
+            texture = np.full((len(self.keys), 2), np.nan, dtype=np.float32)
+        texture = np.asarray(texture, dtype=np.float32).reshape(-1, 2)
+        # References without texture get the library mean, so texture neither helps nor hurts them
+        known = np.isfinite(texture)
+        fill = np.where(known, texture, 0).sum(axis=0) / np.maximum(known.sum(axis=0), 1)
+        self.texture = np.where(known, texture, fill).astype(np.float32)
+
+        self._colour = self._colour_vectors(self.rgb)
+        self._index = NearestNeighbors().fit(self._features(self._colour, self.texture))
+        # Pixels only have a colour, so the per-pixel map searches colour alone
+        self._colour_index = NearestNeighbors().fit(self._colour) if self.texture_weight else self._index
+
+        # Several references can describe one mineral; the map labels minerals, not references
+        self.mineral_names = list(dict.fromkeys(self.minerals))
+        if len(self.mineral_names) >= UNKNOWN:
+            raise ValueError(f"Mineral maps support at most {UNKNOWN - 1} distinct minerals")
+        self._mineral_ids = np.array([self.mineral_names.index(m) for m in self.minerals], dtype=np.uint8)
+        self._luts = {}
+
+    @classmethod
+    def from_colors(cls, refs, **options):
+        """Library from a ``{key: rgb}`` dict such as ``utils.ref_colors``.
+
+        Each key is both the reference key and the mineral name reported by
+        ``match`` and the mineral map, so keys must be non-empty strings.
+        """
+        for key in refs:
+            if not isinstance(key, str) or not key.strip():
+                raise ValueError(f"Mineral names must be non-empty strings, got {key!r}")
+        return cls(list(refs), list(refs), [refs[k] for k in refs], **options)
+
+    @classmethod
+    def from_file(cls, path, **options):
+        """Load a CSV or JSON list of rows: key, mineral, r, g, b (0-1) and optional texture columns."""
+        with open(path, newline="") as fh:
+            rows = json.load(fh) if path.endswith(".json") else list(csv.DictReader(fh))
+
+        def num(row, col):
+            value = row.get(col)
+            return float(value) if value not in (None, "") else np.nan
+
+        raw = np.array([[num(r, "texture_contrast"), num(r, "texture_homogeneity")] for r in rows], dtype=np.float32)
+        return cls(
+            [r["key"] for r in rows],
+            [r.get("mineral") or r["key"] for r in rows],
+            [[float(r["r"]), float(r["g"]), float(r["b"])] for r in rows],
+            texture=texture_features(raw[:, 0], raw[:, 1]) if len(raw) else None,
+            **options,
+        )
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _colour_vectors(self, rgb):
+        if self.space == "lab":
+            return rgb2lab(np.clip(rgb, 0, 1)[None])[0].astype(np.float32)
+        return _unit_rows(rgb)
+
+    def _features(self, colour, texture):
+        if self.texture_weight:
+            return np.hstack([colour, self.texture_weight * texture])
+        return colour
+
+    def _similarity(self, query, refs):
+        if self.space == "lab":
+            return np.clip(1.0 - np.linalg.norm(query - refs, axis=-1) / 100.0, 0.0, 1.0)
+        return np.einsum("...k,...k->...", query, refs)
+
+    def match(self, rgb, texture=None, top_n=3):
+        """Top-N references for every query colour in one index lookup.
+
+        Args:
+            rgb: (M, 3) mean colours in 0-1
+            texture: optional (M, 2) raw (contrast, homogeneity)
+            top_n: candidates per query (at least 1; capped at the library size)
+
+        Returns:
+            list of M lists of {"key", "mineral", "similarity"}, best first
+        """
+        if top_n < 1:
+            raise ValueError(f"top_n must be at least 1, got {top_n}")
+        rgb = np.asarray(rgb, dtype=np.float32).reshape(-1, 3)
+        if not len(rgb):
+            return []
+        n = min(int(top_n), len(self))
+        colour = self._colour_vectors(rgb)
+        if texture is None:
+            tex = np.broadcast_to(self.texture.mean(axis=0), (len(rgb), 2))
+        else:
+            texture = np.asarray(texture, dtype=np.float32).reshape(-1, 2)
+            tex = texture_features(texture[:, 0], texture[:, 1])
+        _, idx = self._index.kneighbors(self._features(colour, tex), n_neighbors=n)
+        sims = self._similarity(colour[:, None, :], self._colour[idx])
+        return [
+            [{"key": self.keys[j], "mineral": self.minerals[j], "similarity": round(float(s), 3)}
+             for j, s in zip(row_idx, row_sims)]
+            for row_idx, row_sims in zip(idx, sims)
+        ]
+
+    def colour_lut(self, bins=32, min_similarity=0.0):
+        """bins³ table from a quantized RGB colour to a mineral id (UNKNOWN below ``min_similarity``)."""
+        key = (bins, float(min_similarity))
+        if key not in self._luts:
+            if bins < 1 or bins > 256 or bins & (bins - 1):
+                raise ValueError("bins must be a power of two between 1 and 256")
+            centres = (np.arange(bins, dtype=np.float32) + 0.5) / bins
+            grid = np.stack(np.meshgrid(centres, centres, centres, indexing="ij"), axis=-1).reshape(-1, 3)
+            colour = self._colour_vectors(grid)
+            _, nearest = self._colour_index.kneighbors(colour, n_neighbors=1)
+            nearest = nearest[:, 0]
+            lut = self._mineral_ids[nearest]
+            if min_similarity > 0:
+                lut[self._similarity(colour, self._colour[nearest]) < min_similarity] = UNKNOWN
+            self._luts[key] = lut
+        return self._luts[key]
+
+    def mineral_map(self, img_rgb, bins=32, min_similarity=0.0, rows_per_block=1024):
+        """Full-resolution uint8 map of mineral ids (see ``mineral_names``) by table lookup."""
+        lut = self.colour_lut(bins, min_similarity)
+        shift = 8 - int(bins).bit_length() + 1
+        bits = 8 - shift
+        dtype = np.uint16 if 3 * bits <= 16 else np.uint32
+        h, w = img_rgb.shape[:2]
+        out = np.empty((h, w), dtype=np.uint8)
+        # Row blocks keep the index buffer small on huge images
+        for y in range(0, h, rows_per_block):
+            block = img_rgb[y:y + rows_per_block]
+            idx = (block[..., 0] >> shift).astype(dtype) << (2 * bits)
+            idx |= (block[..., 1] >> shift).astype(dtype) << bits
+            idx |= block[..., 2] >> shift
+            np.take(lut, idx, out=out[y:y + rows_per_block])
+        return out
+
+    def composition(self, labels):
+        """Fraction of each mineral among ``labels`` (map values), largest first."""
+        labels = np.asarray(labels).ravel()
+        if not labels.size:
+            return {}
+        counts = np.bincount(labels, minlength=UNKNOWN + 1)
+        names = self.mineral_names + ["Unknown"]
+        ids = list(range(len(self.mineral_names))) + [UNKNOWN]
+        fractions = {names[i]: round(float(counts[k] / labels.size), 4) for i, k in enumerate(ids) if counts[k]}
+        return dict(sorted(fractions.items(), key=lambda kv: -kv[1]))
+
+
+@lru_cache(maxsize=4)
+def _load_cached(path, mtime, space, texture_weight):
+    return MineralLibrary.from_file(path, space=space, texture_weight=texture_weight)
+
+
+def load_library(path=None, space="rgb", texture_weight=0.0):
+    """Load a library file once per process; reloaded when the file changes."""
+    path = os.path.abspath(path or DEFAULT_LIBRARY)
+    return _load_cached(path, os.path.getmtime(path), space, float(texture_weight))
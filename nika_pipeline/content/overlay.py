@@ -0,0 +1,79 @@
+
+import cv2, numpy as np
+
+# Zone colours, matching the boxes the dashboard draws (static/js/nika.js)
+ZONE_COLORS = np.array([
+    [255, 107, 107],
+    [78, 205, 196],
+    [69, 183, 209],
+    [150, 206, 180],
+    [254, 202, 87],
+], dtype=np.uint8)
+
+ENCODE_PARAMS = {
+    "webp": lambda q: [cv2.IMWRITE_WEBP_QUALITY, q],
+    "jpg": lambda q: [cv2.IMWRITE_JPEG_QUALITY, q],
+}
+
+
+def fit_size(shape, max_side):
+    h, w = shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def label_map(masks, shape):
+    """uint8 label image: 0 for background, i + 1 where mask i is set (later masks on top)."""
+    labels = np.zeros(shape[:2], dtype=np.uint8)
+    for i, m in enumerate(masks[:255]):
+        m["segmentation"].paste(labels, i + 1)
+    return labels
+
+
+def colour_lut(n_labels, alpha):
+    # Row 0 is the background: no colour, no blending
+    colours = np.zeros((n_labels + 1, 3), dtype=np.float32)
+    colours[1:] = ZONE_COLORS[np.arange(n_labels) % len(ZONE_COLORS)]
+    alphas = np.full(n_labels + 1, alpha, dtype=np.float32)
+    alphas[0] = 0.0
+    return colours, alphas
+
+
+def render_overlay(img_rgb, masks, max_side=2048, alpha=0.45):
+    """Composite the masks onto the image in one blend pass, with contours, at most ``max_side`` px.
+
+    The label map is built at full resolution from the compact masks and then
+    resized, so the blend only touches output-sized arrays.
+    """
+    size = fit_size(img_rgb.shape, max_side)
+    labels = label_map(masks, img_rgb.shape)
+    if size != (img_rgb.shape[1], img_rgb.shape[0]):
+        img_rgb = cv2.resize(img_rgb, size, interpolation=cv2.INTER_AREA)
+        labels = cv2.resize(labels, size, interpolation=cv2.INTER_NEAREST)
+
+    colours, alphas = colour_lut(len(masks), alpha)
+    a = alphas[labels][..., None]
+    out = (img_rgb * (1.0 - a) + colours[labels] * a).astype(np.uint8)
+
+    # Label boundaries: wherever the 3×3 neighbourhood holds more than one label
+    kernel = np.ones((3, 3), np.uint8)
+    outer = cv2.dilate(labels, kernel)
+    edges = outer != cv2.erode(labels, kernel)
+    out[edges] = colours[outer[edges]].astype(np.uint8)
+    return out
+
+
+def thumbnail(img_rgb, max_side=320):
+    return cv2.resize(img_rgb, fit_size(img_rgb.shape, max_side), interpolation=cv2.INTER_AREA)
+
+
+def encode_image(img_rgb, fmt="webp", quality=85):
+    """Compressed bytes of an RGB image; falls back to JPEG if this OpenCV build lacks ``fmt``."""
+    for ext in dict.fromkeys((fmt, "jpg")):
+        try:
+            ok, buf = cv2.imencode(f".{ext}", cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR), ENCODE_PARAMS[ext](quality))
+        except cv2.error:
+            ok = False
+        if ok:
+            return buf.tobytes(), ext
+    raise ValueError(f"Could not encode overlay as {fmt} or jpg")
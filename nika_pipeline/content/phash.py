@@ -0,0 +1,89 @@
+
+import threading
+from array import array
+import cv2, numpy as np
+
+BITS = 64
+
+
+def phash(img_rgb):
+    """64-bit DCT perceptual hash: low-frequency 8×8 coefficients against their median.
+
+    Stable under re-exposure, recompression and small re-framing; the whole
+    image is reduced to 32×32 first, so it costs the same at any resolution.
+    """
+    gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    # The DC term is overall brightness, which is exactly what re-exposure changes
+    bits = low > np.median(low[1:])
+    bits[0] = False
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def to_signed(h):
+    """Unsigned 64-bit hash to the signed range of a database BIGINT (and back with ``to_unsigned``)."""
+    return h - (1 << BITS) if h >= 1 << (BITS - 1) else h
+
+
+def to_unsigned(h):
+    return h + (1 << BITS) if h < 0 else h
+
+
+class MultiIndexHash:
+    """Hamming-radius search over 64-bit hashes with a multi-index hash table.
+
+    The hash is split into ``max_distance + 1`` bit blocks, each with its own
+    exact-match table. Two hashes within ``max_distance`` bits must agree on
+    at least one block (pigeonhole), so a query only verifies the union of its
+    bucket hits, with one vectorised popcount. When the buckets are crowded
+    (large index, wide radius) a flat popcount over every hash is cheaper.
+    """
+
+    def __init__(self, max_distance=10):
+        self.max_distance = int(max_distance)
+        n_blocks = min(BITS, self.max_distance + 1)
+        edges = np.linspace(0, BITS, n_blocks + 1).round().astype(int)
+        self._blocks = [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(edges[:-1], edges[1:])]
+        self._tables = [{} for _ in self._blocks]
+        self._hashes = np.empty(1024, dtype=np.uint64)
+        self._values = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, h, value):
+        with self._lock:
+            i = len(self._values)
+            if i == len(self._hashes):
+                self._hashes = np.concatenate([self._hashes, np.empty_like(self._hashes)])
+            self._hashes[i] = h
+            self._values.append(value)
+            for table, (shift, mask) in zip(self._tables, self._blocks):
+                table.setdefault((h >> shift) & mask, array("q")).append(i)
+
+    def search(self, h, max_distance=None):
+        """All (distance, value) within ``max_distance`` of ``h``, nearest first."""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        with self._lock:
+            n = len(self._values)
+            hits = []
+            if max_distance <= self.max_distance:
+                hits = [table[key] for table, (shift, mask) in zip(self._tables, self._blocks)
+                        if (key := (h >> shift) & mask) in table]
+            if max_distance > self.max_distance or sum(map(len, hits)) > n // 32:
+                # Wider radius than the blocks allow, or buckets too full to pay off: one flat popcount scan
+                candidates = np.arange(n)
+            else:
+                candidates = np.unique(np.concatenate([np.frombuffer(hit, dtype=np.int64) for hit in hits] or [np.empty(0, np.int64)]))
+            if not len(candidates):
+                return []
+            distances = np.bitwise_count(self._hashes[candidates] ^ np.uint64(h))
+            keep = distances <= max_distance
+            order = np.argsort(distances[keep], kind="stable")
+            return [(int(distances[keep][k]), self._values[candidates[keep][k]]) for k in order]
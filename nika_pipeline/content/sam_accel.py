@@ -0,0 +1,163 @@
+
+import logging
+import os
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def bf16_supported():
+    # oneDNN only has fast bf16 kernels on CPUs with AVX512-BF16 / AMX
+    try:
+        return bool(torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configure_threads(intra_op=None, inter_op=None):
+    if intra_op:
+        torch.set_num_threads(int(intra_op))
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(int(inter_op))
+        except RuntimeError:
+            # Can only be set once, before any inter-op parallel work has started
+            pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+class AcceleratedEncoder(torch.nn.Module):
+    """Wraps the SAM image encoder with channels-last input and optional bf16 autocast."""
+
+    def __init__(self, encoder, bf16=False, channels_last=True):
+        super().__init__()
+        self.encoder = encoder
+        self.img_size = encoder.img_size
+        self.bf16 = bf16
+        self.channels_last = channels_last
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.bf16):
+            out = self.encoder(x)
+        # The decoder and SAM's post-processing expect fp32 embeddings
+        return out.float()
+
+
+class AcceleratedDecoder(torch.nn.Module):
+    """Wraps the SAM mask decoder (run once per point batch) with optional bf16 autocast.
+
+    The prompt encoder stays fp32: it is a few embeddings and a random-Fourier
+    positional encoding of pixel coordinates, which bf16 would quantize to a
+    few pixels while saving no measurable time.
+    """
+
+    def __init__(self, decoder, bf16=False):
+        super().__init__()
+        self.decoder = decoder
+        self.bf16 = bf16
+
+    def forward(self, *args, **kwargs):
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.bf16):
+            masks, iou_predictions = self.decoder(*args, **kwargs)
+        # Thresholding and stability scores are computed on fp32 logits
+        return masks.float(), iou_predictions.float()
+
+
+def accelerate_model(model, bf16=False, channels_last=True, compile=False):
+    """Prepare a CPU SAM model for inference; returns the effective settings."""
+    bf16 = bf16 and bf16_supported()
+    model.eval()
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    model.image_encoder = AcceleratedEncoder(model.image_encoder, bf16=bf16, channels_last=channels_last)
+    model.mask_decoder = AcceleratedDecoder(model.mask_decoder, bf16=bf16)
+    compiled = False
+    if compile and hasattr(torch, "compile"):
+        try:
+            model.image_encoder = torch.compile(model.image_encoder)
+            compiled = True
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable, staying eager: {e}")
+    return {"bf16": bf16, "channels_last": channels_last, "compiled": compiled}
+
+
+def warm_up(model):
+    """Run one dummy encoder pass so compilation happens at load time, not in a request.
+
+    Returns False if the compiled encoder failed and the eager one was restored.
+    """
+    size = model.image_encoder.img_size
+    dummy = torch.zeros(1, 3, size, size, device=model.device)
+    with inference_context():
+        try:
+            model.image_encoder(dummy)
+            return True
+        except Exception as e:
+            if not hasattr(model.image_encoder, "_orig_mod"):
+                raise
+            logger.warning(f"Compiled SAM encoder failed at warm-up, staying eager: {e}")
+            model.image_encoder = model.image_encoder._orig_mod
+            model.image_encoder(dummy)
+            return False
+
+
+def inference_context():
+    return torch.inference_mode()
+
+
+def quantized_checkpoint_path(checkpoint, model_type):
+    # Size and mtime of the fp32 checkpoint are part of the name, so replacing it invalidates the cache
+    stat = os.stat(checkpoint)
+    root, _ = os.path.splitext(str(checkpoint))
+    return f"{root}.{model_type}.{stat.st_size:x}-{stat.st_mtime_ns:x}.int8.pt"
+
+
+def quantize_encoder(model):
+    # Dynamic INT8: Linear weights stored as int8, activations quantized per batch at runtime
+    model.image_encoder = torch.ao.quantization.quantize_dynamic(
+        model.image_encoder, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return model
+
+
+def _remove_stale(checkpoint, model_type, keep):
+    root, _ = os.path.splitext(str(checkpoint))
+    prefix = f"{os.path.basename(root)}.{model_type}."
+    folder = os.path.dirname(root) or "."
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.startswith(prefix) and name.endswith(".int8.pt") and path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def load_quantized_model(checkpoint, model_type, build):
+    """Return a SAM model with an INT8 encoder, quantizing and persisting it on first use.
+
+    ``build(checkpoint)`` makes the fp32 model, from ``checkpoint`` or, given None,
+    with untrained weights. Only the quantized state_dict is saved; later starts
+    quantize an untrained model and load the saved weights into it (with
+    weights_only, so the file cannot run code), never reading the fp32 checkpoint.
+    """
+    path = quantized_checkpoint_path(checkpoint, model_type)
+    if os.path.exists(path):
+        model = quantize_encoder(build(None).to("cpu").eval())
+        try:
+            model.load_state_dict(torch.load(path, map_location="cpu", weights_only=True))
+            return model, path
+        except Exception as e:
+            logger.warning(f"Quantized SAM at {path} is unreadable, quantizing again: {e}")
+    model = quantize_encoder(build(checkpoint).to("cpu").eval())
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        torch.save(model.state_dict(), tmp)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not persist quantized SAM to {path}, it will be rebuilt next start: {e}")
+        return model, None
+    _remove_stale(checkpoint, model_type, keep=path)
+    return model, path
@@ -0,0 +1,59 @@
+
+import gc, time
+import numpy as np
+import utils as sam_utils
+from sam_accel import inference_context
+
+
+def mask_agreement(reference, candidate):
+    """Best-match IoU of every reference mask against the candidate masks: (mean, min)."""
+    if not reference:
+        return (1.0, 1.0) if not candidate else (0.0, 0.0)
+    best = [
+        max((r['segmentation'].iou(c['segmentation']) for c in candidate), default=0.0)
+        for r in reference
+    ]
+    return float(np.mean(best)), float(np.min(best))
+
+
+def benchmark_modes(checkpoint, model_type, images, modes, repeats=1):
+    """Time each inference mode on the same RGB images and compare masks to the first mode.
+
+    ``modes`` maps a label to build_sam options; models are built one at a time
+    so only one copy of the weights is resident.
+    """
+    rows, reference = [], None
+    for name, options in modes.items():
+        t0 = time.perf_counter()
+        model, mask_gen, info = sam_utils.build_sam(checkpoint, model_type, **options)
+        load_s = time.perf_counter() - t0
+
+        encode_s, total_s, outputs = [], [], []
+        for img in images:
+            for _ in range(repeats):
+                with inference_context():
+                    t0 = time.perf_counter()
+                    mask_gen.predictor.set_image(img)
+                    encode_s.append(time.perf_counter() - t0)
+                    mask_gen.predictor.reset_image()
+                    t0 = time.perf_counter()
+                    masks = mask_gen.generate(img)
+                    total_s.append(time.perf_counter() - t0)
+            outputs.append(sam_utils.compact_masks(masks))
+
+        if reference is None:
+            reference = outputs
+        agreement = [mask_agreement(r, o) for r, o in zip(reference, outputs)]
+        rows.append({
+            "mode": name,
+            "info": info,
+            "load_s": round(load_s, 3),
+            "encoder_ms": round(1000 * float(np.median(encode_s)), 1),
+            "generate_ms": round(1000 * float(np.median(total_s)), 1),
+            "masks": int(np.mean([len(o) for o in outputs])),
+            "mean_iou": round(float(np.mean([a[0] for a in agreement])), 4),
+            "min_iou": round(float(np.min([a[1] for a in agreement])), 4),
+        })
+        del model, mask_gen
+        gc.collect()
+    return rows
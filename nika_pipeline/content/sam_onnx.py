@@ -0,0 +1,163 @@
+
+import json, os
+from types import SimpleNamespace
+import numpy as np
+import torch
+import torch.nn.functional as F
+from segment_anything import sam_model_registry
+from segment_anything.utils.onnx import SamOnnxModel
+from segment_anything.utils.transforms import ResizeLongestSide
+
+ENCODER_FILE = "sam_encoder.onnx"
+DECODER_FILE = "sam_decoder.onnx"
+META_FILE = "sam_onnx.json"
+
+# Sam.pixel_mean / pixel_std, applied before padding like Sam.preprocess
+PIXEL_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+PIXEL_STD = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+
+
+class LowResDecoder(SamOnnxModel):
+    """Prompt encoder + mask decoder only; upscaling stays outside the graph.
+
+    SamOnnxModel's upscaling crops by a size the tracer freezes to the dummy
+    input, so it would be wrong for any other image size.
+    """
+
+    def forward(self, image_embeddings, point_coords, point_labels, mask_input, has_mask_input):
+        sparse_embedding = self._embed_points(point_coords, point_labels)
+        dense_embedding = self._embed_masks(mask_input, has_mask_input)
+        low_res_masks, iou_predictions = self.model.mask_decoder.predict_masks(
+            image_embeddings=image_embeddings,
+            image_pe=self.model.prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embedding,
+            dense_prompt_embeddings=dense_embedding,
+        )
+        return low_res_masks, iou_predictions
+
+
+def export_onnx(checkpoint, model_type, out_dir, opset=17):
+    """Write the SAM image encoder and prompt/mask decoder to ``out_dir`` as ONNX."""
+    os.makedirs(out_dir, exist_ok=True)
+    model = sam_model_registry[model_type](checkpoint=checkpoint).eval()
+    img_size = model.image_encoder.img_size
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model.image_encoder,
+            torch.randn(1, 3, img_size, img_size),
+            os.path.join(out_dir, ENCODER_FILE),
+            input_names=["image"],
+            output_names=["image_embeddings"],
+            opset_version=opset,
+            dynamo=False,
+        )
+
+        # All four mask tokens are returned; the predictor picks multimask/single like SamPredictor
+        decoder = LowResDecoder(model, return_single_mask=False)
+        embed_dim = model.prompt_encoder.embed_dim
+        embed_size = model.prompt_encoder.image_embedding_size
+        mask_size = [4 * x for x in embed_size]
+        dummy = {
+            "image_embeddings": torch.randn(1, embed_dim, *embed_size),
+            "point_coords": torch.randint(0, img_size, (2, 2, 2), dtype=torch.float),
+            "point_labels": torch.randint(0, 2, (2, 2), dtype=torch.float),
+            "mask_input": torch.zeros(1, 1, *mask_size),
+            "has_mask_input": torch.tensor([0], dtype=torch.float),
+        }
+        torch.onnx.export(
+            decoder,
+            tuple(dummy.values()),
+            os.path.join(out_dir, DECODER_FILE),
+            input_names=list(dummy.keys()),
+            output_names=["low_res_masks", "iou_predictions"],
+            dynamic_axes={
+                "point_coords": {0: "batch", 1: "num_points"},
+                "point_labels": {0: "batch", 1: "num_points"},
+                "low_res_masks": {0: "batch"},
+                "iou_predictions": {0: "batch"},
+            },
+            opset_version=opset,
+            dynamo=False,
+        )
+
+    meta = {"model_type": model_type, "img_size": img_size, "mask_threshold": float(model.mask_threshold)}
+    with open(os.path.join(out_dir, META_FILE), "w") as fh:
+        json.dump(meta, fh)
+    return meta
+
+
+class OnnxPredictor:
+    """Drop-in for SamPredictor inside SamAutomaticMaskGenerator, backed by ONNX Runtime."""
+
+    def __init__(self, onnx_dir, threads=None):
+        import onnxruntime as ort
+
+        with open(os.path.join(onnx_dir, META_FILE)) as fh:
+            self.meta = json.load(fh)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = int(threads)
+        providers = ["CPUExecutionProvider"]
+        self.encoder = ort.InferenceSession(os.path.join(onnx_dir, ENCODER_FILE), opts, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(onnx_dir, DECODER_FILE), opts, providers=providers)
+
+        img_size = self.meta["img_size"]
+        # Only the attributes SamAutomaticMaskGenerator reads from a Sam model
+        self.model = SimpleNamespace(
+            mask_threshold=self.meta["mask_threshold"],
+            image_encoder=SimpleNamespace(img_size=img_size),
+        )
+        self.transform = ResizeLongestSide(img_size)
+        self.device = torch.device("cpu")
+        self.reset_image()
+
+    def set_image(self, image, image_format="RGB"):
+        if image_format == "BGR":
+            image = image[..., ::-1]
+        img_size = self.meta["img_size"]
+        resized = self.transform.apply_image(image)
+        x = (resized.astype(np.float32) - PIXEL_MEAN) / PIXEL_STD
+        padded = np.zeros((img_size, img_size, 3), dtype=np.float32)
+        padded[:x.shape[0], :x.shape[1]] = x
+        self.features = self.encoder.run(None, {"image": padded.transpose(2, 0, 1)[None]})[0]
+        self.original_size = image.shape[:2]
+        self.input_size = resized.shape[:2]
+        self.is_image_set = True
+
+    def reset_image(self):
+        self.is_image_set = False
+        self.features = None
+        self.original_size = None
+        self.input_size = None
+
+    def predict_torch(self, point_coords, point_labels, boxes=None, mask_input=None,
+                      multimask_output=True, return_logits=False):
+        coords = point_coords.cpu().numpy().astype(np.float32)
+        labels = point_labels.cpu().numpy().astype(np.float32)
+        # SamPredictor's prompt encoder appends a padding point when no box is given
+        n = coords.shape[0]
+        coords = np.concatenate([coords, np.zeros((n, 1, 2), dtype=np.float32)], axis=1)
+        labels = np.concatenate([labels, -np.ones((n, 1), dtype=np.float32)], axis=1)
+        mask_size = [4 * s for s in self.features.shape[-2:]]
+        low_res, iou_preds = self.decoder.run(None, {
+            "image_embeddings": self.features,
+            "point_coords": coords,
+            "point_labels": labels,
+            "mask_input": np.zeros((1, 1, *mask_size), dtype=np.float32),
+            "has_mask_input": np.zeros(1, dtype=np.float32),
+        })
+        picked = slice(1, None) if multimask_output else slice(0, 1)
+        low_res = torch.from_numpy(low_res[:, picked])
+        masks = self.postprocess_masks(low_res)
+        if not return_logits:
+            masks = masks > self.model.mask_threshold
+        return masks, torch.from_numpy(iou_preds[:, picked]), low_res
+
+    def postprocess_masks(self, masks):
+        # Same as Sam.postprocess_masks: upscale, drop the padding, resize to the original image
+        img_size = self.meta["img_size"]
+        masks = F.interpolate(masks, (img_size, img_size), mode="bilinear", align_corners=False)
+        masks = masks[..., :self.input_size[0], :self.input_size[1]]
+        return F.interpolate(masks, self.original_size, mode="bilinear", align_corners=False)
@@ -1,60 +1,271 @@
 
-import os, cv2, numpy as np, torch, math
-from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
+import io, os, cv2, numpy as np, torch, math
+from segment_anything import sam_model_registry, SamAutomaticMaskGenerator, SamPredictor
+from segment_anything.utils.amg import calculate_stability_score
 from skimage.measure import perimeter
 from skimage.feature import graycomatrix, graycoprops
-from sklearn.metrics.pairwise import cosine_similarity
+from compact_mask import CompactMask
+from sam_accel import accelerate_model, configure_threads, inference_context, load_quantized_model, warm_up
+from inference_server import SamClient
+from mineral_library import MineralLibrary
+import large_image
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 MODEL = None
 MASK_GEN = None
+MODEL_INFO = {}
+CLIENT = None
 
-def load_model_once(checkpoint="sam_vit_h.pth", model_type="vit_h"):
-    global MODEL, MASK_GEN
-    if MODEL is None:
-        MODEL = sam_model_registry[model_type](checkpoint=checkpoint).to(DEVICE)
-        MASK_GEN = SamAutomaticMaskGenerator(MODEL)
+# Rough peak encoder memory per 1024×1024 image (activations + attention maps)
+ENCODER_BYTES_PER_IMAGE = {"vit_h": 5 << 30, "vit_l": 4 << 30, "vit_b": 3 << 30}
+MAX_ENCODER_BATCH = 8
+
+class EmbeddingPredictor(SamPredictor):
+    """SamPredictor that can take an image embedding computed elsewhere (e.g. in a batch)."""
+
+    def __init__(self, model):
+        super().__init__(model)
+        self._pending = None
+
+    def preset(self, features, original_size, input_size):
+        self._pending = (features, tuple(original_size), tuple(input_size))
+
+    def set_image(self, image, image_format="RGB"):
+        pending, self._pending = self._pending, None
+        if pending is not None and tuple(image.shape[:2]) == pending[1]:
+            self.reset_image()
+            self.features, self.original_size, self.input_size = pending
+            self.is_image_set = True
+            return
+        super().set_image(image, image_format)
+
+def build_sam(checkpoint, model_type="vit_h", cpu_accel=False, bf16=False, compile=False,
+              threads=None, interop_threads=None, quantize=False, backend="torch", onnx_dir=None):
+    """Build a SAM model and mask generator; returns (model, mask_gen, info)."""
+    if backend == "onnx":
+        return build_onnx_sam(onnx_dir, threads=threads)
+    info = {"model_type": model_type, "device": DEVICE, "backend": "torch", "cpu_accel": False, "quantized": False}
+    if quantize and DEVICE == "cpu":
+        # INT8 dynamic quantization only has CPU kernels
+        model, info["quantized_checkpoint"] = load_quantized_model(
+            checkpoint, model_type, lambda ckpt: sam_model_registry[model_type](checkpoint=ckpt))
+        info["quantized"] = True
+    else:
+        model = sam_model_registry[model_type](checkpoint=checkpoint).to(DEVICE)
+    if cpu_accel and DEVICE == "cpu":
+        info["threads"] = configure_threads(threads, interop_threads)
+        # Quantized linears take fp32 activations, so bf16 autocast is off for INT8
+        info.update(accelerate_model(model, bf16=bf16 and not info["quantized"], compile=compile))
+        info["compiled"] = warm_up(model) and info["compiled"]
+        info["cpu_accel"] = True
+    # RLE output keeps SAM from expanding every mask to a dense H×W array
+    mask_gen = SamAutomaticMaskGenerator(model, output_mode="uncompressed_rle")
+    mask_gen.predictor = EmbeddingPredictor(model)
+    return model, mask_gen, info
+
+def build_onnx_sam(onnx_dir, threads=None):
+    # Encoder and decoder run in ONNX Runtime; the generator's point grid / NMS logic is reused as is
+    from sam_onnx import OnnxPredictor
+    predictor = OnnxPredictor(onnx_dir, threads=threads)
+    mask_gen = SamAutomaticMaskGenerator(predictor.model, output_mode="uncompressed_rle")
+    mask_gen.predictor = predictor
+    info = {"model_type": predictor.meta["model_type"], "device": "cpu", "backend": "onnx",
+            "cpu_accel": False, "quantized": False}
+    return None, mask_gen, info
+
+def load_model_once(checkpoint="sam_vit_h.pth", model_type="vit_h", **options):
+    global MODEL, MASK_GEN, MODEL_INFO
+    if MASK_GEN is None:
+        MODEL, MASK_GEN, MODEL_INFO = build_sam(checkpoint, model_type, **options)
     return MASK_GEN
 
-def run_sam_on_image(img_path, max_masks=50):
+def connect_server(address, authkey):
+    """Send segmentation to a shared SAM server instead of loading a model in this process."""
+    global CLIENT, MODEL_INFO
+    if CLIENT is None:
+        client = SamClient(address, authkey)
+        MODEL_INFO = dict(client.info(), server=str(address))
+        CLIENT = client
+    return CLIENT
+
+def compact_masks(masks):
+    # Swap each RLE segmentation for a CompactMask, one mask at a time
+    for m in masks:
+        seg = m['segmentation']
+        if isinstance(seg, dict):
+            m['segmentation'] = CompactMask.from_rle(seg)
+        elif isinstance(seg, np.ndarray):
+            m['segmentation'] = CompactMask.from_dense(seg)
+    return masks
+
+def segment_image(img_rgb, max_masks=50):
+    # Local model path; also what the SAM server runs for each request
     mask_gen = load_model_once()
-    img_bgr = cv2.imread(img_path)
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    masks = mask_gen.generate(img_rgb)
+    with inference_context():
+        masks = mask_gen.generate(img_rgb)
+    return compact_masks(masks)
+
+def segment_at_points(img_rgb, points):
+    """Segment the object at each (x, y) of ``points``; mask records like segment_image(), in point order.
+
+    Warm start for an image close to one analysed before: its zone centres are
+    the prompts, instead of the generator's 32×32 point grid with its decoder
+    passes and NMS. With a shared server the prompts are run there.
+    """
+    if CLIENT is not None:
+        return CLIENT.segment_at_points(img_rgb, points)
+    predictor = load_model_once().predictor
+    threshold = predictor.model.mask_threshold
+    with inference_context():
+        predictor.set_image(img_rgb)
+        coords = predictor.transform.apply_coords(np.asarray(points, dtype=float), img_rgb.shape[:2])
+        coords = torch.as_tensor(coords, dtype=torch.float, device=predictor.device)[:, None, :]
+        labels = torch.ones(coords.shape[:2], dtype=torch.int, device=predictor.device)
+        logits, iou_preds, _ = predictor.predict_torch(coords, labels, multimask_output=True, return_logits=True)
+        masks = []
+        for point, mask_logits, ious in zip(points, logits, iou_preds):
+            # Of SAM's three candidates per prompt, keep the one it is most sure of
+            best = int(torch.argmax(ious))
+            seg = CompactMask.from_dense((mask_logits[best] > threshold).cpu().numpy())
+            x0, y0, x1, y1 = seg.bbox
+            masks.append({
+                "segmentation": seg,
+                "area": seg.area,
+                "bbox": [x0, y0, x1 - x0 + 1, y1 - y0 + 1],
+                "predicted_iou": float(ious[best]),
+                "point_coords": [[float(point[0]), float(point[1])]],
+                "stability_score": float(calculate_stability_score(mask_logits[best:best + 1], threshold, 1.0)[0]),
+                "crop_box": [0, 0, img_rgb.shape[1], img_rgb.shape[0]],
+            })
     return masks
 
-def metrics_dashboard(img_path, masks, refs=None, max_masks=10):
-    img = cv2.cvtColor(cv2.imread(img_path), cv2.COLOR_BGR2RGB)
+def decode_image_rgb(buf, max_side=None):
+    """Decode encoded image bytes (bytes, memoryview or uint8 array) to RGB, converting in place.
+
+    (Big)TIFFs are read tile by tile and downscaled to ``max_side``.
+    """
+    if large_image.is_tiff(buf[:4]):
+        return large_image.read_tiff_rgb(io.BytesIO(buf), max_side or large_image.DEFAULT_MAX_SIDE)[0]
+    img = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+
+def read_image_rgb(img_path, max_side=None):
+    # The encoded file is mapped, not read into a Python bytes copy
+    try:
+        buf = np.memmap(img_path, dtype=np.uint8, mode="r")
+        if large_image.is_tiff(buf[:4]):
+            return large_image.read_tiff_rgb(img_path, max_side or large_image.DEFAULT_MAX_SIDE)[0]
+        return decode_image_rgb(buf)
+    except ValueError as e:
+        raise ValueError(f"Could not read image: {img_path}") from e
+
+def run_sam_on_image(img_path, max_masks=50):
+    img_rgb = img_path if isinstance(img_path, np.ndarray) else read_image_rgb(img_path)
+    if CLIENT is not None:
+        return CLIENT.segment(img_rgb, max_masks)
+    return segment_image(img_rgb, max_masks)
+
+def encoder_batch_size(model_type=None, max_batch=MAX_ENCODER_BATCH):
+    """How many images fit through the encoder at once, from the memory free right now."""
+    model_type = model_type or MODEL_INFO.get("model_type", "vit_h")
+    per_image = ENCODER_BYTES_PER_IMAGE.get(model_type, ENCODER_BYTES_PER_IMAGE["vit_h"])
+    try:
+        if DEVICE == "cuda":
+            free, _ = torch.cuda.mem_get_info()
+        else:
+            free = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError, RuntimeError):
+        return 1
+    # Leave half of the free memory for the decoder and the rest of the process
+    return max(1, min(max_batch, int(free // 2 // per_image)))
+
+@torch.inference_mode()
+def encode_images(images_rgb):
+    # One encoder forward for the whole batch; preprocess pads every image to the same square
+    predictor = MASK_GEN.predictor
+    tensors, sizes = [], []
+    for img in images_rgb:
+        resized = predictor.transform.apply_image(img)
+        t = torch.as_tensor(resized, device=predictor.device).permute(2, 0, 1).contiguous()[None]
+        sizes.append((img.shape[:2], tuple(t.shape[-2:])))
+        tensors.append(MODEL.preprocess(t))
+    features = MODEL.image_encoder(torch.cat(tensors))
+    return features, sizes
+
+def run_sam_on_images(images, batch_size=None):
+    """Segment a queue of images (paths or RGB arrays), batching the encoder.
+
+    Yields ``(img_rgb, masks)`` per image in input order; the mask decoder runs
+    per image on the cached embedding.
+    """
+    if CLIENT is not None or not isinstance(load_model_once().predictor, EmbeddingPredictor):
+        # The shared server and backends without a torch encoder (ONNX) take one image at a time
+        for img in images:
+            if not isinstance(img, np.ndarray):
+                img = read_image_rgb(img)
+            masks = CLIENT.segment(img) if CLIENT is not None else segment_image(img)
+            yield img, masks
+        return
+    mask_gen = load_model_once()
+    batch_size = batch_size or encoder_batch_size()
+    images = iter(images)
+    while True:
+        batch = []
+        for img in images:
+            if not isinstance(img, np.ndarray):
+                img = read_image_rgb(img)
+            batch.append(img)
+            if len(batch) == batch_size:
+                break
+        if not batch:
+            return
+        features, sizes = encode_images(batch)
+        for i, img_rgb in enumerate(batch):
+            mask_gen.predictor.preset(features[i:i + 1], *sizes[i])
+            with inference_context():
+                masks = mask_gen.generate(img_rgb)
+            yield img_rgb, compact_masks(masks)
+        del features
+
+def metrics_dashboard(img_path, masks, refs=None, max_masks=10, top_n=3):
+    """Per-segment shape, colour and texture metrics plus mineral matches.
+
+    ``refs`` is a MineralLibrary or a ``{key: rgb}`` dict like ``ref_colors``;
+    all segments are matched against it in one batched lookup.
+    """
+    if isinstance(refs, dict):
+        refs = MineralLibrary.from_colors(refs) if refs else None
+    if isinstance(img_path, np.ndarray):
+        img = img_path
+    else:
+        img = read_image_rgb(img_path)
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
     H, W, _ = img.shape
-    outputs = []
+    outputs, base_scores = [], []
     for i, m in enumerate(masks[:max_masks]):
         seg = m['segmentation']
-        if seg.sum() == 0: continue
+        if not isinstance(seg, CompactMask):
+            seg = CompactMask.from_dense(seg)
+        if seg.area == 0: continue
 
         # area ratio
-        area_ratio = seg.sum() / (H * W)
+        area_ratio = seg.area / (H * W)
 
-        # compactness
+        # compactness (zero border keeps the cropped perimeter identical)
         try:
-            per = perimeter(seg, neighborhood=8)
-            comp = (4 * math.pi * seg.sum()) / (per**2 + 1e-6)
+            per = perimeter(np.pad(seg.crop(), 1), neighborhood=8)
+            comp = (4 * math.pi * seg.area) / (per**2 + 1e-6)
         except Exception:
             comp = 0.0
 
         # mean color
-        mean_color = img[seg].mean(axis=0) / 255.0
-
-        # color similarity
-        sim_scores = {}
-        if refs:
-            for name, ref_rgb in refs.items():
-                sim = cosine_similarity([mean_color], [ref_rgb])[0,0]
-                sim_scores[name] = round(float(sim), 3)
+        mean_color = seg.gather(img).mean(axis=0) / 255.0
 
         # texture
         try:
-            gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-            mask_gray = gray[seg]
+            mask_gray = seg.gather(gray)
             levels = (mask_gray / 32).astype(np.uint8)
             if len(levels) < 2:
                 contrast, homogeneity = 0.0, 0.0
@@ -70,11 +281,10 @@ def metrics_dashboard(img_path, masks, refs=None, max_masks=10):
         except Exception:
             contrast, homogeneity = 0.0, 0.0
 
-        # anomaly score
-        score = (
+        # anomaly score, without the colour term until the batch is matched
+        base_scores.append(
             min(area_ratio*5, 1.0) * 0.2 +
             min(comp, 1.0) * 0.2 +
-            (max(sim_scores.values()) * 0.3 if sim_scores else 0) +
             (contrast / (contrast+5)) * 0.15 +
             homogeneity * 0.15
         )
@@ -84,11 +294,29 @@ def metrics_dashboard(img_path, masks, refs=None, max_masks=10):
             "area_%": round(area_ratio*100,2),
             "compactness": round(comp,3),
             "mean_color": [round(c,3) for c in mean_color],
-            "color_sims": sim_scores,
+            "_mean_color": mean_color,
+            "color_sims": {},
+            "mineral_matches": [],
             "texture_contrast": round(contrast,3),
             "texture_homogeneity": round(homogeneity,3),
-            "anomaly_score": round(score*100,2)
         })
+
+    # color similarity: every segment against the whole library at once
+    if refs is not None and outputs:
+        matches = refs.match(
+            [o["_mean_color"] for o in outputs],
+            texture=[(o["texture_contrast"], o["texture_homogeneity"]) for o in outputs],
+            top_n=top_n,
+        )
+        for o, candidates in zip(outputs, matches):
+            o["mineral_matches"] = candidates
+            o["color_sims"] = {c["key"]: c["similarity"] for c in candidates}
+
+    for o, score in zip(outputs, base_scores):
+        del o["_mean_color"]
+        if o["color_sims"]:
+            score += max(o["color_sims"].values()) * 0.3
+        o["anomaly_score"] = round(score*100,2)
     return outputs
 
 ref_colors = {
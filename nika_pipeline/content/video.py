@@ -0,0 +1,93 @@
+
+import cv2
+
+# Width frames are reduced to for scene and blur scoring
+SCORE_WIDTH = 320
+
+
+def video_info(cap):
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    return {
+        "fps": round(fps, 3),
+        "frame_count": frames,
+        "duration": round(frames / fps, 2) if frames else None,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+
+
+def frame_scores(frame_bgr):
+    """(HSV colour histogram, Laplacian-variance sharpness) of a frame, on a SCORE_WIDTH copy."""
+    h, w = frame_bgr.shape[:2]
+    small = cv2.resize(frame_bgr, (SCORE_WIDTH, max(1, round(h * SCORE_WIDTH / w))), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+    cv2.normalize(hist, hist, 1.0, 0.0, cv2.NORM_L1)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return hist, float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+def keyframes(path, sample_fps=2.0, scene_threshold=0.4, min_scene_seconds=1.0, max_keyframes=50, info=None):
+    """Stream a video and yield the sharpest sampled frame of every scene.
+
+    Frames are decoded one at a time; off-sample frames are only grabbed.
+    A scene ends when the colour histogram of a sample moves more than
+    ``scene_threshold`` (Bhattacharyya distance) from the scene's first
+    sample. Only the best candidate of the current scene is kept in memory.
+
+    Args:
+        path: Video file path (anything cv2.VideoCapture opens)
+        sample_fps: Frames per second scored
+        scene_threshold: Histogram distance that starts a new scene
+        min_scene_seconds: Shorter scenes are merged into the current one
+        max_keyframes: Stop after this many scenes
+        info: Optional dict filled with video_info() plus frames scored
+
+    Yields:
+        dict: frame, time, image (RGB), sharpness, scene_change, scene_start, scene_end
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video: {path}")
+    meta = video_info(cap)
+    if info is not None:
+        info.update(meta)
+    fps = meta["fps"]
+    step = max(1, round(fps / sample_fps))
+
+    scene_hist, best, emitted, scored, index = None, None, 0, 0, -1
+    try:
+        while emitted < max_keyframes:
+            index += 1
+            if index % step:
+                if not cap.grab():
+                    break
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                break
+            scored += 1
+            t = index / fps
+            hist, sharp = frame_scores(frame)
+            change = 1.0 if scene_hist is None else float(cv2.compareHist(scene_hist, hist, cv2.HISTCMP_BHATTACHARYYA))
+
+            if scene_hist is not None and change > scene_threshold and t - best["scene_start"] >= min_scene_seconds:
+                yield best
+                emitted += 1
+                scene_hist, best = None, None
+                if emitted >= max_keyframes:
+                    break
+            if scene_hist is None:
+                scene_hist = hist
+                best = {"sharpness": -1.0, "scene_start": round(t, 3), "scene_change": round(change, 3)}
+            best["scene_end"] = round(t, 3)
+            if sharp > best["sharpness"]:
+                best.update(frame=index, time=round(t, 3), sharpness=round(sharp, 2),
+                            image=cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if best is not None and emitted < max_keyframes:
+            yield best
+    finally:
+        cap.release()
+        if info is not None:
+            info["frames_scored"] = scored
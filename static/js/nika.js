@@ -712,6 +712,12 @@ class ImageAnalysisManager {
             this.canvas.style.display = 'none';
         }
         
+        // Server-rendered mask overlay, when the analysis produced one
+        const overlayImage = document.getElementById('overlay-image');
+        if (overlayImage) {
+            overlayImage.style.display = this.overlayVisible ? 'block' : 'none';
+        }
+        
         // Update button icon and text
         const toggleBtn = document.getElementById('toggle-overlay');
         const icon = toggleBtn.querySelector('i');